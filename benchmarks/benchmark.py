@@ -0,0 +1,302 @@
+# Benchmarks for every pipeline stage on synthetic data
+# No API key or downloaded data is needed: Materials Project traffic goes to
+# benchmarks/synthetic.py's in-process FakeMPRester and all tables are
+# generated. Stages and what they time:
+#   get_data   full sync of n summary docs, a resync with 5% updated, export
+#   featurize  Magpie featurization of n formulas, uncached and through the cache
+#   train      fitting both random forests on n materials
+#   score      streaming screen of a candidate space of ~n rows
+#   pareto     2-D and 3-D fronts of n points and the optimality score
+#   novelty    known-formula check of n candidates, cold and from the index
+#   relax      a short CHGNet relaxation of Nb2SiC (skipped without chgnet)
+# Results go to benchmarks/results/<timestamp>.json, --compare flags stages
+# that got slower than a previous results file.
+#
+#   python benchmarks/benchmark.py --sizes 1000 10000 --stages featurize score
+#   python benchmarks/benchmark.py --compare benchmarks/results/<old>.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings('ignore')
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+from benchmarks.synthetic import FakeMPRester, materials_table, random_formulas, summary_docs
+from data.get_data import export_cleaned, sync
+from models.model_selection import load_params, make_classifier, make_regressor
+from utils.feature_cache import FeatureCache
+from utils.magpie import MagpieFeaturizer
+from utils.novelty import KnownFormulaIndex
+from utils.pareto import pareto_front, pareto_mask, pareto_optimality_score
+from utils.screening import CandidateSpace, screen
+
+RESULTS_DIR = os.path.join(project_root, 'benchmarks', 'results')
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# largest size each stage runs at by default, training and the API-bound
+# stages get impractically slow long before a million rows
+STAGE_LIMITS = {
+    'get_data': 100_000,
+    'featurize': 1_000_000,
+    'train': 10_000,
+    'score': 1_000_000,
+    'pareto': 1_000_000,
+    'novelty': 100_000,
+    'relax': None,
+}
+M_list = ['Ti', 'V', 'Cr', 'Zr', 'Nb', 'Mo', 'Hf', 'Ta', 'W']
+A_list = ['Al', 'Si', 'P', 'S', 'Ga', 'Ge', 'In', 'Sn']
+X_list = ['C', 'N', 'B']
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        return False
+
+
+def candidate_space(n):
+    """Default screening space with a fraction grid sized to give roughly n candidates."""
+    pure = len(CandidateSpace(M_list, A_list, X_list))
+    per_fraction = len(CandidateSpace(M_list, A_list, X_list, fractions=[0.5])) - pure
+    n_fractions = max(0, round((n - pure) / per_fraction))
+    fractions = np.linspace(0, 1, n_fractions + 2)[1:-1]
+    return CandidateSpace(M_list, A_list, X_list, fractions=fractions)
+
+
+class Context:
+    """Shared setup: temporary directory and a small pair of trained models."""
+
+    def __init__(self, workdir, n_jobs):
+        self.workdir = workdir
+        self.n_jobs = n_jobs
+        self.featurizer = MagpieFeaturizer()
+        self._models = None
+
+    def models(self):
+        if self._models is None:
+            table = materials_table(2_000, seed=1)
+            X = pd.DataFrame(self.featurizer.featurize_many(table['formula']),
+                             columns=self.featurizer.feature_labels())
+            params = load_params()
+            model = make_regressor(params['regressor'], n_jobs=self.n_jobs)
+            model.fit(X, table[['bulk_modulus', 'density']])
+            clf = make_classifier(params['stability'], n_jobs=self.n_jobs)
+            clf.fit(X, table['is_stable'].astype(int))
+            for forest in model.estimators_ + [clf]:
+                forest.set_params(n_jobs=None)
+            self._models = model, clf
+        return self._models
+
+
+def bench_get_data(n, ctx):
+    directory = tempfile.mkdtemp(dir=ctx.workdir)
+    mpr = FakeMPRester(summary_docs(n))
+    with Timer() as t_sync:
+        snapshot = sync(mpr, directory)
+    updated = FakeMPRester(summary_docs(n, updated_fraction=0.05))
+    with Timer() as t_resync:
+        snapshot = sync(updated, directory)
+    with Timer() as t_export:
+        export_cleaned(snapshot, os.path.join(directory, 'materials_cleaned.csv'))
+    return {'rows': n, 'seconds': t_sync.seconds + t_export.seconds, 'sync_seconds': t_sync.seconds,
+            'resync_seconds': t_resync.seconds, 'export_seconds': t_export.seconds,
+            'requests': mpr.requests + updated.requests}
+
+
+def bench_featurize(n, ctx):
+    formulas = random_formulas(n, seed=2)
+    with Timer() as t_plain:
+        ctx.featurizer.featurize_many(formulas)
+    cache = FeatureCache(ctx.featurizer, cache_dir=tempfile.mkdtemp(dir=ctx.workdir))
+    with Timer() as t_cold:
+        cache.featurize_many(formulas)
+    with Timer() as t_warm:
+        cache.featurize_many(formulas)
+    return {'rows': n, 'seconds': t_plain.seconds, 'cache_cold_seconds': t_cold.seconds,
+            'cache_warm_seconds': t_warm.seconds}
+
+
+def bench_train(n, ctx):
+    table = materials_table(n, seed=3)
+    X = pd.DataFrame(ctx.featurizer.featurize_many(table['formula']), columns=ctx.featurizer.feature_labels())
+    params = load_params()
+    with Timer() as t_reg:
+        make_regressor(params['regressor'], n_jobs=ctx.n_jobs).fit(X, table[['bulk_modulus', 'density']])
+    with Timer() as t_clf:
+        make_classifier(params['stability'], n_jobs=ctx.n_jobs).fit(X, table['is_stable'].astype(int))
+    return {'rows': n, 'seconds': t_reg.seconds + t_clf.seconds, 'regressor_seconds': t_reg.seconds,
+            'classifier_seconds': t_clf.seconds, 'n_jobs': ctx.n_jobs}
+
+
+def bench_score(n, ctx):
+    model, clf = ctx.models()
+    space = candidate_space(n)
+    with Timer() as t:
+        screen(space, ctx.featurizer, model, clf)
+    return {'rows': len(space), 'seconds': t.seconds}
+
+
+def bench_pareto(n, ctx):
+    rng = np.random.default_rng(4)
+    table = pd.DataFrame({'density': rng.uniform(1, 15, n), 'bulk_modulus': rng.uniform(5, 400, n),
+                          'shear_modulus': rng.uniform(2, 250, n)})
+    with Timer() as t_2d:
+        front = pareto_front(table, minimize=['density'], maximize=['bulk_modulus'])
+    with Timer() as t_3d:
+        pareto_mask(table.to_numpy(), [False, True, True])
+    candidates = pd.DataFrame({'pred_density': table['density'], 'pred_bulk_modulus': table['bulk_modulus']})
+    with Timer() as t_score:
+        pareto_optimality_score(candidates, front)
+    return {'rows': n, 'seconds': t_2d.seconds, 'front_3d_seconds': t_3d.seconds,
+            'optimality_score_seconds': t_score.seconds}
+
+
+def bench_novelty(n, ctx):
+    space = candidate_space(n)
+    formulas = space.formulas(np.arange(len(space)))
+    # every tenth candidate is already known
+    mpr = FakeMPRester([SimpleNamespace(material_id=f"mp-{i}", formula_pretty=formula)
+                        for i, formula in enumerate(formulas[::10])])
+    index = KnownFormulaIndex(os.path.join(tempfile.mkdtemp(dir=ctx.workdir), 'known_formulas.json'))
+    with Timer() as t_cold:
+        index.exists(formulas, lambda: mpr)
+    cold_requests = mpr.requests
+    with Timer() as t_warm:
+        index.exists(formulas, lambda: mpr)
+    return {'rows': len(formulas), 'seconds': t_cold.seconds, 'warm_seconds': t_warm.seconds,
+            'requests': cold_requests, 'warm_requests': mpr.requests - cold_requests}
+
+
+def bench_relax(steps, ctx):
+    try:
+        from chgnet.model.dynamics import StructOptimizer #type: ignore
+        from chgnet.model.model import CHGNet #type: ignore
+        from pymatgen.core import Structure #type: ignore
+    except ImportError as e:
+        return {'skipped': f"chgnet not available ({e})"}
+    structure = Structure.from_file(os.path.join(project_root, 'geometry', 'Nb2SiC_relaxed.cif'))
+    structure.scale_lattice(structure.volume * 1.05)
+    structure.perturb(0.05)
+    with Timer() as t_load:
+        relaxer = StructOptimizer(model=CHGNet.load(verbose=False))
+    with Timer() as t_relax:
+        result = relaxer.relax(structure, steps=steps, verbose=False)
+    n_steps = len(result['trajectory'].energies)
+    return {'rows': len(structure), 'seconds': t_relax.seconds, 'load_seconds': t_load.seconds,
+            'steps': n_steps, 'steps_per_s': n_steps / t_relax.seconds}
+
+
+STAGES = {
+    'get_data': bench_get_data,
+    'featurize': bench_featurize,
+    'train': bench_train,
+    'score': bench_score,
+    'pareto': bench_pareto,
+    'novelty': bench_novelty,
+    'relax': bench_relax,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(stages, sizes, n_jobs=-1, relax_steps=25, quiet=True):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        ctx = Context(workdir, n_jobs)
+        for stage in stages:
+            limit = STAGE_LIMITS[stage]
+            stage_sizes = [relax_steps] if limit is None else [n for n in sizes if n <= limit]
+            for n in stage_sizes:
+                # the pipeline functions report progress with print, keep the table readable
+                with contextlib.redirect_stdout(io.StringIO() if quiet else sys.stdout):
+                    result = STAGES[stage](n, ctx)
+                result = {'stage': stage, **result}
+                if 'seconds' in result:
+                    result['rows_per_s'] = result['rows'] / max(result['seconds'], 1e-9)
+                    print(f"  {stage:<10}{result['rows']:>10,} rows  {result['seconds']:9.3f}s  "
+                          f"{result['rows_per_s']:>14,.0f} rows/s")
+                else:
+                    print(f"  {stage:<10}skipped: {result['skipped']}")
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print stage timings against a baseline, return the (stage, rows) pairs that regressed."""
+    old = {(r['stage'], r['rows']): r['seconds'] for r in baseline['results'] if 'seconds' in r}
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for r in results:
+        key = (r['stage'], r.get('rows'))
+        if 'seconds' not in r or key not in old:
+            continue
+        ratio = r['seconds'] / max(old[key], 1e-9)
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"  {r['stage']:<10}{r['rows']:>10,} rows  {old[key]:9.3f}s -> {r['seconds']:9.3f}s  "
+              f"x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="row counts (each stage skips sizes above its limit)")
+    parser.add_argument('--jobs', type=int, default=-1, help="n_jobs for training")
+    parser.add_argument('--relax-steps', type=int, default=25)
+    parser.add_argument('--output', default=None, help="results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', default=None, help="earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument('--verbose', action='store_true', help="show the stages' own progress output")
+    args = parser.parse_args()
+
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    print(f"Benchmarking {', '.join(args.stages)} at sizes {args.sizes}...")
+    results = run(args.stages, args.sizes, args.jobs, args.relax_steps, quiet=not args.verbose)
+
+    report = {
+        'timestamp': timestamp,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"\nSaved results to \"{output}\"")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above x{args.threshold}.")
+            raise SystemExit(1)
@@ -0,0 +1,96 @@
+# Synthetic inputs for the benchmarks
+# Materials tables and Materials Project summary docs are generated from a
+# seeded random generator, so every run of a given size sees the same data.
+# FakeMPRester answers the summary.search calls the pipeline makes (listing,
+# paging by material_ids, chemsys lookups) from those docs in-process and
+# counts the requests.
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from utils.magpie import parse_formula
+from utils.novelty import chemsys
+
+# mostly elements found in the training table, plus a few that get_data filters out
+ELEMENT_POOL = ['Li', 'B', 'C', 'N', 'O', 'F', 'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'K', 'Ca',
+                'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'Se', 'Sr', 'Y',
+                'Zr', 'Nb', 'Mo', 'In', 'Sn', 'Sb', 'Te', 'Ba', 'La', 'Hf', 'Ta', 'W', 'Pt', 'Au',
+                'Tc', 'Xe', 'Pm']
+
+
+def random_formulas(n, seed=0, max_elements=4, max_amount=6):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, max_elements + 1, size=n)
+    formulas = []
+    for k in counts:
+        elements = rng.choice(ELEMENT_POOL, size=k, replace=False)
+        amounts = rng.integers(1, max_amount + 1, size=k)
+        formulas.append("".join(f"{el}{a if a > 1 else ''}" for el, a in zip(elements, amounts)))
+    return formulas
+
+
+def materials_table(n, seed=0):
+    """A materials_cleaned.csv-like table with n rows."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'material_id': [f"mp-{i}" for i in range(n)],
+        'formula': random_formulas(n, seed),
+        'density': rng.uniform(1, 15, n),
+        'bulk_modulus': rng.uniform(5, 400, n),
+        'shear_modulus': rng.uniform(2, 250, n),
+        'is_stable': rng.random(n) < 0.3,
+    })
+
+
+def summary_docs(n, seed=0, updated_fraction=0.0):
+    """Summary docs for a materials table, updated_fraction of them with a newer timestamp."""
+    table = materials_table(n, seed)
+    rng = np.random.default_rng(seed + 1)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    newer = rng.random(n) < updated_fraction
+    docs = []
+    for row, is_newer in zip(table.itertuples(index=False), newer):
+        docs.append(SimpleNamespace(
+            material_id=row.material_id,
+            formula_pretty=row.formula,
+            density=row.density,
+            bulk_modulus={'vrh': row.bulk_modulus},
+            shear_modulus={'vrh': row.shear_modulus},
+            is_stable=bool(row.is_stable),
+            last_updated=base + timedelta(days=30 if is_newer else 0),
+        ))
+    return docs
+
+
+class FakeMPRester:
+    """In-process stand-in for MPRester over a list of summary docs."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.by_id = {doc.material_id: doc for doc in docs}
+        self.by_chemsys = {}
+        for doc in docs:
+            self.by_chemsys.setdefault(chemsys(parse_formula(doc.formula_pretty)), []).append(doc)
+        self.requests = 0
+        self.materials = SimpleNamespace(summary=SimpleNamespace(search=self.search))
+
+    def search(self, has_props=None, material_ids=None, chemsys=None, fields=None, **kwargs):
+        self.requests += 1
+        if material_ids is not None:
+            docs = [self.by_id[m] for m in material_ids if m in self.by_id]
+        elif chemsys is not None:
+            systems = [chemsys] if isinstance(chemsys, str) else chemsys
+            docs = [doc for system in systems for doc in self.by_chemsys.get(system, [])]
+        else:
+            docs = self.docs
+        if fields is not None:
+            docs = [SimpleNamespace(**{f: getattr(doc, f, None) for f in fields}) for doc in docs]
+        return docs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -1,61 +1,183 @@
+# Incremental local snapshot of the Materials Project elasticity dataset
+# A sync lists (material_id, last_updated) for every material with elasticity,
+# then fetches only new or changed materials in pages. Each page is written
+# to its own Parquet part as soon as it arrives, so an interrupted download
+# resumes from the parts already on disk instead of restarting. Parts are
+# finally compacted into one typed snapshot (mp_snapshot/materials.parquet)
+# and the cleaned training table is exported to materials_cleaned.csv.
+import argparse
+import glob
+import json
 import os
-from dotenv import load_dotenv
-from mp_api.client import MPRester #type: ignore
-from pymatgen.core import Composition
+import sys
+from types import SimpleNamespace
+
+import numpy as np
 import pandas as pd
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.composition import CompositionTable
+from utils.instrument import api_call, configure, stage
+
 # Some compounds in our downloaded dataset are theoretical
 # they may contain radioactive elements (e.g Plutonium)
 # and/or noble gases
 invalid_elements = ["Tc", "Pm", "Po", "At", "Rn", "Fr", "Ra", "Ac", "He", "Ne", "Ar", "Kr", "Xe"]
 
-def is_invalid(formula_str):
-    try:
-        # Create a Pymatgen Composition object from the string
-        comp = Composition(formula_str)
-        # Check every element in the formula
-        for element in comp.elements:
-            if element.symbol in invalid_elements:
-                return True
-        return False
-    except:
-        # If the formula is garbage/unparseable, mark it as "bad"
-        return True
-
-load_dotenv()
-api_key = os.getenv("MATERIALS_API_KEY")
-
-with MPRester(api_key) as mpr:
-    print("Querying for materials with calculated elastic properties...")
-    docs = mpr.materials.summary.search(
-        has_props=['elasticity'],
-        fields=["material_id", "formula_pretty", "density", "bulk_modulus", "shear_modulus", "is_stable"]
-    )
-    print(f"Found {len(docs)} materials.")
-
-data = {
-    'material_id' : [],
-    'formula' : [],
-    'density' : [],
-    'bulk_modulus' : [],
-    'shear_modulus' : [],
-    'is_stable' : []
+FIELDS = ["material_id", "formula_pretty", "density", "bulk_modulus", "shear_modulus", "is_stable", "last_updated"]
+SNAPSHOT_DTYPES = {
+    'material_id': 'string',
+    'formula': 'string',
+    'density': 'float64',
+    'bulk_modulus': 'float64',
+    'shear_modulus': 'float64',
+    'is_stable': 'boolean',
 }
 
-for mat in docs:
-    data["bulk_modulus"].append(mat.bulk_modulus['vrh'] if mat.bulk_modulus else None)
-    data["density"].append(mat.density)
-    data["formula"].append(mat.formula_pretty)
-    data["is_stable"].append(mat.is_stable)
-    data["shear_modulus"].append(mat.shear_modulus['vrh'] if mat.shear_modulus else None)
-    data["material_id"].append(mat.material_id)
-
-df = pd.DataFrame(data)
-df = df.dropna()
-print(f"Loaded {len(df)} materials from original dataset.")
-
-# Clean invalid elements
-df['invalid_elements'] = df['formula'].apply(is_invalid)
-df_clean = df[df['invalid_elements'] == False].drop(columns=['invalid_elements'])
-df_clean.to_csv('materials_cleaned.csv', index=False)
-print(f"Saved {len(df_clean)} cleaned materials to 'materials_cleaned.csv'.")
\ No newline at end of file
+data_dir = os.path.dirname(os.path.abspath(__file__))
+snapshot_dir = os.path.join(data_dir, 'mp_snapshot')
+
+
+def invalid_mask(formulas, table=None):
+    """Vectorized replacement for the old per-row is_invalid check.
+
+    Every distinct formula is interned once and the blacklist is one pass over
+    the composition matrix, unparseable formulas are marked invalid.
+    """
+    table = CompositionTable() if table is None else table
+    rows = table.intern(formulas, errors='coerce')
+    # If the formula is garbage/unparseable (row -1), mark it as "bad"
+    return np.append(table.contains_any(invalid_elements), True)[rows]
+
+
+def docs_to_frame(docs):
+    def vrh(moduli):
+        return moduli['vrh'] if moduli else None
+
+    df = pd.DataFrame({
+        'material_id': [str(doc.material_id) for doc in docs],
+        'formula': [doc.formula_pretty for doc in docs],
+        'density': [doc.density for doc in docs],
+        'bulk_modulus': [vrh(doc.bulk_modulus) for doc in docs],
+        'shear_modulus': [vrh(doc.shear_modulus) for doc in docs],
+        'is_stable': [doc.is_stable for doc in docs],
+        'last_updated': pd.to_datetime([doc.last_updated for doc in docs], utc=True),
+    })
+    return df.astype(SNAPSHOT_DTYPES)
+
+
+def _write_parquet(df, path):
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(directory=snapshot_dir):
+    """Snapshot plus any pages left behind by an interrupted sync, newest row per material."""
+    paths = glob.glob(os.path.join(directory, 'materials.parquet'))
+    paths += sorted(glob.glob(os.path.join(directory, 'parts', 'part-*.parquet')))
+    if not paths:
+        return docs_to_frame([])
+    df = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+    return df.drop_duplicates('material_id', keep='last').reset_index(drop=True)
+
+
+def sync(mpr, directory=snapshot_dir, page_size=1000):
+    """Bring the local snapshot up to date and return it as a DataFrame."""
+    parts_dir = os.path.join(directory, 'parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    local = load_snapshot(directory)
+
+    print("Listing materials with calculated elastic properties...")
+    with api_call():
+        listing = mpr.materials.summary.search(has_props=['elasticity'], fields=["material_id", "last_updated"])
+    remote = pd.DataFrame({
+        'material_id': [str(doc.material_id) for doc in listing],
+        'last_updated': pd.to_datetime([doc.last_updated for doc in listing], utc=True),
+    })
+    print(f"Found {len(remote)} materials ({len(local)} already in the local snapshot).")
+
+    merged = remote.merge(local[['material_id', 'last_updated']], on='material_id', how='left',
+                          suffixes=('', '_local'))
+    stale = merged['last_updated_local'].isna() | (merged['last_updated'] > merged['last_updated_local'])
+    to_fetch = merged.loc[stale, 'material_id'].tolist()
+    print(f"Fetching {len(to_fetch)} new or updated materials in pages of {page_size}...")
+
+    first_part = len(glob.glob(os.path.join(parts_dir, 'part-*.parquet')))
+    for page, start in enumerate(range(0, len(to_fetch), page_size)):
+        ids = to_fetch[start:start + page_size]
+        with api_call():
+            docs = mpr.materials.summary.search(material_ids=ids, fields=FIELDS)
+        _write_parquet(docs_to_frame(docs), os.path.join(parts_dir, f"part-{first_part + page:05d}.parquet"))
+        print(f"  Fetched {min(start + page_size, len(to_fetch))}/{len(to_fetch)} materials...")
+
+    # compact: newest row per material, drop materials that left the remote set
+    snapshot = load_snapshot(directory)
+    snapshot = snapshot[snapshot['material_id'].isin(remote['material_id'])].reset_index(drop=True)
+    _write_parquet(snapshot, os.path.join(directory, 'materials.parquet'))
+    for path in glob.glob(os.path.join(parts_dir, 'part-*.parquet')):
+        os.remove(path)
+    print(f"Snapshot holds {len(snapshot)} materials.")
+    return snapshot
+
+
+def export_cleaned(snapshot, path):
+    """Write the training table (materials_cleaned.csv) from a snapshot."""
+    df = snapshot.drop(columns=['last_updated']).dropna()
+    print(f"Loaded {len(df)} materials from original dataset.")
+
+    # Clean invalid elements
+    df_clean = df[~invalid_mask(df['formula'])]
+    df_clean.to_csv(path, index=False)
+    print(f"Saved {len(df_clean)} cleaned materials to '{path}'.")
+    return df_clean
+
+
+class FixtureMPRester:
+    """Offline stand-in for MPRester serving summary docs recorded in a JSON file."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.docs = [SimpleNamespace(**doc) for doc in json.load(f)]
+        self.materials = SimpleNamespace(summary=SimpleNamespace(search=self.search))
+
+    def search(self, has_props=None, material_ids=None, fields=None):
+        docs = self.docs
+        if material_ids is not None:
+            wanted = set(material_ids)
+            docs = [doc for doc in docs if doc.material_id in wanted]
+        if fields is not None:
+            docs = [SimpleNamespace(**{f: getattr(doc, f, None) for f in fields}) for doc in docs]
+        return docs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync the local Materials Project elasticity snapshot.")
+    parser.add_argument('--fixture', default=None, help="sync offline from recorded summary docs (JSON)")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--metrics', default=None, help="append per-stage metrics to this JSON-lines file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+
+    if args.fixture:
+        client = FixtureMPRester(args.fixture)
+    else:
+        from dotenv import load_dotenv
+        from mp_api.client import MPRester #type: ignore
+
+        load_dotenv()
+        client = MPRester(os.getenv("MATERIALS_API_KEY"))
+
+    with stage('get_data.sync') as s, client as mpr:
+        snapshot = sync(mpr, page_size=args.page_size)
+        s.items = len(snapshot)
+    with stage('get_data.export', items=len(snapshot)):
+        export_cleaned(snapshot, os.path.join(data_dir, 'materials_cleaned.csv'))
@@ -0,0 +1,304 @@
+# Batch CHGNet relaxation of screened candidates
+# Reads the novel candidates written by utils/evaluate.py (data/candidates.csv),
+# builds each structure from its MAX prototype (dynamics/prototypes.py) and
+# relaxes them concurrently on a process pool, one CHGNet instance per worker.
+# Relaxations are staged (dynamics/staged_relax.py): a loose-fmax triage,
+# refinement only for candidates that held their shape, and an early abort
+# for runs that collapse, explode or diverge.
+# Every finished relaxation is checkpointed in geometry/relaxed/<formula>/<key>/,
+# where key is a hash of the relaxation settings (CHGNet version, fmax, step
+# limit, optimizer, ...), so a rerun with other settings relaxes again:
+#   relaxed.cif      final structure
+#   trajectory.pkl   CHGNet trajectory (energies, forces, stresses, cells)
+#   result.json      summary row, written last and atomically
+# A candidate whose result.json exists is skipped, so a killed run picks up
+# where it stopped. The summaries of the candidates of the current run are
+# collected in data/relaxations.csv.
+# Structures equivalent to one relaxed before (dynamics/structure_cache.py),
+# or to one already queued in the same run, reuse that result instead of
+# being relaxed again, those rows have cached=True.
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+warnings.filterwarnings('ignore')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamics.prototypes import DEFAULT_TEMPLATE_DIR, load_templates, parse_candidate, substitute
+from dynamics.staged_relax import CELL_FILTERS, OPTIMIZERS, StagedRelaxer
+from dynamics.structure_cache import RelaxationCache, chgnet_version
+from utils.instrument import configure, stage
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(project_root, 'geometry', 'relaxed')
+RESULT_FIELDS = ['formula', 'n_atoms', 'energy_initial', 'energy_final', 'volume_initial',
+                 'volume_final', 'volume_change', 'held_shape', 'status', 'stop_reason', 'steps',
+                 'steps_saved', 'seconds', 'cif', 'cached']
+
+_worker = {}
+
+
+def relax_settings(relaxer):
+    """Everything a relaxation result depends on: the CHGNet version and the StagedRelaxer options."""
+    return {'model': chgnet_version(), **relaxer.settings()}
+
+
+def candidate_dir(output_dir, formula, settings):
+    """Checkpoint directory of a candidate, e.g. (Ti0.5Nb0.5)2AlC -> Ti0.5Nb0.5_2AlC/<settings hash>."""
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(output_dir, re.sub(r"[^A-Za-z0-9.]+", "_", formula).strip("_"), key)
+
+
+def is_done(output_dir, formula, settings):
+    return os.path.exists(os.path.join(candidate_dir(output_dir, formula, settings), 'result.json'))
+
+
+def load_result(output_dir, formula, settings):
+    with open(os.path.join(candidate_dir(output_dir, formula, settings), 'result.json')) as f:
+        return json.load(f)
+
+
+def _init_worker(threads, fmax, steps, options):
+    import torch #type: ignore
+    from chgnet.model.model import CHGNet #type: ignore
+
+    warnings.filterwarnings('ignore')
+    # the pool already uses every core, so keep each worker's torch to its share
+    torch.set_num_threads(threads)
+    chgnet = CHGNet.load(verbose=False)
+    _worker['relaxer'] = StagedRelaxer(chgnet, fmax=fmax, steps=steps, **options)
+
+
+def _relax(formula, structure, output_dir):
+    return relax_one(_worker['relaxer'], formula, structure, output_dir)
+
+
+def relax_one(relaxer, formula, structure, output_dir=DEFAULT_OUTPUT_DIR):
+    """Relax one structure with a StagedRelaxer and checkpoint it, returns the result record."""
+    t0 = time.perf_counter()
+    directory = candidate_dir(output_dir, formula, relax_settings(relaxer))
+    os.makedirs(directory, exist_ok=True)
+
+    result = relaxer.relax(structure, save_path=os.path.join(directory, 'trajectory.pkl'))
+    final_structure = result['final_structure']
+    cif_path = os.path.join(directory, 'relaxed.cif')
+    final_structure.to(filename=cif_path)
+
+    vol_start, vol_end = structure.volume, final_structure.volume
+    vol_change = ((vol_end - vol_start) / vol_start) * 100
+    record = {
+        'formula': formula,
+        'n_atoms': len(structure),
+        'energy_initial': float(result['energy_initial']),
+        'energy_final': float(result['energy_final']),
+        'volume_initial': vol_start,
+        'volume_final': vol_end,
+        'volume_change': vol_change,
+        'held_shape': bool(result['status'] in ('converged', 'unconverged')
+                           and abs(vol_change) < relaxer.max_volume_change),
+        'status': result['status'],
+        'stop_reason': result['stop_reason'],
+        'steps': result['steps'],
+        'steps_saved': result['steps_saved'],
+        'seconds': time.perf_counter() - t0,
+        'cif': os.path.relpath(cif_path, project_root),
+        'cached': False,
+    }
+    _write_result(directory, record)
+    return record
+
+
+def _write_result(directory, record):
+    tmp_path = os.path.join(directory, 'result.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, os.path.join(directory, 'result.json'))
+
+
+def _reuse(formula, structure, cache, entry_id, settings, output_dir):
+    # checkpoint a candidate from an equivalent cached relaxation, energies are
+    # per atom and the relaxed cell is the cached one (possibly another cell choice)
+    directory = candidate_dir(output_dir, formula, settings)
+    os.makedirs(directory, exist_ok=True)
+    cif_path = os.path.join(directory, 'relaxed.cif')
+    shutil.copyfile(cache.relaxed_path(entry_id), cif_path)
+    cached = cache.entries[entry_id]['record']
+    record = {
+        **cached,
+        'formula': formula,
+        'n_atoms': len(structure),
+        'volume_initial': structure.volume,
+        'volume_final': structure.volume * (1 + cached['volume_change'] / 100),
+        'seconds': 0.0,
+        'cif': os.path.relpath(cif_path, project_root),
+        'cached': True,
+    }
+    _write_result(directory, record)
+    return record
+
+
+def collect_results(formulas, settings, output_dir=DEFAULT_OUTPUT_DIR):
+    """Checkpointed relaxations of the given formulas with these settings as one DataFrame.
+
+    Formulas without a finished relaxation are left out.
+    """
+    records = [load_result(output_dir, formula, settings) for formula in dict.fromkeys(formulas)
+               if is_done(output_dir, formula, settings)]
+    return pd.DataFrame(records, columns=RESULT_FIELDS)
+
+
+def relax_candidates(formulas, templates, output_dir=DEFAULT_OUTPUT_DIR, n_workers=None,
+                     threads=None, fmax=0.1, steps=500, cache=None, options=None):
+    """Relax every formula that has no checkpoint yet, return {formula: error} for failures.
+
+    options are passed on to StagedRelaxer (optimizer, cell_filter, triage_fmax, ...).
+    With a RelaxationCache, equivalent structures are relaxed only once.
+    """
+    options = options or {}
+    n_workers = n_workers or os.cpu_count()
+    threads = threads or max(1, os.cpu_count() // n_workers)
+    # a relaxer without a model, only to fill in the defaults of the options
+    settings = relax_settings(StagedRelaxer(None, fmax=fmax, steps=steps, **options))
+    todo = [f for f in dict.fromkeys(formulas) if not is_done(output_dir, f, settings)]
+    print(f"{len(formulas) - len(todo)} candidates already relaxed, {len(todo)} to go "
+          f"on {n_workers} workers x {threads} threads.")
+
+    failed = {}
+    structures, buckets = {}, {}
+    for formula in todo:
+        try:
+            structures[formula] = substitute(formula, templates)
+        except ValueError as e:
+            failed[formula] = str(e)
+            print(f"  {formula}: skipped ({e})")
+
+    # cache hits are checkpointed right away, equivalents within this run
+    # follow the first of them and are resolved once it has finished
+    leaders, followers, entry_ids = {}, {}, {}
+    for formula, structure in structures.items():
+        if cache is None:
+            leaders[formula] = structure
+            continue
+        bucket = buckets[formula] = cache.fingerprint(structure)
+        entry_id = cache.lookup(structure, settings, bucket)
+        if entry_id is not None:
+            _reuse(formula, structure, cache, entry_id, settings, output_dir)
+            print(f"  {formula}: equivalent to a cached relaxation, reused")
+            continue
+        leader = next((f for f in leaders if buckets[f] == bucket and cache.matches(structure, leaders[f])), None)
+        if leader is None:
+            leaders[formula] = structure
+        else:
+            followers[formula] = leader
+            cache.duplicates += 1
+
+    records = []
+    with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(threads, fmax, steps, options)) as pool:
+        futures = {pool.submit(_relax, formula, structure, output_dir): formula
+                   for formula, structure in leaders.items()}
+        for i, future in enumerate(as_completed(futures), 1):
+            formula = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                failed[formula] = repr(e)
+                print(f"  [{i}/{len(futures)}] {formula}: FAILED ({e!r})")
+                continue
+            if cache is not None:
+                entry_ids[formula] = cache.store(leaders[formula], os.path.join(project_root, record['cif']),
+                                                 record, settings, buckets[formula])
+            records.append(record)
+            stopped = f" ({record['stop_reason']}, {record['steps_saved']} steps saved)" if record['steps_saved'] else ""
+            print(f"  [{i}/{len(futures)}] {formula}: {record['status']}{stopped}, "
+                  f"{record['energy_final']:.3f} eV/atom, volume change {record['volume_change']:.2f}%, "
+                  f"{record['steps']} steps in {record['seconds']:.1f}s")
+
+    for formula, leader in followers.items():
+        if leader in failed:
+            failed[formula] = f"equivalent to {leader}, which failed"
+            continue
+        _reuse(formula, structures[formula], cache, entry_ids[leader], settings, output_dir)
+        print(f"  {formula}: equivalent to {leader}, reused")
+    if records:
+        statuses = pd.Series([r['status'] for r in records]).value_counts()
+        print(f"Relaxed {len(records)}: " + ", ".join(f"{n} {status}" for status, n in statuses.items()) +
+              f"; early stops saved {sum(r['steps_saved'] for r in records)} of {steps * len(records)} steps.")
+    if cache is not None:
+        print(cache.report())
+    return failed
+
+
+def connect_materials_project():
+    from dotenv import load_dotenv
+    from mp_api.client import MPRester #type: ignore
+
+    load_dotenv()
+    return MPRester(os.getenv('MATERIALS_API_KEY'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Relax screened MAX phase candidates with CHGNet.")
+    parser.add_argument('--candidates', default=os.path.join(project_root, 'data', 'candidates.csv'))
+    parser.add_argument('--top', type=int, default=20, help="relax the first N candidates of the table")
+    parser.add_argument('--formulas', nargs='+', default=None, help="relax these formulas instead")
+    parser.add_argument('--workers', type=int, default=None, help="process pool size (default: all cores)")
+    parser.add_argument('--threads', type=int, default=None, help="torch threads per worker")
+    parser.add_argument('--fmax', type=float, default=0.1, help="force convergence criterion (eV/A)")
+    parser.add_argument('--steps', type=int, default=500, help="maximum optimizer steps")
+    parser.add_argument('--optimizer', choices=OPTIMIZERS, default='BFGS')
+    parser.add_argument('--cell-filter', choices=CELL_FILTERS, default='frechet',
+                        help="ASE cell filter for relaxing the cell (none: fixed cell)")
+    parser.add_argument('--triage-fmax', type=float, default=0.5,
+                        help="loose fmax of the triage stage (0: no triage)")
+    parser.add_argument('--triage-steps', type=int, default=100)
+    parser.add_argument('--max-volume-change', type=float, default=10.0,
+                        help="volume change (%%) above which a candidate is rejected after triage")
+    parser.add_argument('--abort-volume-change', type=float, default=20.0,
+                        help="volume change (%%) that stops a relaxation at once")
+    parser.add_argument('--abort-energy-rise', type=float, default=1.0,
+                        help="energy rise (eV/atom) over the start that stops a relaxation")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--template-dir', default=DEFAULT_TEMPLATE_DIR)
+    parser.add_argument('--results', default=os.path.join(project_root, 'data', 'relaxations.csv'))
+    parser.add_argument('--no-cache', action='store_true',
+                        help="relax every candidate, even if an equivalent structure was relaxed before")
+    parser.add_argument('--metrics', default=None, help="append per-stage metrics to this JSON-lines file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+
+    formulas = args.formulas or pd.read_csv(args.candidates)['formula'].head(args.top).tolist()
+    with stage('batch_relax.templates'):
+        templates = load_templates(connect_materials_project, args.template_dir,
+                                   n_values=sorted({parse_candidate(f)[0] for f in formulas}))
+    # worker CPU shows up as children_cpu_s once the pool has shut down
+    options = {
+        'optimizer': args.optimizer,
+        'cell_filter': args.cell_filter,
+        'triage_fmax': args.triage_fmax or None,
+        'triage_steps': args.triage_steps,
+        'max_volume_change': args.max_volume_change,
+        'abort_volume_change': args.abort_volume_change,
+        'abort_energy_rise': args.abort_energy_rise,
+    }
+    with stage('batch_relax.relax', items=len(formulas)):
+        failed = relax_candidates(formulas, templates, args.output_dir, args.workers, args.threads,
+                                  args.fmax, args.steps, None if args.no_cache else RelaxationCache(), options)
+
+    # only this run's candidates, relaxed with this run's settings
+    settings = relax_settings(StagedRelaxer(None, fmax=args.fmax, steps=args.steps, **options))
+    results = collect_results(formulas, settings, args.output_dir)
+    results.to_csv(args.results, index=False)
+    print(f"\nSaved {len(results)} relaxations to '{args.results}'.")
+    if failed:
+        print(f"{len(failed)} candidates failed and will be retried on the next run.")
@@ -0,0 +1,365 @@
+# Tiered screening cascade from the random forests to CHGNet formation energies
+# Candidates flow through four tiers, each more expensive than the last:
+#   rf            random forest scores (utils/scoring_service.py), passes at a
+#                 minimum predicted stability
+#   single_point  CHGNet formation energy of the unrelaxed prototype
+#                 substitution, passes below a loose limit
+#   relax         staged CHGNet relaxation (dynamics/staged_relax.py),
+#                 checkpointed like batch_relax.py, passes if it held its shape
+#   formation     formation energy of the relaxed structure, passes below a limit
+# Every tier has an input queue and its own worker threads, which take batches
+# from it and put the survivors on the next tier's queue, so the cheap tiers
+# keep the costly ones fed while they run. A tier's budget is a number of
+# items and/or seconds; once it is spent the rest of its input is counted as
+# over budget, and tiers upstream of a spent tier stop too, since nothing
+# they pass could be used. Candidates are fed best-first (the order of
+# data/candidates.csv), so a budget keeps the most promising ones.
+# Per-tier throughput and attrition are printed at the end and every
+# candidate's path through the cascade is written to data/cascade.csv.
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import warnings
+
+import pandas as pd
+
+warnings.filterwarnings('ignore')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamics.batch_relax import DEFAULT_OUTPUT_DIR, is_done, load_result, relax_one, relax_settings
+from dynamics.formation import ReferenceEnergies, connect_materials_project, formation_energies
+from dynamics.prototypes import DEFAULT_TEMPLATE_DIR, load_templates, parse_candidate, substitute
+from dynamics.staged_relax import CELL_FILTERS, OPTIMIZERS, StagedRelaxer
+from utils.instrument import configure, stage
+from utils.magpie import parse_formula
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIERS = ['rf', 'single_point', 'relax', 'formation']
+DEFAULT_BUDGETS = {'relax': 20}
+
+_DONE = object()
+
+
+class Tier:
+    """One stage of the cascade: a batch function, a pass criterion and a budget.
+
+    run takes a list of candidate dicts and returns one dict of new fields per
+    candidate (a dict with an 'error' key fails that candidate only).
+    """
+
+    def __init__(self, name, run, passes, batch_size=1, workers=1, max_items=None, max_seconds=None):
+        self.name = name
+        self.run = run
+        self.passes = passes
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_items = max_items
+        self.max_seconds = max_seconds
+        self.inbox = queue.Queue()
+        self.closed = False
+        self.received = 0
+        self.taken = 0
+        self.passed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.over_budget = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._active = workers
+        self._lock = threading.Lock()
+
+    def _spent(self):
+        if self.max_items is not None and self.taken >= self.max_items:
+            return True
+        return (self.max_seconds is not None and self.started is not None
+                and time.perf_counter() - self.started >= self.max_seconds)
+
+    def _take(self, downstream):
+        # (batch, finished): blocks for one item, then adds what is already queued
+        item = self.inbox.get()
+        if item is _DONE:
+            self.inbox.put(_DONE)  # for the other workers of this tier
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self.inbox.put(_DONE)
+                break
+            batch.append(item)
+        with self._lock:
+            self.received += len(batch)
+            if self.started is None:
+                self.started = time.perf_counter()
+            if self.closed or self._spent() or (downstream is not None and downstream.closed):
+                self.closed = True
+                over, batch = batch, []
+            else:
+                allowed = len(batch) if self.max_items is None else self.max_items - self.taken
+                batch, over = batch[:allowed], batch[allowed:]
+                self.taken += len(batch)
+            self.over_budget += len(over)
+        for candidate in over:
+            candidate['tier'], candidate['outcome'] = self.name, 'over budget'
+        return batch, False
+
+    def _run(self, batch):
+        try:
+            return self.run(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                return [{'error': repr(e)}]
+            # one bad candidate should not fail its whole batch
+            return [self._run([candidate])[0] for candidate in batch]
+
+    def _judge(self, candidate, result):
+        # a pass criterion that raises (a key an aborted run did not set, ...)
+        # fails that candidate, not the worker thread
+        try:
+            candidate.update(result)
+            if 'error' in result:
+                return 'error'
+            return 'passed' if self.passes(candidate) else 'rejected'
+        except Exception as e:
+            candidate['error'] = repr(e)
+            return 'error'
+
+    def work(self, downstream, survivors):
+        try:
+            while True:
+                batch, finished = self._take(downstream)
+                if finished:
+                    break
+                if not batch:
+                    continue
+                t0 = time.perf_counter()
+                results = self._run(batch)
+                seconds = time.perf_counter() - t0
+                forward = []
+                for candidate, result in zip(batch, results):
+                    candidate['outcome'] = self._judge(candidate, result)
+                    candidate['tier'] = self.name
+                    if candidate['outcome'] == 'passed':
+                        forward.append(candidate)
+                with self._lock:
+                    self.busy_seconds += seconds
+                    self.errors += sum(c['outcome'] == 'error' for c in batch)
+                    self.passed += len(forward)
+                    self.rejected += sum(c['outcome'] == 'rejected' for c in batch)
+                for candidate in forward:
+                    if downstream is None:
+                        survivors.append(candidate)
+                    else:
+                        downstream.inbox.put(candidate)
+        finally:
+            # even a worker that died must release the tier below, or Cascade.run never returns
+            with self._lock:
+                self._active -= 1
+                last = self._active == 0
+                self.finished = time.perf_counter()
+            if last and downstream is not None:
+                downstream.inbox.put(_DONE)
+
+
+class Cascade:
+    """Tiers connected by work queues, each tier running on its own threads."""
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self.survivors = []
+        self.seconds = 0.0
+
+    def run(self, candidates):
+        """Stream the candidate dicts through every tier, returns the ones that passed them all."""
+        t0 = time.perf_counter()
+        threads = []
+        for i, tier in enumerate(self.tiers):
+            downstream = self.tiers[i + 1] if i + 1 < len(self.tiers) else None
+            for _ in range(tier.workers):
+                thread = threading.Thread(target=tier.work, args=(downstream, self.survivors), daemon=True)
+                thread.start()
+                threads.append(thread)
+        for candidate in candidates:
+            self.tiers[0].inbox.put(candidate)
+        self.tiers[0].inbox.put(_DONE)
+        for thread in threads:
+            thread.join()
+        self.seconds = time.perf_counter() - t0
+        return self.survivors
+
+    def report(self):
+        """Throughput and attrition of every tier as a DataFrame."""
+        rows = []
+        for tier in self.tiers:
+            processed = tier.passed + tier.rejected + tier.errors
+            wall = (tier.finished - tier.started) if tier.started is not None else 0.0
+            rows.append({
+                'tier': tier.name,
+                'received': tier.received,
+                'processed': processed,
+                'passed': tier.passed,
+                'rejected': tier.rejected,
+                'errors': tier.errors,
+                'over_budget': tier.over_budget,
+                'pass_rate': tier.passed / processed if processed else float('nan'),
+                'busy_s': tier.busy_seconds,
+                'items_per_s': processed / tier.busy_seconds if tier.busy_seconds else float('nan'),
+                'wall_s': wall,
+            })
+        return pd.DataFrame(rows)
+
+
+def rf_tier(score_formulas, min_stability=67, **kwargs):
+    """Random forest scores, passing above min_stability (%) like utils/screening.py."""
+    def run(batch):
+        values = score_formulas([candidate['formula'] for candidate in batch])
+        return [{col: float(v[i]) for col, v in values.items()} for i in range(len(batch))]
+
+    return Tier('rf', run, lambda c: c['stability'] > min_stability, **kwargs)
+
+
+def single_point_tier(templates, references, connect, max_formation=0.5, **kwargs):
+    """Formation energy of the unrelaxed prototype substitution from one batched CHGNet call."""
+    def run(batch):
+        structures = [substitute(candidate['formula'], templates) for candidate in batch]
+        delta_h = formation_energies(structures, references, connect, batch_size=len(structures))
+        return [{'sp_formation_energy': float(e), '_structure': s} for e, s in zip(delta_h, structures)]
+
+    return Tier('single_point', run, lambda c: c['sp_formation_energy'] <= max_formation, **kwargs)
+
+
+def relax_tier(relaxer, output_dir=DEFAULT_OUTPUT_DIR, **kwargs):
+    """Staged relaxation, checkpointed in output_dir, passing if the structure held its shape."""
+    settings = relax_settings(relaxer)
+
+    def run(batch):
+        results = []
+        for candidate in batch:
+            formula = candidate['formula']
+            # only a checkpoint written with the same settings is reused
+            if is_done(output_dir, formula, settings):
+                record = load_result(output_dir, formula, settings)
+            else:
+                record = relax_one(relaxer, formula, candidate['_structure'], output_dir)
+            results.append({key: record[key] for key in
+                            ['status', 'energy_final', 'volume_change', 'held_shape', 'steps', 'cif']})
+        return results
+
+    return Tier('relax', run, lambda c: c['held_shape'], **kwargs)
+
+
+def formation_tier(references, connect, max_formation=0.0, **kwargs):
+    """Formation energy of the relaxed structures, passing at or below max_formation (eV/atom)."""
+    def run(batch):
+        from pymatgen.core import Structure #type: ignore
+
+        structures = [Structure.from_file(os.path.join(project_root, c['cif'])) for c in batch]
+        delta_h = formation_energies(structures, references, connect, batch_size=len(structures))
+        return [{'formation_energy': float(e)} for e in delta_h]
+
+    return Tier('formation', run, lambda c: c['formation_energy'] <= max_formation, **kwargs)
+
+
+def _prototypes_and_elements(formulas):
+    # n of every MAX candidate and all their elements, other formulas fail in their tier
+    n_values, elements = set(), set()
+    for formula in formulas:
+        try:
+            n, species = parse_candidate(formula)[0], parse_formula(formula)
+        except ValueError:
+            continue
+        n_values.add(n)
+        elements.update(species)
+    return sorted(n_values), elements
+
+
+def _tier_values(pairs, cast, parser):
+    # TIER=VALUE options into {tier: value}
+    values = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition('=')
+        if name not in TIERS or not value:
+            parser.error(f"Expected TIER=VALUE with TIER one of {', '.join(TIERS)}, got '{pair}'")
+        values[name] = cast(value)
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream candidates through RF -> CHGNet single point -> "
+                                                 "relaxation -> formation energy.")
+    parser.add_argument('--candidates', default=os.path.join(project_root, 'data', 'candidates.csv'),
+                        help="table written by utils/evaluate.py, fed in its order")
+    parser.add_argument('--formulas', nargs='+', default=None, help="feed these formulas instead")
+    parser.add_argument('--min-stability', type=float, default=67, help="rf: minimum predicted stability (%%)")
+    parser.add_argument('--sp-max-formation', type=float, default=0.5,
+                        help="single_point: highest unrelaxed formation energy (eV/atom)")
+    parser.add_argument('--max-formation', type=float, default=0.0,
+                        help="formation: highest relaxed formation energy (eV/atom)")
+    parser.add_argument('--budget', action='append', metavar='TIER=ITEMS',
+                        help=f"most candidates a tier may process (default {DEFAULT_BUDGETS})")
+    parser.add_argument('--seconds', action='append', metavar='TIER=SECONDS',
+                        help="time after which a tier stops taking candidates")
+    parser.add_argument('--relax-workers', type=int, default=1, help="threads running relaxations")
+    parser.add_argument('--fmax', type=float, default=0.1, help="force convergence criterion (eV/A)")
+    parser.add_argument('--steps', type=int, default=500, help="maximum optimizer steps")
+    parser.add_argument('--optimizer', choices=OPTIMIZERS, default='BFGS')
+    parser.add_argument('--cell-filter', choices=CELL_FILTERS, default='frechet')
+    parser.add_argument('--triage-fmax', type=float, default=0.5,
+                        help="loose fmax of the triage stage (0: no triage)")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--template-dir', default=DEFAULT_TEMPLATE_DIR)
+    parser.add_argument('--output', default=os.path.join(project_root, 'data', 'cascade.csv'))
+    parser.add_argument('--metrics', default=None, help="append per-stage metrics to this JSON-lines file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+    budgets = {**DEFAULT_BUDGETS, **_tier_values(args.budget, int, parser)}
+    seconds = _tier_values(args.seconds, float, parser)
+
+    from chgnet.model.model import CHGNet #type: ignore
+    from utils.scoring_service import load_scorer
+
+    formulas = args.formulas or pd.read_csv(args.candidates)['formula'].tolist()
+    formulas = list(dict.fromkeys(formulas))
+    print(f"Loading models for {len(formulas)} candidates...")
+    with stage('cascade.load'):
+        score_formulas = load_scorer(project_root)
+        chgnet = CHGNet.load(verbose=False)
+        references = ReferenceEnergies(chgnet)
+        n_values, elements = _prototypes_and_elements(formulas)
+        templates = load_templates(connect_materials_project, args.template_dir, n_values=n_values)
+        # relax every elemental reference up front, not from two tiers at once
+        references.get(elements, connect_materials_project)
+
+    relaxer = StagedRelaxer(chgnet, optimizer=args.optimizer, cell_filter=args.cell_filter, fmax=args.fmax,
+                            steps=args.steps, triage_fmax=args.triage_fmax or None)
+
+    def limits(name):
+        return {'max_items': budgets.get(name), 'max_seconds': seconds.get(name)}
+
+    cascade = Cascade([
+        rf_tier(score_formulas, args.min_stability, batch_size=1024, **limits('rf')),
+        single_point_tier(templates, references, connect_materials_project, args.sp_max_formation,
+                          batch_size=16, **limits('single_point')),
+        relax_tier(relaxer, args.output_dir, workers=args.relax_workers, **limits('relax')),
+        formation_tier(references, connect_materials_project, args.max_formation, batch_size=8,
+                       **limits('formation')),
+    ])
+    candidates = [{'formula': f, 'tier': None, 'outcome': 'not reached'} for f in formulas]
+    with stage('cascade.run', items=len(candidates)):
+        survivors = cascade.run(candidates)
+
+    print(cascade.report().to_string(index=False, float_format="%.2f"))
+    print(f"{len(survivors)} of {len(candidates)} candidates passed every tier in {cascade.seconds:.1f}s.")
+    table = pd.DataFrame(candidates)
+    table = table[[c for c in table.columns if not c.startswith('_')]]
+    table.to_csv(args.output, index=False)
+    print(f"Saved the cascade results to '{args.output}'.")
@@ -0,0 +1,169 @@
+# Formation energies against cached elemental reference energies
+# Each element's reference is its stable Materials Project phase (kept as a
+# CIF in geometry/references), relaxed with CHGNet once. The relaxed energy
+# per atom is stored in data/reference_energies.json under
+# element|structure hash|CHGNet version, so it is reused by every later run
+# and only recomputed when the reference cell or the model changes.
+# Candidate energies are predicted in batched CHGNet calls.
+import argparse
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamics.structure_cache import structure_hash
+
+warnings.filterwarnings('ignore')
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(project_root, 'data', 'reference_energies.json')
+DEFAULT_REFERENCE_DIR = os.path.join(project_root, 'geometry', 'references')
+
+
+def model_version(chgnet):
+    import chgnet as chgnet_package #type: ignore
+
+    return f"{chgnet_package.__version__}/{getattr(chgnet, 'version', None)}"
+
+
+class ReferenceEnergies:
+    """Persistent cache of relaxed elemental reference energies (eV/atom).
+
+    connect is a zero-argument callable returning an MPRester-like context
+    manager, only called when a reference structure is not on disk yet.
+    """
+
+    def __init__(self, chgnet, path=DEFAULT_CACHE_PATH, reference_dir=DEFAULT_REFERENCE_DIR,
+                 fmax=0.05, steps=500):
+        self.chgnet = chgnet
+        self.version = model_version(chgnet)
+        self.path = path
+        self.reference_dir = reference_dir
+        self.fmax, self.steps = fmax, steps
+        self.relaxed = 0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def structures(self, elements, connect):
+        """{element: Structure} of the reference cells, fetching missing ones in one query."""
+        from pymatgen.core import Structure #type: ignore
+
+        os.makedirs(self.reference_dir, exist_ok=True)
+        paths = {el: os.path.join(self.reference_dir, f"{el}.cif") for el in elements}
+        missing = [el for el, path in paths.items() if not os.path.exists(path)]
+        if missing:
+            print(f"\tFetching reference structures for {', '.join(missing)}...")
+            with connect() as mpr:
+                docs = mpr.materials.summary.search(
+                    formula=missing,
+                    is_stable=True,
+                    fields=["structure", "material_id", "formula_pretty"]
+                )
+            for doc in docs:
+                el = doc.structure.composition.elements[0].symbol
+                if el in missing and not os.path.exists(paths[el]):
+                    doc.structure.to(filename=paths[el])
+            not_found = [el for el in missing if not os.path.exists(paths[el])]
+            if not_found:
+                raise ValueError(f"Could not find stable {', '.join(not_found)} in database!")
+        return {el: Structure.from_file(path) for el, path in paths.items()}
+
+    def get(self, elements, connect):
+        """{element: reference energy per atom}, relaxing references not in the cache."""
+        energies = {}
+        for el, structure in self.structures(sorted(set(elements)), connect).items():
+            key = f"{el}|{structure_hash(structure)}|{self.version}"
+            if key not in self.entries:
+                self.entries[key] = self._relax(el, structure)
+                self.save()
+            energies[el] = self.entries[key]['energy']
+        return energies
+
+    def _relax(self, element, structure):
+        from chgnet.model.dynamics import StructOptimizer #type: ignore
+
+        print(f"\tRelaxing {element} reference ({len(structure)} atoms)...")
+        result = StructOptimizer(model=self.chgnet).relax(
+            structure, fmax=self.fmax, steps=self.steps, verbose=False
+        )
+        self.relaxed += 1
+        return {
+            'element': element,
+            'energy': float(result['trajectory'].energies[-1] / len(structure)),
+            'volume_per_atom': result['final_structure'].volume / len(structure),
+            'model': self.version,
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def formation_energies(structures, references, connect, batch_size=16):
+    """Formation energy (eV/atom) of each relaxed structure.
+
+    All structures are predicted in batched CHGNet calls and every element's
+    reference is looked up once for the whole list.
+    """
+    if not structures:
+        return np.empty(0)
+    predictions = references.chgnet.predict_structure(structures, batch_size=batch_size)
+    elements = {el.symbol for s in structures for el in s.composition}
+    mu = references.get(elements, connect)
+    delta_h = np.empty(len(structures))
+    for i, (structure, prediction) in enumerate(zip(structures, predictions)):
+        fractions = structure.composition.fractional_composition
+        delta_h[i] = float(prediction['e']) - sum(x * mu[el.symbol] for el, x in fractions.items())
+    return delta_h
+
+
+def connect_materials_project():
+    from dotenv import load_dotenv
+    from mp_api.client import MPRester #type: ignore
+
+    load_dotenv()
+    return MPRester(os.getenv('MATERIALS_API_KEY'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Formation energies of relaxed structures with CHGNet.")
+    parser.add_argument('--relaxations', default=os.path.join(project_root, 'data', 'relaxations.csv'),
+                        help="table written by dynamics/batch_relax.py")
+    parser.add_argument('--cifs', nargs='+', default=None, help="score these CIF files instead")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', default=os.path.join(project_root, 'data', 'formation_energies.csv'))
+    args = parser.parse_args()
+
+    from chgnet.model.model import CHGNet #type: ignore
+    from pymatgen.core import Structure #type: ignore
+
+    if args.cifs:
+        table = pd.DataFrame({'cif': [os.path.abspath(p) for p in args.cifs]})
+        table['formula'] = [os.path.splitext(os.path.basename(p))[0] for p in args.cifs]
+    else:
+        table = pd.read_csv(args.relaxations)
+        # aborted, rejected or unconverged runs did not end in a relaxed structure
+        converged = table['status'] == 'converged'
+        if not converged.all():
+            print(f"Skipping {(~converged).sum()} relaxations that did not converge.")
+        table = table[converged].reset_index(drop=True)
+    structures = [Structure.from_file(os.path.join(project_root, p)) for p in table['cif']]
+
+    print("Initializing CHGNet...")
+    references = ReferenceEnergies(CHGNet.load())
+    table['formation_energy'] = formation_energies(structures, references, connect_materials_project,
+                                                   args.batch_size)
+    print(f"Relaxed {references.relaxed} new elemental reference(s).")
+
+    print(table[['formula', 'formation_energy']].to_string(index=False, float_format="%.3f"))
+    table.to_csv(args.output, index=False)
+    print(f"\nSaved {len(table)} formation energies to '{args.output}'.")
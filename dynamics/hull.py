@@ -0,0 +1,231 @@
+# Energy above the convex hull against a local snapshot of competing phases
+# formation.py only compares a candidate with its elements, so a candidate
+# that is unstable against a binary (Nb2SiC -> NbC + NbSi2, ...) still looks
+# stable there. Here every candidate is placed on the pymatgen PhaseDiagram of
+# its chemical system:
+#   data/mp_snapshot/phases.parquet   competing phases (material id, formula,
+#                                     energy per atom), fetched from the
+#                                     Materials Project once per chemical system
+#   data/hull_cache/<chemsys>.pkl     stable entries of each built hull, keyed
+#                                     by a hash of the phases it was built from
+# Candidates are grouped by chemical system, so each hull is built (or read)
+# once per batch. Only converged relaxations are placed on a hull.
+# MP energies are the corrected GGA/GGA+U ones, which CHGNet was trained on.
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings('ignore')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.composition import CompositionTable
+from utils.instrument import api_call, configure, stage
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PHASES_PATH = os.path.join(project_root, 'data', 'mp_snapshot', 'phases.parquet')
+DEFAULT_HULL_DIR = os.path.join(project_root, 'data', 'hull_cache')
+PHASE_COLUMNS = ['material_id', 'formula', 'energy_per_atom', 'source']
+
+
+def subsystems(chemsys):
+    """Every chemical system made of the elements of chemsys, e.g. Al, C, Ti, Al-C, ... for Al-C-Ti."""
+    elements = sorted(chemsys.split('-'))
+    return ["-".join(combo) for n in range(1, len(elements) + 1) for combo in itertools.combinations(elements, n)]
+
+
+def _entry(formula, energy_per_atom, material_id=None):
+    from pymatgen.analysis.phase_diagram import PDEntry #type: ignore
+    from pymatgen.core import Composition #type: ignore
+
+    composition = Composition(formula)
+    return PDEntry(composition, energy_per_atom * composition.num_atoms, name=formula, attribute=material_id)
+
+
+class HullCache:
+    """Per chemical system PhaseDiagrams of the local phase snapshot, cached on disk."""
+
+    def __init__(self, phases_path=DEFAULT_PHASES_PATH, path=DEFAULT_HULL_DIR):
+        self.phases_path = phases_path
+        self.path = path
+        self.built = 0
+        self.loaded = 0
+        self._hulls = {}            # chemsys -> (key, PhaseDiagram)
+        self._table = CompositionTable()
+        self.phases = pd.DataFrame(columns=PHASE_COLUMNS)
+        self.fetched = set()        # chemical systems already queried
+        if os.path.exists(phases_path):
+            self.phases = pd.read_parquet(phases_path)
+        fetched_path = self._fetched_path()
+        if os.path.exists(fetched_path):
+            with open(fetched_path) as f:
+                self.fetched = set(json.load(f))
+        self._phase_rows = self._table.intern(self.phases['formula'].tolist())
+
+    def _fetched_path(self):
+        return os.path.splitext(self.phases_path)[0] + '_systems.json'
+
+    def save_phases(self):
+        os.makedirs(os.path.dirname(self.phases_path), exist_ok=True)
+        self.phases.to_parquet(self.phases_path + '.tmp', index=False)
+        os.replace(self.phases_path + '.tmp', self.phases_path)
+        with open(self._fetched_path() + '.tmp', 'w') as f:
+            json.dump(sorted(self.fetched), f)
+        os.replace(self._fetched_path() + '.tmp', self._fetched_path())
+
+    def fetch(self, mpr, systems):
+        """Add the stable MP phases of every subsystem of the given systems not queried yet.
+
+        Stable phases are enough: a phase above the MP hull is never on a hull.
+        """
+        missing = sorted({sub for chemsys in systems for sub in subsystems(chemsys)} - self.fetched)
+        if not missing:
+            return 0
+        print(f"Fetching competing phases of {len(missing)} chemical systems...")
+        with api_call():
+            docs = mpr.materials.summary.search(
+                chemsys=missing,
+                is_stable=True,
+                fields=["material_id", "formula_pretty", "energy_per_atom"]
+            )
+        new = pd.DataFrame({
+            'material_id': [str(doc.material_id) for doc in docs],
+            'formula': [doc.formula_pretty for doc in docs],
+            'energy_per_atom': [float(doc.energy_per_atom) for doc in docs],
+            'source': 'mp',
+        }, columns=PHASE_COLUMNS)
+        new = new[~new['material_id'].isin(self.phases['material_id'])]
+        self.phases = pd.concat([self.phases, new], ignore_index=True)
+        self._phase_rows = self._table.intern(self.phases['formula'].tolist())
+        self.fetched.update(missing)
+        self.save_phases()
+        return len(new)
+
+    def _phases_in(self, chemsys):
+        rows = self._table.within(chemsys.split('-'))
+        return self.phases[np.isin(self._phase_rows, rows)]
+
+    def _key(self, phases):
+        payload = json.dumps(sorted(zip(phases['material_id'], phases['energy_per_atom'].astype(float).round(6))))
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def _hull_path(self, chemsys):
+        return os.path.join(self.path, f"{chemsys}.pkl")
+
+    def _store(self, chemsys, key, diagram):
+        self._hulls[chemsys] = (key, diagram)
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._hull_path(chemsys) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'elements': diagram.elements, 'stable': list(diagram.stable_entries)}, f)
+        os.replace(tmp_path, self._hull_path(chemsys))
+
+    def _load(self, chemsys):
+        from pymatgen.analysis.phase_diagram import PhaseDiagram #type: ignore
+
+        if chemsys in self._hulls:
+            return self._hulls[chemsys]
+        if not os.path.exists(self._hull_path(chemsys)):
+            return None, None
+        with open(self._hull_path(chemsys), 'rb') as f:
+            cached = pickle.load(f)
+        self._hulls[chemsys] = (cached['key'], PhaseDiagram(cached['stable'], cached['elements']))
+        self.loaded += 1
+        return self._hulls[chemsys]
+
+    def hull(self, chemsys):
+        """PhaseDiagram of a chemical system, from memory, disk or built from the snapshot.
+
+        Raises ValueError when the snapshot lacks a phase of one of its elements.
+        """
+        from pymatgen.analysis.phase_diagram import PhaseDiagram #type: ignore
+
+        phases = self._phases_in(chemsys)
+        key = self._key(phases)
+        cached_key, diagram = self._load(chemsys)
+        if cached_key == key:
+            return diagram
+        entries = [_entry(*row) for row in phases[['formula', 'energy_per_atom', 'material_id']].itertuples(index=False)]
+        diagram = PhaseDiagram(entries)
+        self.built += 1
+        self._store(chemsys, key, diagram)
+        return diagram
+
+    def e_above_hull(self, formulas, energies):
+        """Energy above hull (eV/atom, negative below it) and decomposition of each formula.
+
+        Candidates are grouped by chemical system and each hull is looked up
+        once; systems without a complete set of elemental phases give NaN.
+        """
+        table = CompositionTable()
+        rows = table.intern(formulas)
+        energies = np.asarray(energies, dtype=float)
+        e_above = np.full(len(rows), np.nan)
+        decomposition = np.full(len(rows), None, dtype=object)
+        chemsys = np.asarray(table.systems, dtype=object)[rows] if len(rows) else np.empty(0, dtype=object)
+        for system, positions in pd.Series(chemsys).groupby(chemsys).indices.items():
+            try:
+                diagram = self.hull(system)
+            except ValueError as e:
+                print(f"  Skipping {system}: {e}")
+                continue
+            for i in positions:
+                decomp, e = diagram.get_decomp_and_e_above_hull(_entry(formulas[i], energies[i]),
+                                                                allow_negative=True)
+                e_above[i] = e
+                decomposition[i] = " + ".join(sorted(entry.name for entry in decomp))
+        return e_above, decomposition, chemsys
+
+    def report(self):
+        return (f"Hull cache: {self.built} hulls built, {self.loaded} read from disk, "
+                f"{len(self.phases)} phases in the snapshot.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Energy above hull of relaxed candidates against competing phases.")
+    parser.add_argument('--relaxations', default=os.path.join(project_root, 'data', 'relaxations.csv'),
+                        help="table written by dynamics/batch_relax.py")
+    parser.add_argument('--offline', action='store_true',
+                        help="use only the phases already in the local snapshot")
+    parser.add_argument('--output', default=os.path.join(project_root, 'data', 'hull.csv'))
+    parser.add_argument('--metrics', default=None, help="append stage metrics (JSON lines) to this file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+
+    table = pd.read_csv(args.relaxations)
+    # aborted, rejected or unconverged runs have no meaningful final energy
+    converged = table['status'] == 'converged'
+    if not converged.all():
+        print(f"Skipping {(~converged).sum()} relaxations that did not converge.")
+    table = table[converged].reset_index(drop=True)
+    hulls = HullCache()
+    if not args.offline:
+        from dynamics.formation import connect_materials_project
+
+        interned = CompositionTable()
+        systems = set(interned.groups(interned.intern(table['formula'].tolist())))
+        with stage('hull.fetch', items=len(systems)), connect_materials_project() as mpr:
+            hulls.fetch(mpr, systems)
+
+    with stage('hull.e_above_hull', items=len(table)):
+        e_above, decomposition, chemsys = hulls.e_above_hull(table['formula'].tolist(),
+                                                             table['energy_final'].to_numpy())
+    table['chemsys'] = chemsys
+    table['e_above_hull'] = e_above
+    table['decomposition'] = decomposition
+    print(hulls.report())
+
+    columns = [c for c in ['formula', 'chemsys', 'energy_final', 'e_above_hull', 'decomposition', 'held_shape']
+               if c in table]
+    print(table[columns].to_string(index=False, float_format="%.3f"))
+    table.to_csv(args.output, index=False)
+    print(f"\nSaved {len(table)} hull energies to '{args.output}'.")
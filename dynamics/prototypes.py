@@ -0,0 +1,124 @@
+# Prototype templates and substitutions for MAX phase candidates
+# Every candidate formula written by utils/screening.py (Ti2AlC, Ti3AlC2,
+# (Ti0.5Nb0.5)2AlC, Ti2(Al0.5Si0.5)C, ...) is mapped onto the stable
+# Materials Project structure of the M_(n+1)AX_n prototype with the same n and
+# the M, A and X sites are substituted. Solid solutions become ordered
+# approximants: the cell is repeated along a until every site fraction is a
+# whole number of atoms and the species are spread over the sites in order.
+# Templates are fetched once and kept as CIFs in geometry/templates.
+import os
+import re
+
+from pymatgen.core import Structure #type: ignore
+
+from utils.instrument import api_call
+from utils.magpie import parse_formula
+
+# n -> (template formula, its M, A and X element)
+TEMPLATES = {
+    1: ('Ti2AlC', 'Ti', 'Al', 'C'),
+    2: ('Ti3AlC2', 'Ti', 'Al', 'C'),
+    3: ('Ti4AlN3', 'Ti', 'Al', 'N'),
+}
+DEFAULT_TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'geometry', 'templates'
+)
+
+_SITE = r"(?:\((?P<{0}>[^)]+)\)|(?P<{0}1>[A-Z][a-z]?))"
+_CANDIDATE = re.compile(
+    _SITE.format('m') + r"(?P<m_count>\d*)" + _SITE.format('a') + r"(?P<x>[A-Z][a-z]?)(?P<x_count>\d*)$"
+)
+
+
+def parse_candidate(formula):
+    """Split a candidate formula into n and the species on the M, A and X sites.
+
+    Returns (n, {M: fraction}, {A: fraction}, X), e.g. '(Ti0.5Nb0.5)2AlC' gives
+    (1, {'Ti': 0.5, 'Nb': 0.5}, {'Al': 1.0}, 'C').
+    """
+    match = _CANDIDATE.match(formula)
+    if not match:
+        raise ValueError(f"Not a MAX phase candidate: {formula!r}")
+    n = int(match['x_count'] or 1)
+    if int(match['m_count'] or 1) != n + 1 or n not in TEMPLATES:
+        raise ValueError(f"No M_(n+1)AX_n prototype for {formula!r}")
+
+    def site(group):
+        if match[group + '1']:
+            return {match[group + '1']: 1.0}
+        species = parse_formula(match[group])
+        total = sum(species.values())
+        return {el: amount / total for el, amount in species.items()}
+
+    return n, site('m'), site('a'), match['x']
+
+
+def load_templates(connect, template_dir=DEFAULT_TEMPLATE_DIR, n_values=TEMPLATES):
+    """{n: Structure} of the prototypes, fetching missing ones with connect()."""
+    os.makedirs(template_dir, exist_ok=True)
+    templates, missing = {}, []
+    for n in n_values:
+        path = os.path.join(template_dir, f"{TEMPLATES[n][0]}.cif")
+        if os.path.exists(path):
+            templates[n] = Structure.from_file(path)
+        else:
+            missing.append(n)
+    if missing:
+        with connect() as mpr:
+            for n in missing:
+                formula = TEMPLATES[n][0]
+                print(f"\tSearching for stable {formula} template...")
+                with api_call():
+                    docs = mpr.materials.summary.search(
+                        formula=formula,
+                        is_stable=True,
+                        fields=["structure", "material_id"]
+                    )
+                if not docs:
+                    raise ValueError(f"Could not find {formula} in database!")
+                print(f"\tFound template: {docs[0].material_id}")
+                templates[n] = docs[0].structure
+                templates[n].to(filename=os.path.join(template_dir, f"{formula}.cif"))
+    return templates
+
+
+def _spread(species, n_sites):
+    # hand out sites one by one to the species furthest behind its target count
+    assigned = dict.fromkeys(species, 0)
+    order = []
+    for i in range(1, n_sites + 1):
+        el = max(species, key=lambda e: species[e] * i - assigned[e])
+        assigned[el] += 1
+        order.append(el)
+    return order
+
+
+def _repeats(site_counts, fractions, max_repeats=12):
+    for repeats in range(1, max_repeats + 1):
+        if all(abs(count * repeats * f - round(count * repeats * f)) < 1e-6
+               for count, species in zip(site_counts, fractions) for f in species.values()):
+            return repeats
+    raise ValueError(f"Site fractions {fractions} need more than {max_repeats} cell repeats")
+
+
+def substitute(formula, templates):
+    """Ordered structure for a candidate formula, built from its prototype."""
+    n, m_site, a_site, x = parse_candidate(formula)
+    _, template_m, template_a, template_x = TEMPLATES[n]
+    roles = {template_m: m_site, template_a: a_site, template_x: {x: 1.0}}
+
+    structure = templates[n].copy()
+    site_counts = [sum(site.specie.symbol == el for site in structure) for el in roles]
+    repeats = _repeats(site_counts, list(roles.values()))
+    if repeats > 1:
+        structure.make_supercell([repeats, 1, 1])
+
+    template_species = [site.specie.symbol for site in structure]
+    species = list(template_species)
+    for template_el, site_species in roles.items():
+        # walk the sites layer by layer so mixed sites alternate along c
+        indices = sorted((i for i, el in enumerate(template_species) if el == template_el),
+                         key=lambda i: tuple(structure[i].frac_coords[::-1]))
+        for i, el in zip(indices, _spread(site_species, len(indices))):
+            species[i] = el
+    return Structure(structure.lattice, species, structure.frac_coords)
@@ -0,0 +1,158 @@
+# Staged CHGNet relaxation with early abort
+# StructOptimizer.relax runs to convergence or to the step limit, and only then
+# is the volume change checked, so a collapsing or exploding candidate burns
+# the whole step budget. Here the ASE optimizer is stepped directly and every
+# step's volume, energy per atom and largest force are checked:
+#   abort    volume change beyond abort_volume_change, energy more than
+#            abort_energy_rise above the start (a diverging run) or a force
+#            above abort_force (overlapping atoms)
+#   triage   a loose fmax first; a candidate whose volume already changed by
+#            more than max_volume_change is rejected here
+#   refine   only the survivors continue to the tight fmax
+# The part of the step budget a stopped candidate did not use is reported as
+# steps_saved.
+import pickle
+
+import numpy as np
+
+OPTIMIZERS = ['BFGS', 'FIRE']
+CELL_FILTERS = ['frechet', 'exp', 'none']
+
+
+def _optimizer_class(name):
+    from ase.optimize import BFGS, FIRE #type: ignore
+
+    return {'BFGS': BFGS, 'FIRE': FIRE}[name]
+
+
+def _cell_filter(name, atoms):
+    if name == 'none':
+        return atoms
+    try:
+        from ase.filters import ExpCellFilter, FrechetCellFilter #type: ignore
+    except ImportError:
+        # ASE < 3.23 only has ExpCellFilter, in ase.constraints
+        from ase.constraints import ExpCellFilter #type: ignore
+        FrechetCellFilter = None
+    if name == 'frechet' and FrechetCellFilter is not None:
+        return FrechetCellFilter(atoms)
+    return ExpCellFilter(atoms)
+
+
+def _to_atoms(structure):
+    from pymatgen.io.ase import AseAtomsAdaptor #type: ignore
+
+    return AseAtomsAdaptor.get_atoms(structure)
+
+
+def _to_structure(atoms):
+    from pymatgen.io.ase import AseAtomsAdaptor #type: ignore
+
+    return AseAtomsAdaptor.get_structure(atoms)
+
+
+class StagedRelaxer:
+    """Triage at a loose fmax, refine survivors at fmax, abort runs that are clearly lost.
+
+    Set triage_fmax to None to go straight to fmax (early abort still applies).
+    """
+
+    def __init__(self, model, optimizer='BFGS', cell_filter='frechet', fmax=0.1, steps=500,
+                 triage_fmax=0.5, triage_steps=100, max_volume_change=10.0, abort_volume_change=20.0,
+                 abort_energy_rise=1.0, abort_force=50.0):
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer '{optimizer}', choose from {OPTIMIZERS}")
+        if cell_filter not in CELL_FILTERS:
+            raise ValueError(f"Unknown cell filter '{cell_filter}', choose from {CELL_FILTERS}")
+        self.model = model
+        self.optimizer, self.cell_filter = optimizer, cell_filter
+        self.fmax, self.steps = fmax, steps
+        self.triage_fmax, self.triage_steps = triage_fmax, triage_steps
+        self.max_volume_change = max_volume_change
+        self.abort_volume_change = abort_volume_change
+        self.abort_energy_rise = abort_energy_rise
+        self.abort_force = abort_force
+
+    def settings(self):
+        """Every option a relaxation result depends on, apart from the model."""
+        return {
+            'optimizer': self.optimizer, 'cell_filter': self.cell_filter, 'fmax': self.fmax, 'steps': self.steps,
+            'triage_fmax': self.triage_fmax, 'triage_steps': self.triage_steps,
+            'max_volume_change': self.max_volume_change, 'abort_volume_change': self.abort_volume_change,
+            'abort_energy_rise': self.abort_energy_rise, 'abort_force': self.abort_force,
+        }
+
+    def _abort_reason(self, energy, energy_initial, volume_change, max_force):
+        if abs(volume_change) > self.abort_volume_change:
+            return f"volume change {volume_change:.1f}%"
+        if energy - energy_initial > self.abort_energy_rise:
+            return f"energy rose by {energy - energy_initial:.2f} eV/atom"
+        if max_force > self.abort_force:
+            return f"max force {max_force:.1f} eV/A"
+        return None
+
+    def relax(self, structure, save_path=None):
+        """Relax a pymatgen Structure, returns a dict with the final structure, status and step counts.
+
+        status is 'converged', 'unconverged' (step budget used up), 'rejected'
+        (volume change above max_volume_change after triage) or 'aborted'.
+        """
+        from chgnet.model.dynamics import CHGNetCalculator #type: ignore
+
+        atoms = _to_atoms(structure)
+        atoms.calc = CHGNetCalculator(model=self.model)
+        n_atoms, volume_initial = len(atoms), atoms.get_volume()
+        trajectory = {'energy': [], 'max_force': [], 'volume': [], 'cell': [], 'atom_positions': []}
+
+        stages = []
+        if self.triage_fmax and self.triage_fmax > self.fmax:
+            stages.append(('triage', self.triage_fmax, min(self.triage_steps, self.steps)))
+        stages.append(('refine', self.fmax, None))
+
+        steps = {'triage': 0, 'refine': 0}
+        status, reason = 'unconverged', None
+        for stage, fmax, budget in stages:
+            budget = self.steps - sum(steps.values()) if budget is None else budget
+            # a fresh optimizer per stage, so step counting does not depend on the ASE version
+            optimizer = _optimizer_class(self.optimizer)(_cell_filter(self.cell_filter, atoms), logfile=None)
+            converged = False
+            for i, converged in enumerate(optimizer.irun(fmax=fmax, steps=budget)):
+                energy = atoms.get_potential_energy() / n_atoms
+                max_force = float(np.linalg.norm(atoms.get_forces(), axis=1).max())
+                volume = atoms.get_volume()
+                trajectory['energy'].append(energy)
+                trajectory['max_force'].append(max_force)
+                trajectory['volume'].append(volume)
+                trajectory['cell'].append(np.array(atoms.get_cell()))
+                trajectory['atom_positions'].append(atoms.get_positions())
+                steps[stage] = i
+                reason = self._abort_reason(energy, trajectory['energy'][0],
+                                            (volume - volume_initial) / volume_initial * 100, max_force)
+                if reason:
+                    status = 'aborted'
+                    break
+            if status == 'aborted':
+                break
+            volume_change = (atoms.get_volume() - volume_initial) / volume_initial * 100
+            if stage == 'triage' and abs(volume_change) > self.max_volume_change:
+                status, reason = 'rejected', f"volume change {volume_change:.1f}% after triage"
+                break
+            if stage == 'refine':
+                status = 'converged' if converged else 'unconverged'
+
+        if save_path:
+            with open(save_path, 'wb') as f:
+                pickle.dump(trajectory, f)
+        used = sum(steps.values())
+        return {
+            'final_structure': _to_structure(atoms),
+            'trajectory': trajectory,
+            'status': status,
+            'stop_reason': reason,
+            'energy_initial': trajectory['energy'][0],
+            'energy_final': trajectory['energy'][-1],
+            'steps': used,
+            'steps_triage': steps['triage'],
+            'steps_refine': steps['refine'],
+            'steps_saved': self.steps - used if status in ('aborted', 'rejected') else 0,
+        }
@@ -0,0 +1,141 @@
+# Persistent cache of relaxed structures, matched by symmetry
+# Substituting many M/A/X combinations into the prototypes produces the same
+# crystal more than once: in later runs, from a supercell of an ordered solid
+# solution next to its primitive cell, or from two spellings of one formula.
+# Before a structure is relaxed it is looked up in two steps:
+#   1. fingerprint: reduced formula, space group number and a hash of the
+#      rounded Niggli-reduced primitive lattice select one bucket
+#   2. StructureMatcher runs only against the unrelaxed inputs in that bucket
+# A match returns the cached relaxed structure and energies without running
+# CHGNet. Entries are only reused for the same CHGNet version, fmax, step
+# limit and relaxation options. Layout of geometry/structure_cache/:
+# An entry id hashes the input structure together with those settings, so a
+# relaxation with other settings is stored next to it instead of over it.
+#   index.json        entry id -> bucket, settings and result record
+#   <id>/input.cif    structure as it was before the relaxation
+#   <id>/relaxed.cif  relaxed structure
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.path.join(project_root, 'geometry', 'structure_cache')
+
+
+def structure_hash(structure):
+    """Short hash of lattice, species and fractional coordinates."""
+    payload = json.dumps([
+        np.round(structure.lattice.matrix, 6).tolist(),
+        [site.species_string for site in structure],
+        np.round(np.mod(structure.frac_coords, 1.0), 6).tolist(),
+    ])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def entry_key(structure, settings):
+    """Cache entry id: the input structure hashed together with the relaxation settings."""
+    payload = f"{structure_hash(structure)}|{json.dumps(settings, sort_keys=True)}"
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def chgnet_version():
+    import chgnet #type: ignore
+
+    return getattr(chgnet, '__version__', None)
+
+
+class RelaxationCache:
+    """On-disk relaxed structures, found by fingerprint bucket then StructureMatcher."""
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, symprec=0.1):
+        from pymatgen.analysis.structure_matcher import StructureMatcher #type: ignore
+
+        self.path = path
+        self.symprec = symprec
+        self.matcher = StructureMatcher()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0         # misses that matched another structure of the same run
+        self.matcher_calls = 0
+        self.entries = {}
+        index_path = os.path.join(path, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.entries = json.load(f)
+        self._buckets = {}
+        for entry_id, entry in self.entries.items():
+            self._buckets.setdefault(entry['bucket'], []).append(entry_id)
+        self._inputs = {}
+
+    def fingerprint(self, structure):
+        """Bucket key: reduced formula, space group number and reduced primitive lattice hash."""
+        from pymatgen.symmetry.analyzer import SpacegroupAnalyzer #type: ignore
+
+        try:
+            analyzer = SpacegroupAnalyzer(structure, symprec=self.symprec)
+            number = analyzer.get_space_group_number()
+            primitive = analyzer.find_primitive() or structure
+        except Exception:
+            # spglib gives up on some distorted cells, they still get a bucket
+            number, primitive = 0, structure.get_primitive_structure()
+        lattice = primitive.lattice.get_niggli_reduced_lattice()
+        params = np.round(lattice.abc, 1).tolist() + np.round(lattice.angles, 0).tolist()
+        lattice_hash = hashlib.sha256(json.dumps(params).encode()).hexdigest()[:12]
+        return f"{structure.composition.reduced_formula}|{number}|{lattice_hash}"
+
+    def _input(self, entry_id):
+        from pymatgen.core import Structure #type: ignore
+
+        if entry_id not in self._inputs:
+            self._inputs[entry_id] = Structure.from_file(os.path.join(self.path, entry_id, 'input.cif'))
+        return self._inputs[entry_id]
+
+    def matches(self, structure, other):
+        self.matcher_calls += 1
+        return self.matcher.fit(structure, other)
+
+    def lookup(self, structure, settings, bucket=None):
+        """Id of a cached relaxation of an equivalent structure with the same settings, else None."""
+        bucket = bucket or self.fingerprint(structure)
+        for entry_id in self._buckets.get(bucket, []):
+            if self.entries[entry_id]['settings'] == settings and self.matches(structure, self._input(entry_id)):
+                self.hits += 1
+                return entry_id
+        self.misses += 1
+        return None
+
+    def store(self, structure, relaxed_path, record, settings, bucket=None):
+        """Add a finished relaxation (input structure, relaxed CIF, result record), return its id."""
+        bucket = bucket or self.fingerprint(structure)
+        entry_id = entry_key(structure, settings)
+        directory = os.path.join(self.path, entry_id)
+        os.makedirs(directory, exist_ok=True)
+        structure.to(filename=os.path.join(directory, 'input.cif'))
+        shutil.copyfile(relaxed_path, os.path.join(directory, 'relaxed.cif'))
+        if entry_id not in self.entries:
+            self._buckets.setdefault(bucket, []).append(entry_id)
+        self.entries[entry_id] = {'bucket': bucket, 'settings': settings, 'record': record}
+        self._inputs[entry_id] = structure
+        self.save()
+        return entry_id
+
+    def relaxed_path(self, entry_id):
+        return os.path.join(self.path, entry_id, 'relaxed.cif')
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        index_path = os.path.join(self.path, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        saved = self.hits + self.duplicates
+        rate = saved / lookups if lookups else 0.0
+        return (f"Structure cache: {self.hits} hits and {self.duplicates} duplicates within the run out of "
+                f"{lookups} structures ({rate:.0%} not relaxed), {self.matcher_calls} StructureMatcher "
+                f"comparisons, {len(self.entries)} entries.")
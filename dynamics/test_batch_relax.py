@@ -0,0 +1,88 @@
+# Relaxation checkpoints keyed by settings, with a stand-in relaxer (no CHGNet needed)
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dynamics.batch_relax as batch_relax
+from dynamics.batch_relax import collect_results, is_done, load_result, relax_one, relax_settings
+from dynamics.cascade import relax_tier
+from dynamics.staged_relax import StagedRelaxer
+
+pytest.importorskip('pymatgen')
+
+
+class StubRelaxer(StagedRelaxer):
+    """StagedRelaxer settings, relax() only swells the cell by 1% and counts calls."""
+
+    def __init__(self, **kwargs):
+        super().__init__(None, **kwargs)
+        self.relaxed = []
+
+    def relax(self, structure, save_path=None):
+        self.relaxed.append(structure.composition.reduced_formula)
+        final = structure.copy()
+        final.scale_lattice(structure.volume * 1.01)
+        return {'final_structure': final, 'energy_initial': -8.0, 'energy_final': -8.2, 'status': 'converged',
+                'stop_reason': 'fmax', 'steps': 12, 'steps_saved': 0}
+
+
+@pytest.fixture(autouse=True)
+def chgnet_version(monkeypatch):
+    version = {'value': '0.3.0'}
+    monkeypatch.setattr(batch_relax, 'chgnet_version', lambda: version['value'])
+    return version
+
+
+def structure(formula='Nb2SiC'):
+    from pymatgen.core import Lattice, Structure #type: ignore
+
+    species = {'Nb2SiC': ['Nb', 'Nb', 'Si', 'C'], 'Ti2AlC': ['Ti', 'Ti', 'Al', 'C']}[formula]
+    coords = [[1 / 3, 2 / 3, 0.08], [2 / 3, 1 / 3, 0.58], [1 / 3, 2 / 3, 0.75], [0, 0, 0]]
+    return Structure(Lattice.hexagonal(3.2, 12.6), species, coords)
+
+
+def test_checkpoint_is_keyed_by_settings(tmp_path, chgnet_version):
+    output_dir = str(tmp_path)
+    loose, tight = StubRelaxer(fmax=0.1), StubRelaxer(fmax=0.05)
+    record = relax_one(loose, 'Nb2SiC', structure(), output_dir)
+    assert record['status'] == 'converged' and record['held_shape']
+    assert record['volume_change'] == pytest.approx(1.0)
+
+    assert is_done(output_dir, 'Nb2SiC', relax_settings(loose))
+    assert load_result(output_dir, 'Nb2SiC', relax_settings(loose)) == record
+    assert not is_done(output_dir, 'Nb2SiC', relax_settings(tight))
+    assert not is_done(output_dir, 'Nb2SiC', relax_settings(StubRelaxer(fmax=0.1, optimizer='FIRE')))
+    assert not is_done(output_dir, 'Ti2AlC', relax_settings(loose))
+
+    # a new CHGNet release invalidates every checkpoint
+    chgnet_version['value'] = '0.4.0'
+    assert not is_done(output_dir, 'Nb2SiC', relax_settings(loose))
+
+
+def test_relax_tier_reuses_only_matching_checkpoints(tmp_path):
+    output_dir = str(tmp_path)
+    loose, tight = StubRelaxer(fmax=0.1), StubRelaxer(fmax=0.05)
+    relax_one(loose, 'Nb2SiC', structure(), output_dir)
+
+    batch = [{'formula': 'Nb2SiC', '_structure': structure()}]
+    again = StubRelaxer(fmax=0.1)
+    assert relax_tier(again, output_dir).run(batch)[0]['held_shape']
+    assert again.relaxed == []
+    relax_tier(tight, output_dir).run(batch)
+    assert tight.relaxed == ['Nb2SiC']
+
+
+def test_collect_results_reads_only_the_run(tmp_path):
+    output_dir = str(tmp_path)
+    loose, tight = StubRelaxer(fmax=0.1), StubRelaxer(fmax=0.05)
+    relax_one(loose, 'Nb2SiC', structure('Nb2SiC'), output_dir)
+    relax_one(loose, 'Ti2AlC', structure('Ti2AlC'), output_dir)
+    relax_one(tight, 'Ti2AlC', structure('Ti2AlC'), output_dir)
+
+    table = collect_results(['Ti2AlC', 'V2PC'], relax_settings(loose), output_dir)
+    assert table['formula'].tolist() == ['Ti2AlC']
+    assert collect_results(['Nb2SiC'], relax_settings(tight), output_dir).empty
+    assert sorted(collect_results(['Nb2SiC', 'Ti2AlC'], relax_settings(loose), output_dir)['formula']) \
+        == ['Nb2SiC', 'Ti2AlC']
@@ -0,0 +1,128 @@
+# Cascade budgets and failure handling with stand-in tiers (no CHGNet needed)
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamics.cascade import Cascade, Tier, rf_tier
+
+
+def run_cascade(cascade, candidates, timeout=30):
+    # a worker that dies without releasing its downstream tier would hang run() forever
+    thread = threading.Thread(target=cascade.run, args=(candidates,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "cascade did not finish"
+    return cascade.survivors
+
+
+def candidates(n):
+    return [{'formula': f"C{i}", 'value': i, 'tier': None, 'outcome': 'not reached'} for i in range(n)]
+
+
+def passthrough(batch):
+    return [{} for _ in batch]
+
+
+def test_budget_keeps_the_first_candidates():
+    items = candidates(50)
+    first = Tier('first', passthrough, lambda c: c['value'] % 2 == 0, batch_size=4)
+    second = Tier('second', passthrough, lambda c: True, max_items=5)
+    survivors = run_cascade(Cascade([first, second]), items)
+
+    # fed best-first, so the budget goes to the five best candidates that got this far
+    assert [c['formula'] for c in survivors] == ['C0', 'C2', 'C4', 'C6', 'C8']
+    assert second.taken == second.passed == 5
+    assert second.received == second.taken + second.over_budget
+    # every candidate ends in exactly one state
+    outcomes = [c['outcome'] for c in items]
+    assert outcomes.count('passed') == len(survivors)
+    assert outcomes.count('rejected') == first.rejected
+    assert outcomes.count('over budget') == first.over_budget + second.over_budget
+    assert len(survivors) + first.rejected + first.over_budget + second.over_budget == len(items)
+
+
+def test_spent_tier_stops_upstream():
+    items = candidates(200)
+
+    def slow(batch):
+        time.sleep(0.01)
+        return [{} for _ in batch]
+
+    first = Tier('first', slow, lambda c: True)
+    second = Tier('second', passthrough, lambda c: True, max_items=2)
+    # once the second tier has spent its budget the first one stops too
+    run_cascade(Cascade([first, second]), items)
+    assert second.passed == 2
+    assert first.closed
+    assert first.passed < 20
+    assert sum(c['outcome'] == 'over budget' for c in items) == first.over_budget + second.over_budget
+
+
+def test_seconds_budget():
+    items = candidates(30)
+
+    def slow(batch):
+        time.sleep(0.02)
+        return [{} for _ in batch]
+
+    tier = Tier('slow', slow, lambda c: True, max_seconds=0.1)
+    run_cascade(Cascade([tier]), items)
+    assert 0 < tier.passed < len(items)
+    assert tier.passed + tier.over_budget == len(items)
+
+
+def test_failing_run_fails_only_its_candidate():
+    def run(batch):
+        if any(c['value'] == 3 for c in batch):
+            raise RuntimeError("bad structure")
+        return [{'score': c['value']} for c in batch]
+
+    items = candidates(8)
+    tier = Tier('tier', run, lambda c: True, batch_size=4)
+    survivors = run_cascade(Cascade([tier]), items)
+    assert len(survivors) == 7
+    assert tier.errors == 1
+    assert items[3]['outcome'] == 'error' and 'bad structure' in items[3]['error']
+
+
+def test_raising_pass_criterion_does_not_hang():
+    # e.g. an aborted relaxation without 'held_shape' reaching the relax tier's criterion
+    def run(batch):
+        return [{} if c['value'] % 3 == 0 else {'held_shape': True} for c in batch]
+
+    items = candidates(12)
+    first = Tier('relax', run, lambda c: c['held_shape'], batch_size=2, workers=2)
+    second = Tier('formation', passthrough, lambda c: True)
+    survivors = run_cascade(Cascade([first, second]), items)
+    assert first.errors == 4
+    assert len(survivors) == 8
+    for candidate in items:
+        if candidate['value'] % 3 == 0:
+            assert candidate['outcome'] == 'error' and 'held_shape' in candidate['error']
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_worker_crash_still_releases_downstream():
+    items = candidates(5)
+    # a run that returns nothing breaks the worker loop itself, not one candidate
+    first = Tier('first', lambda batch: None, lambda c: True)
+    second = Tier('second', passthrough, lambda c: True)
+    run_cascade(Cascade([first, second]), items)
+    assert second.passed == 0
+
+
+def test_rf_tier_passes_above_min_stability():
+    def score(formulas):
+        stability = np.array([float(f[1:]) for f in formulas])
+        return {'pred_bulk_modulus': stability, 'pred_density': stability + 1, 'stability': stability,
+                'specific_stiffness': stability}
+
+    items = [{'formula': f"C{s}"} for s in (66, 67, 68)]
+    survivors = run_cascade(Cascade([rf_tier(score, min_stability=67, batch_size=8)]), items)
+    # strictly above, like utils/screening.py
+    assert [c['formula'] for c in survivors] == ['C68']
@@ -0,0 +1,46 @@
+# RelaxationCache lookups and entries keyed by structure and settings
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamics.structure_cache import RelaxationCache, entry_key, structure_hash
+
+pytest.importorskip('pymatgen')
+
+
+def nb2sic():
+    from pymatgen.core import Lattice, Structure #type: ignore
+
+    coords = [[1 / 3, 2 / 3, 0.08], [2 / 3, 1 / 3, 0.58], [1 / 3, 2 / 3, 0.75], [0, 0, 0]]
+    return Structure(Lattice.hexagonal(3.2, 12.6), ['Nb', 'Nb', 'Si', 'C'], coords)
+
+
+def test_settings_get_their_own_entries(tmp_path):
+    structure = nb2sic()
+    relaxed_path = str(tmp_path / 'relaxed.cif')
+    structure.to(filename=relaxed_path)
+    loose, tight = {'model': '0.3.0', 'fmax': 0.1}, {'model': '0.3.0', 'fmax': 0.05}
+
+    cache = RelaxationCache(str(tmp_path / 'cache'))
+    first = cache.store(structure, relaxed_path, {'energy_final': -8.2}, loose)
+    second = cache.store(structure, relaxed_path, {'energy_final': -8.3}, tight)
+    assert first != second and len(cache.entries) == 2
+    assert first == entry_key(structure, loose) != structure_hash(structure)
+
+    # both survive a reload and are found only with their own settings
+    cache = RelaxationCache(str(tmp_path / 'cache'))
+    assert cache.lookup(structure, loose) == first
+    assert cache.entries[cache.lookup(structure, tight)]['record'] == {'energy_final': -8.3}
+    assert cache.lookup(structure, {'model': '0.4.0', 'fmax': 0.1}) is None
+
+
+def test_equivalent_supercell_is_found(tmp_path):
+    structure = nb2sic()
+    relaxed_path = str(tmp_path / 'relaxed.cif')
+    structure.to(filename=relaxed_path)
+    settings = {'model': '0.3.0', 'fmax': 0.1}
+    cache = RelaxationCache(str(tmp_path / 'cache'))
+    entry_id = cache.store(structure, relaxed_path, {}, settings)
+    assert cache.lookup(structure * (2, 1, 1), settings) == entry_id
@@ -0,0 +1,86 @@
+# Importance-driven feature pruning for the random forest models
+# Both models are fitted once on a training split with every feature, and the
+# features are ranked by impurity importance (or permutation importance on the
+# held-out split), averaged over bulk modulus, density and stability. Forests
+# are then refitted on the top k features for a shrinking series of k and the
+# smallest subset whose held-out R^2 and accuracy both stay within the budget
+# of the full feature set is kept. Models trained on it record the columns in
+# feature_names_in_, which is what screening featurizes.
+import numpy as np
+import pandas as pd
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.model_selection import train_test_split
+
+from models.model_selection import make_classifier, make_regressor
+
+PRUNE_METHODS = ['impurity', 'permutation']
+PRUNE_FRACTIONS = [0.75, 0.5, 0.35, 0.25, 0.15, 0.1, 0.05]
+
+
+def _normalized(importance):
+    importance = np.clip(importance, 0, None)
+    total = importance.sum()
+    return importance / total if total > 0 else importance
+
+
+def feature_importance(model, clf, X, y_reg, y_stability, method='impurity', n_jobs=None, random_state=67):
+    """Mean normalised importance of every column over the two regressor outputs and the classifier.
+
+    X and the targets are only used by the permutation method and should be held out.
+    """
+    if method not in PRUNE_METHODS:
+        raise ValueError(f"Unknown importance method '{method}', choose from {PRUNE_METHODS}")
+    y_reg = np.asarray(y_reg)
+    per_model = []
+    for i, forest in enumerate(model.estimators_):
+        if method == 'impurity':
+            per_model.append(forest.feature_importances_)
+        else:
+            per_model.append(permutation_importance(forest, X, y_reg[:, i], n_repeats=5, n_jobs=n_jobs,
+                                                    random_state=random_state).importances_mean)
+    if method == 'impurity':
+        per_model.append(clf.feature_importances_)
+    else:
+        per_model.append(permutation_importance(clf, X, y_stability, n_repeats=5, n_jobs=n_jobs,
+                                                random_state=random_state).importances_mean)
+    return pd.Series(np.mean([_normalized(v) for v in per_model], axis=0), index=X.columns)
+
+
+def select_features(X, y_reg, y_stability, params, method='impurity', budget=0.01, test_size=0.2,
+                    n_jobs=-1, random_state=67):
+    """Smallest importance-ranked subset within budget of the full set's held-out scores.
+
+    Returns the kept columns (in X's order), the importance of every column
+    and a table of the held-out scores of every subset size tried.
+    """
+    train, test = train_test_split(np.arange(len(X)), test_size=test_size, random_state=random_state,
+                                   stratify=y_stability)
+
+    def fit(columns):
+        model = make_regressor(params['regressor'], n_jobs=n_jobs).fit(X.iloc[train][columns], y_reg.iloc[train])
+        clf = make_classifier(params['stability'], n_jobs=n_jobs).fit(X.iloc[train][columns],
+                                                                      y_stability.iloc[train])
+        scores = {
+            'n_features': len(columns),
+            'regressor_score': r2_score(y_reg.iloc[test], model.predict(X.iloc[test][columns])),
+            'stability_score': accuracy_score(y_stability.iloc[test], clf.predict(X.iloc[test][columns])),
+        }
+        return model, clf, scores
+
+    model, clf, full = fit(list(X.columns))
+    importance = feature_importance(model, clf, X.iloc[test], y_reg.iloc[test], y_stability.iloc[test],
+                                    method, n_jobs=n_jobs, random_state=random_state)
+    ranked = importance.sort_values(ascending=False, kind='stable').index.tolist()
+
+    rows, kept = [full], list(X.columns)
+    for k in sorted({max(1, round(len(ranked) * f)) for f in PRUNE_FRACTIONS}, reverse=True):
+        subset = [c for c in X.columns if c in set(ranked[:k])]
+        _, _, scores = fit(subset)
+        scores['within_budget'] = (scores['regressor_score'] >= full['regressor_score'] - budget
+                                   and scores['stability_score'] >= full['stability_score'] - budget)
+        rows.append(scores)
+        if scores['within_budget']:
+            kept = subset
+    rows[0]['within_budget'] = True
+    return kept, importance.sort_values(ascending=False), pd.DataFrame(rows)
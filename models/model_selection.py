@@ -0,0 +1,130 @@
+# Parallel cross-validated sweep over the random forest hyperparameters
+# Every (model, configuration, fold) triple is an independent task and all of
+# them run on a joblib process pool with single-threaded forests, which keeps
+# every core busy without nested parallelism. Each task records the held-out
+# score (mean R^2 over bulk modulus and density for the regressor, accuracy
+# for the stability classifier), fit time, prediction time per 1000 rows and
+# pickled model size. choose() then takes the configuration with the fastest
+# inference whose score is within a tolerance of the best one.
+import itertools
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.model_selection import KFold, StratifiedKFold
+from sklearn.multioutput import MultiOutputRegressor
+
+# the sklearn defaults the models were originally trained with
+DEFAULT_PARAMS = {
+    'regressor': {'n_estimators': 100, 'max_depth': None, 'max_features': 1.0},
+    'stability': {'n_estimators': 100, 'max_depth': None, 'max_features': 'sqrt'},
+}
+SWEEP_GRID = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [None, 24, 16, 10],
+    'max_features': [1.0, 0.5, 'sqrt'],
+}
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'training_config.json')
+
+
+def make_regressor(params, n_jobs=None, random_state=67):
+    return MultiOutputRegressor(RandomForestRegressor(**params, n_jobs=n_jobs, random_state=random_state))
+
+
+def make_classifier(params, n_jobs=None, random_state=67):
+    return RandomForestClassifier(**params, n_jobs=n_jobs, random_state=random_state)
+
+
+def load_params(path=CONFIG_PATH):
+    """Chosen parameters per model ('regressor', 'stability'), the defaults if no sweep was run."""
+    if not os.path.exists(path):
+        return {kind: dict(params) for kind, params in DEFAULT_PARAMS.items()}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_params(params, path=CONFIG_PATH):
+    with open(path, 'w') as f:
+        json.dump(params, f, indent=1)
+
+
+def _evaluate(kind, params, X, y, train, test):
+    model = make_regressor(params) if kind == 'regressor' else make_classifier(params)
+    t0 = time.perf_counter()
+    model.fit(X.iloc[train], y.iloc[train])
+    fit_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    predictions = model.predict(X.iloc[test])
+    predict_seconds = time.perf_counter() - t0
+    if kind == 'regressor':
+        score = r2_score(y.iloc[test], predictions)
+    else:
+        score = accuracy_score(y.iloc[test], predictions)
+    return {
+        'model': kind, **{k: params[k] for k in SWEEP_GRID},
+        'score': score,
+        'fit_seconds': fit_seconds,
+        'predict_ms_per_1k': 1e6 * predict_seconds / len(test),
+        'size_mb': len(pickle.dumps(model)) / 1e6,
+    }
+
+
+def sweep(X, y_reg, y_stability, grid=SWEEP_GRID, cv=5, n_jobs=-1, random_state=67):
+    """Cross-validate every configuration of the grid for both models, mean over folds."""
+    configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    reg_folds = list(KFold(cv, shuffle=True, random_state=random_state).split(X))
+    clf_folds = list(StratifiedKFold(cv, shuffle=True, random_state=random_state).split(X, y_stability))
+    tasks = [('regressor', params, y_reg, fold) for params in configs for fold in reg_folds]
+    tasks += [('stability', params, y_stability, fold) for params in configs for fold in clf_folds]
+
+    print(f"Cross-validating {len(configs)} configurations x {cv} folds x 2 models on {n_jobs} jobs...")
+    t0 = time.perf_counter()
+    rows = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate)(kind, params, X, y, train, test) for kind, params, y, (train, test) in tasks
+    )
+    print(f"Sweep finished in {time.perf_counter() - t0:.1f}s.")
+
+    results = pd.DataFrame(rows)
+    # dropna=False keeps max_depth=None (unlimited) as its own group
+    results = results.groupby(['model'] + list(grid), sort=False, dropna=False).agg(
+        score=('score', 'mean'), score_std=('score', 'std'), fit_seconds=('fit_seconds', 'mean'),
+        predict_ms_per_1k=('predict_ms_per_1k', 'mean'), size_mb=('size_mb', 'mean'),
+    ).reset_index()
+    return results
+
+
+def _param(name, value):
+    if pd.isna(value):
+        return None
+    if name in ('n_estimators', 'max_depth'):
+        return int(value)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def choose(results, tolerance=0.01):
+    """Fastest-inference configuration per model whose score is within tolerance of the best."""
+    chosen = {}
+    for kind, group in results.groupby('model'):
+        eligible = group[group['score'] >= group['score'].max() - tolerance]
+        best = eligible.sort_values(['predict_ms_per_1k', 'size_mb']).iloc[0]
+        chosen[kind] = {k: _param(k, best[k]) for k in SWEEP_GRID}
+    return chosen
+
+
+def grow(model, X, y, add_trees, n_jobs=None):
+    """Warm start: keep the fitted trees and fit add_trees new ones on (X, y)."""
+    forests = model.estimators_ if isinstance(model, MultiOutputRegressor) else [model]
+    y = np.asarray(y)
+    for i, forest in enumerate(forests):
+        forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + add_trees, n_jobs=n_jobs)
+        forest.fit(X, y[:, i] if y.ndim == 2 else y)
+        forest.set_params(warm_start=False, n_jobs=None)
+    if isinstance(model, MultiOutputRegressor):
+        model.estimator.set_params(n_estimators=forests[0].n_estimators)
+    return model
@@ -1,18 +1,45 @@
+import argparse
 import os
+import sys
+import time
 import pandas as pd
 import warnings
 
 warnings.filterwarnings('ignore')
 
-from matminer.featurizers.conversions import StrToComposition #type: ignore
-from matminer.featurizers.composition import ElementProperty #type: ignore
-
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.multioutput import MultiOutputRegressor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.magpie import MagpieFeaturizer
+from utils.feature_cache import FeatureCache
+from models.feature_selection import PRUNE_METHODS, select_features
+from utils.instrument import configure, stage
+from models.model_selection import (
+    CONFIG_PATH, choose, grow, load_params, make_classifier, make_regressor, save_params, sweep
+)
 
 import joblib
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the bulk modulus / density and stability forests.")
+    parser.add_argument('--jobs', type=int, default=-1, help="cores used to fit the forests (-1: all)")
+    parser.add_argument('--sweep', action='store_true',
+                        help="cross-validate tree count, depth and max_features before training")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="score (R^2 / accuracy) the sweep may give up for faster inference")
+    parser.add_argument('--warm-start', type=int, default=None, metavar='N_TREES',
+                        help="grow the saved forests by this many trees on the current data instead of retraining")
+    parser.add_argument('--prune', choices=PRUNE_METHODS, default=None,
+                        help="rank features by this importance and train on the smallest subset within --prune-budget")
+    parser.add_argument('--prune-budget', type=float, default=0.01,
+                        help="held-out R^2 / accuracy the pruned feature set may give up")
+    parser.add_argument('--metrics', default=None, help="append per-stage metrics to this JSON-lines file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.prune and args.warm_start:
+        parser.error("--prune retrains the models, it can't be combined with --warm-start")
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+
     # Get paths relative to this script
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)
@@ -25,33 +52,87 @@ if __name__ == '__main__':
     y_stability = data['is_stable'].astype(int)
 
     # calculate X data via featurizers
-    print("Featurizing Dataset (this may take several minutes)...")
-    df = StrToComposition().featurize_dataframe(data, 'formula')
-    ep_feat = ElementProperty.from_preset(preset_name='magpie')
-    df_featurized = ep_feat.featurize_dataframe(df, col_id='composition')
+    print("Featurizing Dataset...")
+    featurizer = FeatureCache(MagpieFeaturizer())
+    with stage('train.featurize', items=len(data)):
+        df_featurized = featurizer.featurize_dataframe(data, col_id='formula')
+    print(f"Feature cache: {featurizer.hits} hits, {featurizer.misses} newly featurized.")
 
     cols_to_drop = target_properties + ['material_id', 'formula', 'shear_modulus', 'is_stable', 'composition']
     X_features = df_featurized.drop(columns=cols_to_drop, errors='ignore')
 
     print(f"Training on {X_features.shape[0]} materials with {X_features.shape[1]} features each.")
 
-    model = MultiOutputRegressor(
-        RandomForestRegressor(
-            n_estimators=100,
-            random_state=67
-        )
-    )
-    model.fit(X_features, y_data)
-    print("Model trained successfully!")
     regressor_path = os.path.join(script_dir, 'regressor.joblib')
-    joblib.dump(model, regressor_path)
-    print(f"Model saved to \"{regressor_path}\"")
-    print()
-    
-    print("Training Stability Predictor.")
-    clf = RandomForestClassifier(n_estimators=100, random_state=67)
-    clf.fit(X_features, y_stability)
-    print("Trained Stability Predictor.")
     stability_path = os.path.join(script_dir, 'stability.joblib')
-    joblib.dump(clf, stability_path)
-    print(f"Model saved to \"{stability_path}\"")
+
+    if args.sweep:
+        with stage('train.sweep'):
+            results = sweep(X_features, y_data, y_stability, cv=args.folds, n_jobs=args.jobs)
+        sweep_path = os.path.join(script_dir, 'sweep_results.csv')
+        results.to_csv(sweep_path, index=False)
+        print(results.sort_values(['model', 'score'], ascending=[True, False]).to_string(
+            index=False, float_format="%.4f"))
+        print(f"Sweep results saved to \"{sweep_path}\"")
+        save_params(choose(results, args.tolerance))
+        print(f"Chosen configuration saved to \"{CONFIG_PATH}\"")
+        print()
+    params = load_params()
+
+    if args.prune:
+        print(f"Ranking features by {args.prune} importance...")
+        with stage('train.prune', items=len(X_features)):
+            kept, importance, report = select_features(X_features, y_data, y_stability, params,
+                                                       method=args.prune, budget=args.prune_budget,
+                                                       n_jobs=args.jobs)
+        print(report.to_string(index=False, float_format="%.4f"))
+        importance_path = os.path.join(script_dir, 'feature_importance.csv')
+        importance.rename('importance').to_csv(importance_path, index_label='feature')
+        print(f"Keeping {len(kept)} of {X_features.shape[1]} features, importances saved to \"{importance_path}\"")
+        print()
+        X_features = X_features[kept]
+
+    if args.warm_start:
+        print(f"Growing the saved forests by {args.warm_start} trees on {len(X_features)} materials...")
+        model, clf = joblib.load(regressor_path), joblib.load(stability_path)
+        # a pruned model keeps its own subset of the columns
+        if not set(model.feature_names_in_) <= set(X_features.columns):
+            raise ValueError("Saved models were trained on different features, retrain without --warm-start")
+        X_features = X_features[list(model.feature_names_in_)]
+        t0 = time.perf_counter()
+        with stage('train.warm_start', items=len(X_features)):
+            grow(model, X_features, y_data, args.warm_start, n_jobs=args.jobs)
+            grow(clf, X_features, y_stability, args.warm_start, n_jobs=args.jobs)
+        print(f"Grew both models in {time.perf_counter() - t0:.1f}s "
+              f"({len(clf.estimators_)} trees per forest).")
+        joblib.dump(model, regressor_path)
+        joblib.dump(clf, stability_path)
+        print(f"Models saved to \"{regressor_path}\" and \"{stability_path}\"")
+        print()
+    else:
+        print(f"Regressor parameters: {params['regressor']}")
+        model = make_regressor(params['regressor'], n_jobs=args.jobs)
+        t0 = time.perf_counter()
+        with stage('train.regressor', items=len(X_features)):
+            model.fit(X_features, y_data)
+        print(f"Model trained successfully in {time.perf_counter() - t0:.1f}s!")
+        # fitted with every core, but scoring runs its own pools
+        model.estimator.set_params(n_jobs=None)
+        for forest in model.estimators_:
+            forest.set_params(n_jobs=None)
+        joblib.dump(model, regressor_path)
+        print(f"Model saved to \"{regressor_path}\"")
+        print()
+
+        print("Training Stability Predictor.")
+        print(f"Classifier parameters: {params['stability']}")
+        clf = make_classifier(params['stability'], n_jobs=args.jobs)
+        t0 = time.perf_counter()
+        with stage('train.stability', items=len(X_features)):
+            clf.fit(X_features, y_stability)
+        clf.set_params(n_jobs=None)
+        print(f"Trained Stability Predictor in {time.perf_counter() - t0:.1f}s.")
+        joblib.dump(clf, stability_path)
+        print(f"Model saved to \"{stability_path}\"")
+        print()
+
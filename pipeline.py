@@ -0,0 +1,323 @@
+# Incremental runner for the whole discovery pipeline
+# Every stage declares the script it runs, its command line parameters, the
+# files it reads and the files it writes. A stage's fingerprint hashes its
+# script together with the local modules that script imports (utils/, models/,
+# dynamics/, ...), its parameters and the contents of its inputs. A stage only
+# runs when its fingerprint changed since the last successful run or one of its
+# outputs is missing or was modified, so changing the screening threshold
+# reruns evaluate.py and what reads candidates.csv and nothing else. A stage
+# whose rerun produces byte-identical outputs does not invalidate the stages
+# after it. Stages whose inputs are ready run concurrently (the plots next to
+# the relaxations); each one's output goes to data/pipeline_logs/<stage>.log.
+# Fingerprints are kept in data/pipeline_state.json.
+#
+#   python pipeline.py                                  everything that is stale
+#   python pipeline.py evaluate --set evaluate.threshold=80
+#   python pipeline.py --dry-run                        what would run and why
+#   python pipeline.py --force get_data                 resync Materials Project
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(project_root, 'data', 'pipeline_state.json')
+LOG_DIR = os.path.join(project_root, 'data', 'pipeline_logs')
+
+# name -> script, parameters, inputs and outputs (paths relative to the project root).
+# get_data has no file inputs, it only runs when its output is missing or with --force.
+# Path parameters are resolved from the script's directory, the scripts' defaults already
+# point at the files listed here.
+STAGES = {
+    'get_data': {
+        'script': 'data/get_data.py',
+        'params': {},
+        'inputs': [],
+        'outputs': ['data/materials_cleaned.csv'],
+    },
+    'train': {
+        'script': 'models/randomforest.py',
+        'params': {},
+        'inputs': ['data/materials_cleaned.csv', 'models/training_config.json'],
+        'outputs': ['models/regressor.joblib', 'models/stability.joblib'],
+    },
+    'evaluate': {
+        'script': 'utils/evaluate.py',
+        'params': {'n-values': '1 2 3', 'fractions': '0.5', 'threshold': '67', 'top-k': '1000'},
+        'inputs': ['models/regressor.joblib', 'models/stability.joblib', 'data/materials_cleaned.csv'],
+        'outputs': ['data/candidates.csv'],
+    },
+    'pareto_plot': {
+        'script': 'utils/pareto_front.py',
+        'params': {},
+        'inputs': ['data/materials_cleaned.csv'],
+        'outputs': ['figures/pareto.png'],
+    },
+    'portfolio_plot': {
+        'script': 'utils/visualize.py',
+        'params': {},
+        'inputs': ['data/materials_cleaned.csv', 'data/candidates.csv'],
+        'outputs': ['figures/portfolio_plot.png'],
+    },
+    'relax': {
+        'script': 'dynamics/batch_relax.py',
+        'params': {'top': '20'},
+        'inputs': ['data/candidates.csv'],
+        'outputs': ['data/relaxations.csv'],
+    },
+    'formation': {
+        'script': 'dynamics/formation.py',
+        'params': {},
+        'inputs': ['data/relaxations.csv'],
+        'outputs': ['data/formation_energies.csv'],
+    },
+    'hull': {
+        'script': 'dynamics/hull.py',
+        'params': {},
+        'inputs': ['data/relaxations.csv'],
+        'outputs': ['data/hull.csv'],
+    },
+}
+
+
+def _hash_file(path, cache):
+    """sha256 of a file, reused from cache while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = os.path.relpath(path, project_root)
+    cached = cache.get(key)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    cache[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return cache[key][2]
+
+
+def content_hash(path, cache):
+    """Hash of a file or of every file under a directory, None if it does not exist."""
+    full = os.path.join(project_root, path)
+    if os.path.isfile(full):
+        return _hash_file(full, cache)
+    if not os.path.isdir(full):
+        return None
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(full):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, full).encode())
+            digest.update(_hash_file(file_path, cache).encode())
+    return digest.hexdigest()
+
+
+def local_modules(script):
+    """The script and every project module it imports, directly or not."""
+    seen, todo = set(), [script]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(os.path.join(project_root, path)) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                names = [node.module]
+            elif isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            else:
+                continue
+            for name in names:
+                module = name.replace('.', '/') + '.py'
+                if os.path.isfile(os.path.join(project_root, module)):
+                    todo.append(module)
+    return sorted(seen)
+
+
+def fingerprint(name, stage, cache):
+    digest = hashlib.sha256()
+    for path in local_modules(stage['script']):
+        digest.update(f"code {path} {content_hash(path, cache)}\n".encode())
+    digest.update(f"params {json.dumps(stage['params'], sort_keys=True)}\n".encode())
+    for path in stage['inputs']:
+        digest.update(f"input {path} {content_hash(path, cache)}\n".encode())
+    return digest.hexdigest()
+
+
+def upstream(stages):
+    """name -> the stages that write its inputs."""
+    writers = {out: name for name, stage in stages.items() for out in stage['outputs']}
+    return {name: sorted({writers[p] for p in stage['inputs'] if p in writers} - {name})
+            for name, stage in stages.items()}
+
+
+def stale_reason(name, stage, state, cache, force):
+    """Why the stage has to run, None if it is up to date."""
+    if name in force:
+        return "forced"
+    record = state['stages'].get(name)
+    for path in stage['outputs']:
+        current = content_hash(path, cache)
+        if current is None:
+            return f"{path} is missing"
+        if record is not None and current != record['outputs'].get(path):
+            return f"{path} was modified"
+    # a source stage (no inputs) is up to date as long as its outputs exist
+    if not stage['inputs']:
+        return None
+    if record is None:
+        return "never ran"
+    if fingerprint(name, stage, cache) != record['fingerprint']:
+        return "code, parameters or inputs changed"
+    return None
+
+
+def command(stage):
+    args = [sys.executable, os.path.join(project_root, stage['script'])]
+    for option, value in stage['params'].items():
+        if value is True:
+            args.append(f"--{option}")
+        elif value is not None and value is not False:
+            args += [f"--{option}", *shlex.split(str(value))]
+    return args
+
+
+def run_stage(name, stage):
+    """Run the stage's script from its own directory, return (exit code, seconds)."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    with open(os.path.join(LOG_DIR, f"{name}.log"), 'w') as log:
+        process = subprocess.run(command(stage), cwd=os.path.dirname(os.path.join(project_root, stage['script'])),
+                                 stdout=log, stderr=subprocess.STDOUT)
+    return process.returncode, time.perf_counter() - t0
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {'stages': {}, 'hashes': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def run(stages, targets=None, force=(), parallel=4, dry_run=False, state_path=STATE_PATH):
+    """Run the stale stages needed for targets (default: all), returns the names of the failed ones."""
+    deps = upstream(stages)
+    wanted, todo = set(), list(targets or stages)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+
+    state = load_state(state_path)
+    cache = state['hashes']
+    finished, failed, ran = set(), set(), set()
+    pending = {name for name in stages if name in wanted}
+
+    def ready(name):
+        return all(d in finished or d in failed or d not in wanted for d in deps[name])
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        running = {}
+        while pending or running:
+            for name in sorted(n for n in pending if ready(n)):
+                pending.discard(name)
+                if any(d in failed for d in deps[name]):
+                    print(f"  {name:<15} skipped, an upstream stage failed")
+                    failed.add(name)
+                    continue
+                reason = stale_reason(name, stages[name], state, cache, force)
+                # a dry run cannot know what reruns would produce, so it assumes they change
+                if reason is None and dry_run and any(d in ran for d in deps[name]):
+                    reason = "upstream reruns"
+                if reason is None:
+                    print(f"  {name:<15} up to date")
+                    finished.add(name)
+                    continue
+                print(f"  {name:<15} runs: {reason}")
+                ran.add(name)
+                if dry_run:
+                    finished.add(name)
+                    continue
+                running[pool.submit(run_stage, name, stages[name])] = name
+            if not running:
+                if pending and not any(ready(n) for n in pending):
+                    raise ValueError(f"Stages {sorted(pending)} depend on each other")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                code, seconds = future.result()
+                stage = stages[name]
+                missing = [p for p in stage['outputs'] if content_hash(p, cache) is None]
+                if code == 0 and not missing:
+                    state['stages'][name] = {
+                        'fingerprint': fingerprint(name, stage, cache),
+                        'outputs': {p: content_hash(p, cache) for p in stage['outputs']},
+                    }
+                    save_state(state, state_path)
+                    finished.add(name)
+                    print(f"  {name:<15} done in {seconds:.1f}s")
+                    continue
+                failed.add(name)
+                why = f"exit code {code}" if code else f"did not write {', '.join(missing)}"
+                print(f"  {name:<15} FAILED ({why}), see {os.path.join(LOG_DIR, name + '.log')}")
+
+    if not dry_run:
+        save_state(state, state_path)
+    return sorted(failed)
+
+
+def apply_overrides(stages, overrides):
+    """stage.option=value assignments from the command line, an empty value drops the option."""
+    for assignment in overrides:
+        key, _, value = assignment.partition('=')
+        name, _, option = key.partition('.')
+        if name not in stages or not option:
+            raise ValueError(f"Expected <stage>.<option>=<value>, got '{assignment}'")
+        if value:
+            stages[name]['params'][option] = value
+        else:
+            stages[name]['params'].pop(option, None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the stale stages of the discovery pipeline.")
+    parser.add_argument('targets', nargs='*',
+                        help="stages to bring up to date, with everything they need (default: all)")
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='STAGE.OPTION=VALUE',
+                        help="command line option of a stage, e.g. evaluate.threshold=80 or evaluate.select=50")
+    parser.add_argument('--force', nargs='+', default=[], choices=list(STAGES), help="rerun these stages")
+    parser.add_argument('--parallel', type=int, default=4, help="stages run at the same time")
+    parser.add_argument('--dry-run', action='store_true', help="only print what would run and why")
+    args = parser.parse_args()
+    unknown = [name for name in args.targets if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s) {', '.join(unknown)}, choose from {', '.join(STAGES)}")
+
+    stages = {name: {**stage, 'params': dict(stage['params'])} for name, stage in STAGES.items()}
+    apply_overrides(stages, args.overrides)
+
+    t0 = time.perf_counter()
+    print("Checking pipeline stages...")
+    failed = run(stages, args.targets or None, set(args.force), args.parallel, args.dry_run)
+    print(f"Finished in {time.perf_counter() - t0:.1f}s.")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        raise SystemExit(1)
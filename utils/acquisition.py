@@ -0,0 +1,119 @@
+# Predictive uncertainty and budget-aware selection for CHGNet validation
+# The spread of a random forest's trees is used as the predictive standard
+# deviation. All per-tree predictions come from one batched pass: every
+# forest's apply() gives the leaf of each (row, tree) pair, which is looked up
+# in a padded (trees, nodes) table of leaf values.
+# Candidates are then picked greedily by acquisition per unit of relaxation
+# cost until the budget is spent. The acquisition is the expected improvement
+# of bulk modulus over the known Pareto front at the candidate's density,
+# weighted by the predicted stability. After every pick the candidate's
+# prediction is added to the front, so the next pick has to improve on it and
+# the batch does not fill up with near-duplicates.
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr #type: ignore
+
+from utils.magpie import parse_formula
+from utils.pareto import pareto_mask
+
+# atoms in the cell of a pure 211 phase (two formula units), one cost unit
+REFERENCE_CELL_ATOMS = 8
+
+
+def _leaf_table(forest):
+    trees = [est.tree_ for est in forest.estimators_]
+    table = np.zeros((len(trees), max(tree.node_count for tree in trees)))
+    for t, tree in enumerate(trees):
+        table[t, :tree.node_count] = tree.value[:, 0, 0]
+    return table
+
+
+def tree_predictions(model, features, labels=None):
+    """Per-tree bulk modulus and density predictions, each an (n, n_trees) array."""
+    X = pd.DataFrame(features, columns=labels)
+    predictions = []
+    for forest in model.estimators_:
+        leaves = forest.apply(X)
+        predictions.append(_leaf_table(forest)[np.arange(leaves.shape[1]), leaves])
+    return predictions
+
+
+def forest_spread(features, model, labels=None):
+    """Standard deviation across trees of bulk modulus, density and specific stiffness."""
+    bulk, density = tree_predictions(model, features, labels)
+    bulk_mean, density_mean = bulk.mean(axis=1), density.mean(axis=1)
+    bulk_std, density_std = bulk.std(axis=1), density.std(axis=1)
+    # the two outputs come from independent forests, so propagate to the ratio
+    stiffness = bulk_mean / density_mean
+    stiffness_std = np.abs(stiffness) * np.hypot(bulk_std / bulk_mean, density_std / density_mean)
+    return {
+        'pred_bulk_modulus_std': bulk_std,
+        'pred_density_std': density_std,
+        'specific_stiffness_std': stiffness_std,
+    }
+
+
+def relaxation_cost(formulas):
+    """Relaxation cost of each candidate in units of an 8-atom 211 cell.
+
+    The cell is two formula units, repeated until every site fraction is a
+    whole number of atoms, like the ordered cells of dynamics/prototypes.py.
+    """
+    cost = np.empty(len(formulas))
+    for i, formula in enumerate(formulas):
+        amounts = np.array(list(parse_formula(formula).values()))
+        for repeats in range(1, 13):
+            n_atoms = 2 * repeats * amounts
+            if np.allclose(n_atoms, np.round(n_atoms)):
+                break
+        cost[i] = n_atoms.sum() / REFERENCE_CELL_ATOMS
+    return cost
+
+
+def expected_improvement(mean, std, limit):
+    """Expected amount by which a normal(mean, std) value exceeds limit."""
+    std = np.maximum(std, 1e-9)
+    z = (mean - limit) / std
+    return (mean - limit) * ndtr(z) + std * np.exp(-0.5 * z ** 2) / np.sqrt(2 * np.pi)
+
+
+def _front_arrays(density, bulk_modulus):
+    points = np.column_stack([density, bulk_modulus])
+    points = points[pareto_mask(points, [False, True])]
+    points = points[np.argsort(points[:, 0], kind='stable')]
+    return points[:, 0], points[:, 1]
+
+
+def select_for_validation(candidates, front, budget):
+    """Pick candidates for relaxation within budget (in 211-cell units).
+
+    candidates needs the screening columns plus pred_bulk_modulus_std, front is
+    a table of known materials with density and bulk_modulus. Returns the picks
+    in order with their acquisition score and cost.
+    """
+    density = candidates['pred_density'].to_numpy()
+    bulk = candidates['pred_bulk_modulus'].to_numpy()
+    bulk_std = candidates['pred_bulk_modulus_std'].to_numpy()
+    p_stable = candidates['stability'].to_numpy() / 100
+    cost = relaxation_cost(candidates['formula'].tolist())
+    front_x, front_y = _front_arrays(front['density'].to_numpy(), front['bulk_modulus'].to_numpy())
+
+    available = np.ones(len(candidates), dtype=bool)
+    picks, scores, spent = [], [], 0.0
+    while available.any():
+        acquisition = p_stable * expected_improvement(bulk, bulk_std, np.interp(density, front_x, front_y))
+        ratio = np.where(available & (cost <= budget - spent + 1e-9), acquisition / cost, -np.inf)
+        i = int(np.argmax(ratio))
+        if ratio[i] == -np.inf:
+            break
+        picks.append(i)
+        scores.append(acquisition[i])
+        spent += cost[i]
+        available[i] = False
+        # believe the prediction until CHGNet says otherwise
+        front_x, front_y = _front_arrays(np.append(front_x, density[i]), np.append(front_y, bulk[i]))
+
+    selected = candidates.iloc[picks].copy()
+    selected['acquisition'] = scores
+    selected['cost'] = cost[picks]
+    return selected.reset_index(drop=True)
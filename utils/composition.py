@@ -0,0 +1,132 @@
+# Interned compositions shared by the training table, screening and novelty
+# Every formula string is parsed once and mapped to a row of its reduced
+# formula, so Ti2AlC, Ti4Al2C2 and (Ti1.0)2AlC share one row. Row r holds the
+# atomic fractions of its elements in a sparse (rows x 118 elements) CSR
+# matrix, which answers element questions for a whole table at once:
+#   contains_any   rows with any of the given elements (blacklists)
+#   within         rows made only of the given elements (chemical subsystems)
+#   groups         rows per chemical system
+# shared_table() is the process-wide instance used by the feature cache,
+# the candidate space and the novelty index.
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from utils.magpie import ELEMENT_INDEX, ELEMENTS, parse_formula, reduced_formula
+
+
+class CompositionTable:
+    """Growing table of interned reduced formulas with a sparse element-fraction matrix."""
+
+    def __init__(self):
+        self.formulas = []          # reduced formula of every row
+        self.systems = []           # chemical system of every row, e.g. 'Al-C-Ti'
+        self._rows = {}             # reduced formula -> row
+        self._spellings = {}        # every formula string seen -> row (-1 if unparseable)
+        self._indptr = [0]
+        self._indices = []
+        self._data = []
+        self._csr = None
+
+    def __len__(self):
+        return len(self.formulas)
+
+    def add(self, comp):
+        """Row of an {element: amount} dict, appended if its reduced formula is new."""
+        key = reduced_formula(comp)
+        row = self._rows.get(key)
+        if row is not None:
+            return row
+        elements = sorted(comp, key=ELEMENT_INDEX.__getitem__)
+        total = sum(comp.values())
+        row = self._rows[key] = len(self.formulas)
+        self.formulas.append(key)
+        self.systems.append("-".join(sorted(comp)))
+        self._indices.extend(ELEMENT_INDEX[el] for el in elements)
+        self._data.extend(comp[el] / total for el in elements)
+        self._indptr.append(len(self._indices))
+        self._csr = None
+        return row
+
+    def intern(self, formulas, errors='raise'):
+        """Rows of a list of formula strings, each distinct spelling is parsed once.
+
+        With errors='coerce' unparseable formulas get row -1 instead of raising.
+        """
+        codes, uniques = pd.factorize(pd.Series(formulas, dtype=object))
+        unique_rows = np.empty(len(uniques), dtype=np.int64)
+        for i, formula in enumerate(uniques):
+            row = self._spellings.get(formula)
+            if row is None:
+                try:
+                    row = self.add(parse_formula(formula))
+                except (ValueError, TypeError):
+                    if errors == 'raise':
+                        raise
+                    row = -1
+                self._spellings[formula] = row
+            elif row < 0 and errors == 'raise':
+                raise ValueError(f"Could not parse formula '{formula}'")
+            unique_rows[i] = row
+        # NaN and None have code -1
+        missing = codes < 0
+        if missing.any() and errors == 'raise':
+            raise ValueError("Missing formula")
+        rows = np.full(len(codes), -1, dtype=np.int64)
+        rows[~missing] = unique_rows[codes[~missing]]
+        return rows
+
+    @property
+    def matrix(self):
+        """(rows, 118) CSR matrix of atomic fractions, columns in Z order."""
+        if self._csr is None:
+            self._csr = sparse.csr_matrix(
+                (np.array(self._data), np.array(self._indices, dtype=np.int32), np.array(self._indptr)),
+                shape=(len(self.formulas), len(ELEMENTS)),
+            )
+        return self._csr
+
+    def _rows_of_entries(self):
+        m = self.matrix
+        return np.repeat(np.arange(m.shape[0]), np.diff(m.indptr))
+
+    def _count_in(self, elements):
+        # number of the given elements in every row
+        m = self.matrix
+        hit = np.isin(m.indices, [ELEMENT_INDEX[el] for el in elements])
+        return np.bincount(self._rows_of_entries()[hit], minlength=m.shape[0])
+
+    def contains_any(self, elements):
+        """Boolean mask over rows, True where a row has any of the elements."""
+        return self._count_in(elements) > 0
+
+    def within(self, elements):
+        """Rows made only of the given elements, e.g. every phase of the Nb-Si-C system."""
+        return np.flatnonzero(self._count_in(elements) == np.diff(self.matrix.indptr))
+
+    def groups(self, rows=None):
+        """{chemical system: rows} of the given rows (default: all)."""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        systems = np.asarray(self.systems, dtype=object)[rows]
+        return {system: rows[pos] for system, pos in pd.Series(systems).groupby(systems).indices.items()}
+
+    def padded(self, rows=None):
+        """Padded (element index, fraction) arrays of the given rows for the Magpie featurizer."""
+        m = self.matrix if rows is None else self.matrix[np.asarray(rows)]
+        counts = np.diff(m.indptr)
+        k = int(counts.max()) if len(counts) else 1
+        entry_rows = np.repeat(np.arange(len(counts)), counts)
+        cols = np.arange(len(entry_rows)) - np.repeat(m.indptr[:-1], counts)
+        idx = np.full((len(counts), k), -1, dtype=np.int16)
+        amounts = np.zeros((len(counts), k))
+        idx[entry_rows, cols] = m.indices
+        amounts[entry_rows, cols] = m.data
+        return idx, amounts
+
+
+_shared = CompositionTable()
+
+
+def shared_table():
+    """The process-wide CompositionTable."""
+    return _shared
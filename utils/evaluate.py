@@ -1,35 +1,84 @@
+import argparse
 import joblib
 import traceback
-import itertools
 import pandas as pd
 import warnings
 import os
+import sys
 from dotenv import load_dotenv
-from mp_api.client import MPRester #type: ignore
 
 warnings.filterwarnings('ignore')
 
-from matminer.featurizers.conversions import StrToComposition #type: ignore
-from matminer.featurizers.composition import ElementProperty #type: ignore
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.feature_cache import FeatureCache
+from utils.magpie import MagpieFeaturizer
+from utils.screening import CandidateSpace, model_feature_labels, model_fingerprint, screen
+from utils.parallel import screen_parallel
+from utils.novelty import KnownFormulaIndex
+from utils.acquisition import forest_spread, select_for_validation
+from utils.instrument import configure, stage
+from utils.scoring_service import DEFAULT_ADDRESS, ScoringClient, load_scorer
 
-def check_material_exists(formula, mpr):
-    """Check if a material exists in the Materials Project database."""
-    docs = mpr.materials.summary.search(
-        formula=formula,
-        fields=["material_id", "formula_pretty", "is_stable", "energy_above_hull"]
-    )
-    return len(docs) > 0
+
+def connect_materials_project():
+    # mp_api takes seconds to import, so only pay for it when a query is needed
+    from mp_api.client import MPRester #type: ignore
+
+    load_dotenv()
+    return MPRester(os.getenv("MATERIALS_API_KEY"))
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Screen hypothetical MAX phases for specific stiffness.")
+    parser.add_argument('--n-values', type=int, nargs='+', default=[1],
+                        help="n in M_(n+1)AX_n (default: M2AX only)")
+    parser.add_argument('--fractions', type=float, nargs='*', default=[],
+                        help="solid solution fraction grid (default: none, pure phases only)")
+    parser.add_argument('--threshold', type=float, default=67, help="minimum predicted stability (%%)")
+    parser.add_argument('--top-k', type=int, default=1000, help="number of candidates to keep")
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--checkpoint', default=None, help="resumable checkpoint file (.npz)")
+    parser.add_argument('--feature-cache', action='store_true',
+                        help="featurize candidates through the on-disk feature cache (pays off when the same "
+                             "space is screened again, costs disk in proportion to its size)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="score shards on a process pool with this many workers")
+    parser.add_argument('--refresh-days', type=float, default=None,
+                        help="re-query chemical systems whose known formulas are older than this")
+    parser.add_argument('--select', type=float, default=None,
+                        help="pick candidates for CHGNet validation within this budget (8-atom relaxations)")
+    parser.add_argument('--formulas', nargs='+', default=None,
+                        help="what-if mode: only score these formulas")
+    parser.add_argument('--service', default=DEFAULT_ADDRESS,
+                        help="address of utils/scoring_service.py, used by --formulas when it is running")
+    parser.add_argument('--metrics', default=None, help="append per-stage metrics to this JSON-lines file")
+    parser.add_argument('--profile', default=None, help="write a cProfile dump per stage to this directory")
+    args = parser.parse_args()
+    if args.metrics or args.profile:
+        configure(args.metrics, args.profile)
+
     # Get paths relative to this script
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)
+    output_cols = ['formula', 'pred_bulk_modulus', 'pred_density', 'specific_stiffness', 'stability']
+
+    if args.formulas:
+        client = ScoringClient(args.service)
+        if client.is_running():
+            results = pd.DataFrame(client.score(args.formulas))
+        else:
+            print("Scoring service not running, loading models locally...")
+            results = pd.DataFrame({'formula': args.formulas, **load_scorer(project_root)(args.formulas)})
+        print(results[output_cols].to_string(index=False, float_format="%.2f"))
+        raise SystemExit(0)
+
     reg_filename = os.path.join(project_root, 'models', 'regressor.joblib')
     clf_filename = os.path.join(project_root, 'models', 'stability.joblib')
     candidates_path = os.path.join(project_root, 'data', 'candidates.csv')
+    queue_path = os.path.join(project_root, 'data', 'relaxation_queue.csv')
+    materials_path = os.path.join(project_root, 'data', 'materials_cleaned.csv')
     try: 
-        model = joblib.load(reg_filename)
-        clf = joblib.load(clf_filename)
+        with stage('evaluate.load_models'):
+            model, clf = joblib.load(reg_filename), joblib.load(clf_filename)
         print("Models loaded successfully")
     except Exception as e:
         print("An exception occurred.")
@@ -42,45 +91,53 @@ if __name__ == '__main__':
     A_list = ['Al', 'Si', 'P', 'S', 'Ga', 'Ge', 'In', 'Sn']
     X_list = ['C', 'N', 'B'] # added boron
 
-    print("Generating MAX Composites.")
-    candidates = [f"{m}2{a}{x}" for m, a, x in itertools.product(M_list, A_list, X_list)]
-    print(f"Generated {len(candidates)} candidates.")
-
-    ep_feat = ElementProperty.from_preset(preset_name='magpie')
-
-    df_candidates = pd.DataFrame({'formula': candidates})
-    df_candidates = StrToComposition().featurize_dataframe(df_candidates, "formula")
-    df_candidates = ep_feat.featurize_dataframe(df_candidates, col_id="composition")
-
-    X_cand = df_candidates.drop(columns=['formula', 'composition'], errors='ignore')
-
-    print("Predicting properties...")
-    predictions = model.predict(X_cand)
-    stability = clf.predict_proba(X_cand)
+    # only the descriptors the models were trained on, in their order
+    featurizer = MagpieFeaturizer(labels=model_feature_labels(model))
+    if args.feature_cache:
+        featurizer = FeatureCache(featurizer)
+    space = CandidateSpace(M_list, A_list, X_list, n_values=args.n_values, fractions=args.fractions)
+    print(f"Screening {len(space)} MAX Composites in chunks of {args.chunk_size}...")
+    with stage('evaluate.screen', items=len(space)):
+        models = None
+        if args.checkpoint:
+            # a checkpoint is only resumed by the models that wrote it
+            models = model_fingerprint(reg_filename, clf_filename)
+        if args.workers > 1:
+            df_candidates = screen_parallel(
+                space,
+                reg_filename,
+                clf_filename,
+                n_workers=args.workers,
+                stability_threshold=args.threshold,
+                top_k=args.top_k,
+                chunk_size=args.chunk_size,
+                checkpoint_path=args.checkpoint,
+                feature_cache=args.feature_cache
+            )
+        else:
+            df_candidates = screen(
+                space,
+                featurizer,
+                model,
+                clf,
+                stability_threshold=args.threshold,
+                top_k=args.top_k,
+                chunk_size=args.chunk_size,
+                checkpoint_path=args.checkpoint,
+                models=models
+            )
+    if args.feature_cache and args.workers == 1:
+        print(f"Feature cache: {featurizer.hits} hits, {featurizer.misses} newly featurized.")
     print("Predictions completed successfully.")
-
-    df_candidates['pred_bulk_modulus'] = predictions[:, 0]
-    df_candidates['pred_density'] = predictions[:, 1]
-    df_candidates['stability'] = stability[:, 1] * 100
-
-    # Calculate "Specific Stiffness" (Stiffness / Density)
-    df_candidates['specific_stiffness'] = df_candidates['pred_bulk_modulus'] / df_candidates['pred_density']
-    df_candidates = df_candidates[df_candidates['stability'] > 67]
     
     print(f"\nFiltering out materials that already exist in Materials Project database...")
     print(f"Checking {len(df_candidates)} candidates...")
     
     # Check which candidates already exist in the database
-    load_dotenv()
-    api_key = os.getenv("MATERIALS_API_KEY")
-    
-    exists_in_db = []
-    with MPRester(api_key) as mpr:
-        for idx, formula in enumerate(df_candidates['formula']):
-            if (idx + 1) % 10 == 0:
-                print(f"  Checked {idx + 1}/{len(df_candidates)} candidates...")
-            exists = check_material_exists(formula, mpr)
-            exists_in_db.append(exists)
+    known_formulas = KnownFormulaIndex(max_age_days=args.refresh_days)
+    with stage('evaluate.novelty', items=len(df_candidates)):
+        exists_in_db = known_formulas.exists(df_candidates['formula'], connect_materials_project)
+    print(f"  Made {known_formulas.queries} Materials Project request(s).")
     
     df_candidates['exists_in_db'] = exists_in_db
     novel_candidates = df_candidates[df_candidates['exists_in_db'] == False].copy()
@@ -88,22 +145,38 @@ if __name__ == '__main__':
     print(f"\nFound {len(df_candidates) - len(novel_candidates)} materials that already exist.")
     print(f"Remaining novel candidates: {len(novel_candidates)}")
     
+    candidate_cols = ['formula', 'pred_bulk_modulus', 'pred_density', 'stability', 'specific_stiffness',
+                      'pred_bulk_modulus_std', 'pred_density_std', 'specific_stiffness_std']
     if len(novel_candidates) > 0:
+        # spread across the trees as predictive uncertainty, one batched pass
+        with stage('evaluate.uncertainty', items=len(novel_candidates)):
+            spread = forest_spread(featurizer.featurize_many(novel_candidates['formula']), model,
+                                   featurizer.feature_labels())
+        for col, values in spread.items():
+            novel_candidates[col] = values
+
         top_candidates = novel_candidates.sort_values('specific_stiffness', ascending=False).head(10)
         
         print("\n----------------------------------------------------------")
         print("TOP 10 NOVEL STABLE DISCOVERED MATERIALS (Ranked by Specific Stiffness)")
         print("----------------------------------------------------------")
-        output_cols = ['formula', 'pred_bulk_modulus', 'pred_density', 'specific_stiffness', 'stability']
         print(top_candidates[output_cols].to_string(index=False, float_format="%.2f"))
         
         # Drop the 'exists_in_db' column before saving
         novel_candidates = novel_candidates.drop(columns=['exists_in_db'])
-        novel_candidates.to_csv(
-            candidates_path,
-            columns=['formula', 'pred_bulk_modulus', 'pred_density', 'stability', 'specific_stiffness'],
-            index=False
-        )
+        novel_candidates.to_csv(candidates_path, columns=candidate_cols, index=False)
         print(f"\nSaved {len(novel_candidates)} novel candidates to '{candidates_path}'")
+
+        if args.select:
+            with stage('evaluate.select', items=len(novel_candidates)):
+                selected = select_for_validation(novel_candidates, pd.read_csv(materials_path), args.select)
+            print(f"\nSelected {len(selected)} candidates for CHGNet validation "
+                  f"({selected['cost'].sum():.1f}/{args.select:g} budget):")
+            print(selected[['formula', 'pred_bulk_modulus', 'pred_bulk_modulus_std', 'pred_density',
+                            'stability', 'acquisition', 'cost']].to_string(index=False, float_format="%.2f"))
+            selected.to_csv(queue_path, index=False)
+            print(f"Saved the relaxation queue to '{queue_path}' (dynamics/batch_relax.py --candidates)")
     else:
-        print("\nNo novel candidates found. All materials already exist in the database.")
\ No newline at end of file
+        print("\nNo novel candidates found. All materials already exist in the database.")
+        # an empty table, so nothing downstream keeps reading an older screen's candidates
+        pd.DataFrame(columns=candidate_cols).to_csv(candidates_path, index=False)
\ No newline at end of file
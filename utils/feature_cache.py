@@ -0,0 +1,172 @@
+# On-disk feature store shared by training (models/randomforest.py) and
+# screening (utils/evaluate.py)
+# Features are keyed by reduced formula plus featurizer name/version, so a
+# formula is only ever featurized once. Layout of one store directory:
+#   features.f8     float64 matrix (rows x n_features), appended, memory-mapped
+#   keys.npy        reduced formula of every feature row
+#   spellings.npy   every formula string seen so far ...
+#   rows.npy        ... and the feature row it maps to
+# Lookups are a single vectorized hash join of the requested formula strings
+# against the stored spellings, only misses are parsed and featurized, from
+# the string they were requested with, so a cached row is bit for bit what
+# the featurizer gives for that spelling.
+# Training, the resident scoring service and screening workers can write one
+# store at the same time: misses are featurized without a lock, then appended
+# under an exclusive lock on the store's lock file, after re-reading the index
+# another process may have extended in the meantime.
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from utils.composition import shared_table
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'feature_cache'
+)
+
+
+def _save_npy(path, array):
+    # write-then-rename so a killed run never leaves a half written index
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class FeatureCache:
+    """Persistent, content-addressed wrapper around a featurizer.
+
+    Exposes the same featurize_many / featurize_dataframe / feature_labels
+    interface as the featurizer it wraps.
+    """
+
+    def __init__(self, featurizer, cache_dir=DEFAULT_CACHE_DIR, table=None):
+        self.featurizer = featurizer
+        self.table = shared_table() if table is None else table
+        self.path = os.path.join(cache_dir, f"{featurizer.name}-v{featurizer.version}")
+        self.n_features = len(featurizer.feature_labels())
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        meta_path = self._file('meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['labels'] != self.featurizer.feature_labels():
+                raise ValueError(f"Feature cache at {self.path} was written with different feature labels")
+            self.keys = np.load(self._file('keys.npy'))
+            self.spellings = np.load(self._file('spellings.npy'))
+            self.rows = np.load(self._file('rows.npy'))
+            # an interrupted save can leave the alias table one step ahead
+            n = min(len(self.spellings), len(self.rows))
+            keep = self.rows[:n] < len(self.keys)
+            self.spellings, self.rows = self.spellings[:n][keep], self.rows[:n][keep]
+        else:
+            self.keys = np.array([], dtype=str)
+            self.spellings = np.array([], dtype=str)
+            self.rows = np.array([], dtype=np.int64)
+        self._spelling_index = pd.Index(self.spellings)
+        self._key_index = pd.Index(self.keys)
+        self._map_features()
+
+    def _map_features(self):
+        if len(self.keys) == 0:
+            self.features = np.empty((0, self.n_features))
+            return
+        self.features = np.memmap(
+            self._file('features.f8'), dtype='<f8', mode='r', shape=(len(self.keys), self.n_features)
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def feature_labels(self):
+        return self.featurizer.feature_labels()
+
+    @contextmanager
+    def _locked(self):
+        with open(self._file('lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def featurize_many(self, formulas):
+        """Features for a list of formula strings, featurizing only cache misses."""
+        formulas = pd.Index(pd.Series(formulas, dtype=object))
+        rows = self._spelling_index.get_indexer(formulas)
+        missing = rows < 0
+        self.hits += int((~missing).sum())
+        self.misses += int(missing.sum())
+        if missing.any():
+            spellings = pd.unique(formulas[missing])
+            # featurized before taking the lock, so processes sharing the store featurize in parallel
+            keys, new_keys, features = self._featurize_new(spellings)
+            with self._locked():
+                self._load()
+                self._add(spellings, keys, new_keys, features)
+            rows[missing] = self._spelling_index.get_indexer(formulas[missing])
+        return np.asarray(self.features[self.rows[rows]])
+
+    def featurize_dataframe(self, df, col_id='formula'):
+        """Return a copy of df with the feature columns appended."""
+        features = self.featurize_many(df[col_id].tolist())
+        features = pd.DataFrame(features, columns=self.feature_labels(), index=df.index)
+        return pd.concat([df, features], axis=1)
+
+    def _featurize_new(self, spellings):
+        # reduced formula of every spelling, and features of the ones not cached yet
+        table_rows = self.table.intern(spellings)
+        keys = pd.Index(np.asarray(self.table.formulas, dtype=object)[table_rows])
+        new = self._key_index.get_indexer(keys) < 0
+        new_keys, first = np.unique(keys[new], return_index=True)
+        # featurized from the spelling, not the table's fractions, which
+        # can differ from direct featurization in the last bits
+        new_spellings = np.asarray(spellings, dtype=object)[np.flatnonzero(new)[first]]
+        if not len(new_keys):
+            return keys, new_keys, np.empty((0, self.n_features))
+        return keys, new_keys, self.featurizer.featurize_many(list(new_spellings))
+
+    def _add(self, spellings, keys, new_keys, features):
+        # under the lock, with the index just read from disk: spellings and
+        # reduced formulas another process added since are not added twice
+        unknown = self._spelling_index.get_indexer(spellings) < 0
+        spellings, keys = np.asarray(spellings, dtype=object)[unknown], keys[unknown]
+        # spellings of an already cached reduced formula only need an alias
+        append = self._key_index.get_indexer(new_keys) < 0
+        if append.any():
+            self._append_features(features[append].astype('<f8'))
+            self.keys = np.concatenate([self.keys, np.asarray(new_keys[append], dtype=str)])
+            self._key_index = pd.Index(self.keys)
+
+        self.spellings = np.concatenate([self.spellings, np.asarray(spellings, dtype=str)])
+        self.rows = np.concatenate([self.rows, self._key_index.get_indexer(keys)])
+        self._spelling_index = pd.Index(self.spellings)
+        self._save_index()
+        self._map_features()
+
+    def _append_features(self, features):
+        # drop rows past the index left by an interrupted run before appending
+        features_path = self._file('features.f8')
+        self.features = None
+        with open(features_path, 'ab') as f:
+            f.truncate(len(self.keys) * self.n_features * 8)
+            f.write(np.ascontiguousarray(features).tobytes())
+
+    def _save_index(self):
+        _save_npy(self._file('keys.npy'), self.keys)
+        _save_npy(self._file('spellings.npy'), self.spellings)
+        _save_npy(self._file('rows.npy'), self.rows)
+        with open(self._file('meta.json'), 'w') as f:
+            json.dump({'labels': self.feature_labels(), 'n_rows': len(self.keys)}, f)
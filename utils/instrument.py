@@ -0,0 +1,138 @@
+# Stage-level instrumentation shared by the pipeline scripts
+# Wrap a unit of work in `with stage('name', items=n):` and every API round
+# trip inside it in `with api_call():`. When metrics are on, each finished
+# stage appends one JSON line with wall time, CPU time (own and of finished
+# child processes), peak RSS, items/s and the API call count and latencies.
+# With a profile directory every top-level stage also runs under cProfile and
+# is dumped to <dir>/<stage>.prof (snakeviz, pstats); sampling profilers like
+# py-spy can attach to the same runs unchanged.
+#
+# Off by default, then stage() and api_call() only check a flag. Turn on with
+#   PIPELINE_METRICS=metrics.jsonl  PIPELINE_PROFILE=profiles/
+# or configure(metrics_path, profile_dir) (the --metrics/--profile options).
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_state = {'sink': None, 'profile_dir': None, 'enabled': False, 'run': uuid.uuid4().hex[:8], 'stack': []}
+
+
+class Stage:
+    """Counters of one running stage, yielded by stage()."""
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.api_max_seconds = 0.0
+
+    def add_items(self, n):
+        self.items = (self.items or 0) + n
+
+
+class _NullStage(Stage):
+    def add_items(self, n):
+        pass
+
+
+_NULL_STAGE = _NullStage('disabled')
+
+
+def configure(metrics_path=None, profile_dir=None):
+    """Send stage records to metrics_path (JSON lines) and/or cProfile dumps to profile_dir."""
+    if _state['sink'] is not None:
+        _state['sink'].close()
+    _state['sink'] = open(metrics_path, 'a') if metrics_path else None
+    _state['profile_dir'] = profile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    _state['enabled'] = bool(metrics_path or profile_dir)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def stage(name, items=None):
+    """Measure a pipeline stage, items is the number of things it processes (if known)."""
+    if not _state['enabled']:
+        yield _NULL_STAGE
+        return
+    stack = _state['stack']
+    record = Stage(name, items)
+    parent = stack[-1].name if stack else None
+    profiler = None
+    if _state['profile_dir'] and not stack:
+        profiler = cProfile.Profile()
+    stack.append(record)
+    wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_state['profile_dir'], f"{name}.prof"))
+        wall = time.perf_counter() - wall
+        stack.pop()
+        if _state['sink'] is not None:
+            line = {
+                'run': _state['run'],
+                'time': time.time(),
+                'stage': name,
+                'parent': parent,
+                'wall_s': wall,
+                'cpu_s': time.process_time() - cpu,
+                'children_cpu_s': _children_cpu() - children,
+                'peak_rss_mb': _peak_rss_mb(),
+                'items': record.items,
+                'items_per_s': record.items / wall if record.items and wall > 0 else None,
+                'api_calls': record.api_calls,
+                'api_s': record.api_seconds,
+                'api_max_s': record.api_max_seconds,
+            }
+            _state['sink'].write(json.dumps(line) + '\n')
+            _state['sink'].flush()
+
+
+@contextlib.contextmanager
+def api_call():
+    """Time one API round trip and count it against the innermost running stage."""
+    if not _state['enabled'] or not _state['stack']:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        record = _state['stack'][-1]
+        record.api_calls += 1
+        record.api_seconds += seconds
+        record.api_max_seconds = max(record.api_max_seconds, seconds)
+
+
+configure(os.environ.get('PIPELINE_METRICS'), os.environ.get('PIPELINE_PROFILE'))
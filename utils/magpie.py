@@ -0,0 +1,224 @@
+# Vectorized replacement for matminer's ElementProperty.from_preset('magpie')
+# matminer walks every composition (and every element of every composition)
+# in python; here the per-element property table is built once and the magpie
+# statistics are computed for a whole batch of formulas with numpy
+import hashlib
+import json
+import math
+import re
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+MAGPIE_FEATURES = [
+    "Number", "MendeleevNumber", "AtomicWeight", "MeltingT", "Column", "Row",
+    "CovalentRadius", "Electronegativity", "NsValence", "NpValence", "NdValence",
+    "NfValence", "NValence", "NsUnfilled", "NpUnfilled", "NdUnfilled", "NfUnfilled",
+    "NUnfilled", "GSvolume_pa", "GSbandgap", "GSmagmom", "SpaceGroupNumber",
+]
+MAGPIE_STATS = ["minimum", "maximum", "range", "mean", "avg_dev", "mode"]
+
+# Z = 1..118, so the element index of a symbol is Z - 1
+ELEMENTS = [
+    "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S",
+    "Cl", "Ar", "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga",
+    "Ge", "As", "Se", "Br", "Kr", "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd",
+    "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe", "Cs", "Ba", "La", "Ce", "Pr", "Nd", "Pm",
+    "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu", "Hf", "Ta", "W", "Re", "Os",
+    "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn", "Fr", "Ra", "Ac", "Th", "Pa",
+    "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr", "Rf", "Db", "Sg",
+    "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og",
+]
+ELEMENT_INDEX = {symbol: i for i, symbol in enumerate(ELEMENTS)}
+
+_group_re = re.compile(r"\(([^()]*)\)([.\de+-]*)")
+_element_re = re.compile(r"([A-Z][a-z]*)([.\de+-]*)")
+
+
+def _expand_groups(formula):
+    # expand the innermost parenthesised group until none are left,
+    # e.g. (Ti0.5Nb0.5)2AlC -> Ti1Nb1AlC
+    def expand(match):
+        factor = float(match.group(2) or 1)
+        return "".join(
+            f"{el}{float(amt or 1) * factor!r}" for el, amt in _element_re.findall(match.group(1))
+        )
+
+    formula = re.sub(r"\s", "", formula).replace("[", "(").replace("]", ")")
+    while "(" in formula:
+        expanded = _group_re.sub(expand, formula)
+        if expanded == formula:
+            raise ValueError(f"Unbalanced parentheses in formula '{formula}'")
+        formula = expanded
+    return formula
+
+
+def parse_formula(formula):
+    """Parse a formula string into an {element: amount} dict (same amounts as pymatgen)."""
+    if "(" in formula or "[" in formula or " " in formula:
+        formula = _expand_groups(formula)
+    amounts = {}
+    consumed = 0
+    for symbol, amt in _element_re.findall(formula):
+        if symbol not in ELEMENT_INDEX:
+            raise ValueError(f"Unknown element '{symbol}' in formula '{formula}'")
+        amounts[symbol] = amounts.get(symbol, 0.0) + (float(amt) if amt else 1.0)
+        consumed += len(symbol) + len(amt)
+    if consumed != len(formula) or not amounts:
+        raise ValueError(f"Could not parse formula '{formula}'")
+    return {el: amt for el, amt in amounts.items() if amt > 0}
+
+
+def reduced_formula(comp):
+    """Canonical reduced formula of an {element: amount} dict, elements in Z order.
+
+    Ti4Al2C2, Ti2AlC and (Ti1.0)2Al1C1 all reduce to 'CAlTi2'.
+    """
+    elements = sorted(comp, key=ELEMENT_INDEX.__getitem__)
+    if all(amt == int(amt) for amt in comp.values()):
+        # the common case, whole numbers only need their gcd
+        divisor = math.gcd(*(int(comp[el]) for el in elements))
+        return "".join(el if comp[el] == divisor else f"{el}{int(comp[el]) // divisor}" for el in elements)
+    smallest = min(comp.values())
+    amounts = [comp[el] / smallest for el in elements]
+    # the smallest multiplier up to 100 that makes every amount whole is the lcm
+    # of their closest fractions with denominators up to 100
+    approx = [Fraction(amt).limit_denominator(100) for amt in amounts]
+    multiplier = math.lcm(*(f.denominator for f in approx))
+    if multiplier <= 100 and all(abs(amt - f) * multiplier < 1e-6 for amt, f in zip(amounts, approx)):
+        rounded = [round(amt * multiplier) for amt in amounts]
+        divisor = math.gcd(*rounded)
+        amounts = [r // divisor for r in rounded]
+    else:
+        total = sum(amounts)
+        amounts = [amt / total for amt in amounts]
+    return "".join(el if amt == 1 else f"{el}{amt:.6g}" for el, amt in zip(elements, amounts))
+
+
+def formulas_to_padded(formulas):
+    """Convert formulas into padded (element index, amount) arrays of shape (n, k).
+
+    Padding slots have index -1 and amount 0, k is the largest number of
+    distinct elements in any formula.
+    """
+    return compositions_to_padded([parse_formula(f) for f in formulas])
+
+
+def compositions_to_padded(parsed):
+    """Same as formulas_to_padded, for already parsed {element: amount} dicts."""
+    counts = np.fromiter(map(len, parsed), dtype=np.int64, count=len(parsed))
+    k = int(counts.max()) if len(parsed) else 1
+    rows = np.repeat(np.arange(len(parsed)), counts)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    flat_idx = [ELEMENT_INDEX[el] for comp in parsed for el in comp]
+    flat_amt = [amt for comp in parsed for amt in comp.values()]
+
+    idx = np.full((len(parsed), k), -1, dtype=np.int16)
+    amounts = np.zeros((len(parsed), k), dtype=np.float64)
+    idx[rows, cols] = flat_idx
+    amounts[rows, cols] = flat_amt
+    return idx, amounts
+
+
+def magpie_labels():
+    """All 132 column names, in matminer's order."""
+    return [f"MagpieData {stat} {feature}" for feature in MAGPIE_FEATURES for stat in MAGPIE_STATS]
+
+
+class MagpieFeaturizer:
+    """Batched, numpy-only equivalent of ElementProperty.from_preset('magpie').
+
+    Column names, column order and values match matminer (within float tolerance).
+    With labels only those columns are computed, in the given order, e.g. the
+    feature list a pruned model was trained on.
+    """
+
+    version = "1"
+
+    def __init__(self, impute_nan=True, chunk_size=2048, labels=None):
+        from matminer.utils.data import MagpieData #type: ignore
+
+        self.impute_nan = impute_nan
+        self.chunk_size = chunk_size
+        self.name = "magpie" if impute_nan else "magpie_raw"
+        self.labels = magpie_labels() if labels is None else list(labels)
+        unknown = sorted(set(self.labels) - set(magpie_labels()))
+        if unknown:
+            raise ValueError(f"Unknown Magpie feature label(s): {', '.join(unknown)}")
+        if self.labels != magpie_labels():
+            # subsets get their own feature cache
+            self.name += "-" + hashlib.sha256(json.dumps(self.labels).encode()).hexdigest()[:8]
+
+        # (stat, elemental property) of every column, and the properties that are needed
+        columns = [label.split(" ")[1:] for label in self.labels]
+        self.properties = [f for f in MAGPIE_FEATURES if any(feature == f for _, feature in columns)]
+        self.stats = [s for s in MAGPIE_STATS if any(stat == s for stat, _ in columns)]
+        self._columns = {
+            stat: (np.array([j for j, (s, _) in enumerate(columns) if s == stat]),
+                   np.array([self.properties.index(f) for s, f in columns if s == stat]))
+            for stat in self.stats
+        }
+
+        # (n_elements + 1, n_properties) lookup table, the last row is used for padding
+        data = MagpieData(impute_nan=impute_nan).all_elemental_props
+        table = np.zeros((len(ELEMENTS) + 1, len(self.properties)))
+        for j, feature in enumerate(self.properties):
+            table[:-1, j] = [data[feature].get(el, np.nan) for el in ELEMENTS]
+        self.table = table
+
+    def feature_labels(self):
+        return list(self.labels)
+
+    def featurize_padded(self, idx, amounts):
+        """Magpie features for padded (element index, amount) arrays, shape (n, n_labels)."""
+        n = len(idx)
+        out = np.empty((n, len(self.labels)))
+        for start in range(0, n, self.chunk_size):
+            stop = min(start + self.chunk_size, n)
+            self._featurize_chunk(idx[start:stop], amounts[start:stop], out[start:stop])
+        return out
+
+    def _featurize_chunk(self, idx, amounts, out):
+        # element slots go first, (k, n, f), so every reduction runs over
+        # contiguous (n, f) slabs
+        valid = (idx >= 0).T
+        values = self.table[np.where(valid, idx.T, -1)]
+        amounts = amounts.T
+        weights = (amounts / amounts.sum(axis=0))[:, :, None]
+        present = valid[:, :, None]
+
+        # only the statistics some column needs are computed
+        stats = {}
+        if {"minimum", "range"} & set(self.stats):
+            stats["minimum"] = np.where(present, values, np.inf).min(axis=0)
+        if {"maximum", "range"} & set(self.stats):
+            stats["maximum"] = np.where(present, values, -np.inf).max(axis=0)
+        if "range" in self.stats:
+            stats["range"] = stats["maximum"] - stats["minimum"]
+        if {"mean", "avg_dev"} & set(self.stats):
+            stats["mean"] = (weights * values).sum(axis=0)
+        if "avg_dev" in self.stats:
+            stats["avg_dev"] = (weights * np.abs(values - stats["mean"])).sum(axis=0)
+        if "mode" in self.stats:
+            # mode: smallest value among the elements sharing the largest amount
+            ties = (valid & np.isclose(amounts, amounts.max(axis=0)))[:, :, None]
+            stats["mode"] = np.where(ties, values, np.inf).min(axis=0)
+
+        for stat, (out_cols, property_cols) in self._columns.items():
+            out[:, out_cols] = stats[stat][:, property_cols]
+
+    def featurize_many(self, formulas):
+        """Magpie features for a list of formula strings, shape (n, n_labels).
+
+        Each distinct formula is parsed only once.
+        """
+        codes, uniques = pd.factorize(pd.Series(formulas, dtype=object))
+        idx, amounts = formulas_to_padded(uniques)
+        return self.featurize_padded(idx, amounts)[codes]
+
+    def featurize_dataframe(self, df, col_id="formula"):
+        """Return a copy of df with the magpie feature columns appended."""
+        features = self.featurize_many(df[col_id].tolist())
+        features = pd.DataFrame(features, columns=self.feature_labels(), index=df.index)
+        return pd.concat([df, features], axis=1)
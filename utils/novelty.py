@@ -0,0 +1,85 @@
+# Batched novelty check against the Materials Project
+# Candidates are grouped by chemical system and every chemical system that is
+# not in the local index yet is fetched with one bulk summary.search call
+# (batched over many chemical systems). The reduced formulas found are stored
+# on disk with a refresh timestamp, so repeat runs answer from the index
+# without opening a connection at all. Formulas are interned in the shared
+# CompositionTable (utils/composition.py), so candidates the screen already
+# interned are not parsed again.
+import json
+import os
+import time
+
+from utils.composition import shared_table
+from utils.instrument import api_call
+
+DEFAULT_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'known_formulas.json'
+)
+
+
+def chemsys(comp):
+    """Materials Project style chemical system of an {element: amount} dict, e.g. 'Al-C-Ti'."""
+    return "-".join(sorted(comp))
+
+
+class KnownFormulaIndex:
+    """On-disk index of known reduced formulas per chemical system.
+
+    connect is a zero-argument callable returning an MPRester-like context
+    manager (anything with materials.summary.search), it is only called when
+    some chemical systems are missing or older than max_age_days.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_age_days=None, batch_size=200, table=None):
+        self.path = path
+        self.table = shared_table() if table is None else table
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.queries = 0
+        self.systems = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.systems = json.load(f)
+
+    def _is_stale(self, system):
+        entry = self.systems.get(system)
+        if entry is None:
+            return True
+        if self.max_age_days is None:
+            return False
+        return time.time() - entry['fetched_at'] > self.max_age_days * 86400
+
+    def refresh(self, systems, mpr):
+        """Fetch the known formulas of the given chemical systems with bulk queries."""
+        systems = sorted(systems)
+        for i in range(0, len(systems), self.batch_size):
+            batch = systems[i:i + self.batch_size]
+            with api_call():
+                docs = mpr.materials.summary.search(chemsys=batch, fields=["formula_pretty", "chemsys"])
+            self.queries += 1
+            fetched_at = time.time()
+            found = {system: set() for system in batch}
+            for row in self.table.intern([doc.formula_pretty for doc in docs]).tolist():
+                found.setdefault(self.table.systems[row], set()).add(self.table.formulas[row])
+            for system, formulas in found.items():
+                self.systems[system] = {'fetched_at': fetched_at, 'formulas': sorted(formulas)}
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.systems, f)
+        os.replace(tmp_path, self.path)
+
+    def exists(self, formulas, connect):
+        """Return a list of booleans, True where the formula is already known."""
+        rows = self.table.intern(formulas).tolist()
+        systems = [self.table.systems[row] for row in rows]
+        stale = {system for system in systems if self._is_stale(system)}
+        if stale:
+            print(f"  Querying {len(stale)} chemical systems in {-(-len(stale) // self.batch_size)} request(s)...")
+            with connect() as mpr:
+                self.refresh(stale, mpr)
+        known = {system: set(self.systems[system]['formulas']) for system in set(systems)}
+        return [self.table.formulas[row] in known[system] for row, system in zip(rows, systems)]
@@ -0,0 +1,130 @@
+# Shared multi-objective Pareto engine
+# Objectives are columns of an (n, k) array together with a per-column
+# maximize flag. Internally everything is turned into minimization.
+#   pareto_mask          non-dominated rows: O(n log n) sweeps for k = 2 and
+#                        k = 3, rank 0 of the non-dominated sort otherwise
+#   non_dominated_sort   front rank of every row (0 = Pareto front). k = 2 uses
+#                        a binary search over the fronts' staircases, k > 2 the
+#                        efficient non-dominated sort with binary search (ENS-BS)
+#   pareto_optimality_score  candidate stiffness as % of the 2-D front at its density
+# Exact duplicates count as dominated by their first occurrence, so a front
+# never contains the same point twice.
+import bisect
+
+import numpy as np
+import pandas as pd
+
+
+def _as_minimization(values, maximize):
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    maximize = np.broadcast_to(np.asarray(maximize, dtype=bool), values.shape[1:])
+    return np.where(maximize, -values, values)
+
+
+def _lexsort(X):
+    # rows in lexicographic order of (f0, f1, ...)
+    return np.lexsort(X.T[::-1])
+
+
+def _front_2d(X):
+    order = _lexsort(X)
+    y = X[order, 1]
+    best_before = np.concatenate([[np.inf], np.minimum.accumulate(y)[:-1]])
+    mask = np.zeros(len(X), dtype=bool)
+    mask[order[y < best_before]] = True
+    return mask
+
+
+def _front_3d(X):
+    # sweep in f0 order keeping the (f1, f2) staircase of the front so far:
+    # f1 ascending with f2 strictly descending
+    order = _lexsort(X)
+    stair_f1, stair_f2 = [], []
+    mask = np.zeros(len(X), dtype=bool)
+    for i, f1, f2 in zip(order, X[order, 1].tolist(), X[order, 2].tolist()):
+        pos = bisect.bisect_right(stair_f1, f1)
+        if pos and stair_f2[pos - 1] <= f2:
+            continue
+        mask[i] = True
+        end = pos
+        while end < len(stair_f1) and stair_f2[end] >= f2:
+            end += 1
+        stair_f1[pos:end] = [f1]
+        stair_f2[pos:end] = [f2]
+    return mask
+
+
+def non_dominated_sort(values, maximize=False):
+    """Front rank of every row, 0 for the Pareto front, 1 for the next front, ..."""
+    X = _as_minimization(values, maximize)
+    n, k = X.shape
+    ranks = np.empty(n, dtype=np.int64)
+    order = _lexsort(X)
+    if k == 1:
+        # one objective is a total order (ties broken by the duplicate rule)
+        ranks[order] = np.arange(n)
+        return ranks
+    if k == 2:
+        # every front's last point has its smallest f1, and those minima increase with rank
+        front_min = []
+        for i, f1 in zip(order, X[order, 1].tolist()):
+            rank = bisect.bisect_right(front_min, f1)
+            if rank == len(front_min):
+                front_min.append(f1)
+            else:
+                front_min[rank] = f1
+            ranks[i] = rank
+        return ranks
+
+    # each front is a growing buffer of its rows, so a check is one numpy call
+    fronts, sizes = [], []
+    for i in order:
+        x = X[i]
+        lo, hi = 0, len(fronts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            # earlier rows are never worse in f0, so weakly better everywhere means dominated
+            if (fronts[mid][:sizes[mid]] <= x).all(axis=1).any():
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(fronts):
+            fronts.append(np.empty((16, k)))
+            sizes.append(0)
+        elif sizes[lo] == len(fronts[lo]):
+            fronts[lo] = np.concatenate([fronts[lo], np.empty_like(fronts[lo])])
+        fronts[lo][sizes[lo]] = x
+        sizes[lo] += 1
+        ranks[i] = lo
+    return ranks
+
+
+def pareto_mask(values, maximize=False):
+    """Boolean mask of the non-dominated rows of an (n, k) objective array."""
+    X = _as_minimization(values, maximize)
+    if len(X) == 0:
+        return np.zeros(0, dtype=bool)
+    if X.shape[1] == 2:
+        return _front_2d(X)
+    if X.shape[1] == 3:
+        return _front_3d(X)
+    return non_dominated_sort(X) == 0
+
+
+def pareto_front(df, minimize=(), maximize=()):
+    """Rows of df on the Pareto front of the given columns, sorted by the first column."""
+    columns = list(minimize) + list(maximize)
+    flags = [False] * len(minimize) + [True] * len(maximize)
+    mask = pareto_mask(df[columns].to_numpy(), flags)
+    return df[mask].sort_values(columns[0], kind='stable')
+
+
+def pareto_optimality_score(candidates, front, x='pred_density', y='pred_bulk_modulus',
+                            front_x='density', front_y='bulk_modulus'):
+    """Candidate y as a percentage of the front's y interpolated at the candidate's x."""
+    front = front.sort_values(front_x)
+    limit = np.interp(candidates[x].to_numpy(float), front[front_x].to_numpy(float),
+                      front[front_y].to_numpy(float))
+    return pd.Series(candidates[y].to_numpy(float) / limit * 100, index=candidates.index)
@@ -3,37 +3,45 @@
 # trade-off solutions when we have multiple, conflicting goals
 # i.e both lighter AND stiffer
 
+import argparse
+import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns #type: ignore
 
-df = pd.read_csv('../data/materials_cleaned.csv')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.plotting import PLOT_MODES, cached_pareto_front, draw_population, place_labels, resolve_mode
+
+parser = argparse.ArgumentParser(description="Plot the density / bulk modulus Pareto front of the known materials.")
+parser.add_argument('--mode', choices=PLOT_MODES, default='auto',
+                    help="draw the materials as points, or binned (hexbin, raster) for large tables")
+parser.add_argument('--max-labels', type=int, default=20,
+                    help="most Pareto materials to label in the binned modes (scatter labels all of them)")
+args = parser.parse_args()
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+df = pd.read_csv(os.path.join(project_root, 'data', 'materials_cleaned.csv'))
 
 # remove diamond because it is an extreme outlier
 df = df[(df["bulk_modulus"] < 600) & (df["density"] < 15)]
 print(f"Plotting {len(df)} materials...")
 
-df_sorted = df.sort_values("density")
-pareto_boundary = []
-max_stiffness = -1.0 
-
-for _, row in df_sorted.iterrows():
-    if row["bulk_modulus"] > max_stiffness:
-        max_stiffness = row["bulk_modulus"]
-        pareto_boundary.append(row)
-
-pareto_values = pd.DataFrame(pareto_boundary)
-print(f"Calculuated {len(pareto_boundary)} materials on the Pareto Front.")
+# lighter AND stiffer: minimize density, maximize bulk modulus
+pareto_values = cached_pareto_front(df)
+print(f"Calculuated {len(pareto_values)} materials on the Pareto Front.")
 
 plt.figure(figsize=(12,8))
 sns.set_style('whitegrid')
+ax = plt.gca()
 
 # Plots all materials
-plt.scatter(
+draw_population(
+    ax,
     df['density'], 
     df['bulk_modulus'], 
+    args.mode,
     alpha = 0.3, 
-    c = 'slategrey', 
     s = 15, 
     label = 'Existing Materials'
 )
@@ -50,8 +58,9 @@ plt.plot(
 )
 
 # Label Pareto Materials
-for i, row in pareto_values.iterrows():
-    if row["bulk_modulus"] >= 41:
+labelled = pareto_values[pareto_values["bulk_modulus"] >= 41]
+if resolve_mode(args.mode, len(df)) == 'scatter':
+    for i, row in labelled.iterrows():
         plt.text(
             row['density'] + 0.1, 
             row['bulk_modulus'], 
@@ -60,6 +69,19 @@ for i, row in pareto_values.iterrows():
             color = 'darkred',
             fontweight = 'bold'
         )
+else:
+    # binned plots: stiffest per density first, capped, skipping overlaps
+    labelled = labelled.loc[(labelled['bulk_modulus'] / labelled['density']).sort_values(ascending=False).index]
+    place_labels(
+        ax,
+        labelled['density'], 
+        labelled['bulk_modulus'], 
+        labelled['formula'], 
+        max_labels = args.max_labels,
+        fontsize = 9, 
+        color = 'darkred',
+        fontweight = 'bold'
+    )
 
 plt.xlabel('Density (g/cm³)', fontsize=14)
 plt.ylabel('Bulk Modulus (GPa)', fontsize=14)
@@ -67,6 +89,6 @@ plt.title('Material Discovery: Stiffness vs. Density Trade-off', fontsize=16)
 plt.legend(fontsize=12)
 plt.grid(True, which='both', linestyle='--', linewidth=0.5)
 
-plt.savefig('../figures/pareto.png')
+plt.savefig(os.path.join(project_root, 'figures', 'pareto.png'))
 plt.close()
 print("Saved image to \"figures/pareto.png\"")
\ No newline at end of file
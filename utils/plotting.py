@@ -0,0 +1,96 @@
+# Shared helpers for the density / bulk modulus maps (pareto_front.py, visualize.py)
+# Drawing every material with plt.scatter costs time and PNG size in
+# proportion to the number of rows. In the dense modes the population is
+# binned once with numpy instead, so the figure holds a fixed number of cells
+# however many rows there are:
+#   hexbin   ax.hexbin with log counts
+#   raster   np.histogram2d drawn as one image
+#   auto     scatter up to AUTO_SCATTER_LIMIT rows, hexbin above
+# Only the Pareto front and a capped set of non-overlapping labels are drawn
+# on top; scatter plots keep labelling every point as before. The front is
+# cached in data/pareto_cache/ under a hash of the plotted columns, so plots
+# of the same table don't recompute it. Only the latest front is kept there.
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from matplotlib.colors import LogNorm
+
+from utils.pareto import pareto_front
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FRONT_CACHE = os.path.join(project_root, 'data', 'pareto_cache')
+PLOT_MODES = ['auto', 'scatter', 'hexbin', 'raster']
+AUTO_SCATTER_LIMIT = 20_000
+
+
+def cached_pareto_front(df, x='density', y='bulk_modulus', label='formula', cache_dir=DEFAULT_FRONT_CACHE):
+    """Pareto front of df (minimize x, maximize y), read from the cache when the columns are unchanged."""
+    columns = [x, y, label]
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df[columns], index=False).to_numpy().tobytes())
+    path = os.path.join(cache_dir, f"{digest.hexdigest()[:16]}.csv")
+    if os.path.exists(path):
+        return pd.read_csv(path)
+    front = pareto_front(df[columns], minimize=[x], maximize=[y]).reset_index(drop=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    front.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    # fronts of older tables are never read again
+    for name in os.listdir(cache_dir):
+        if name.endswith('.csv') and os.path.join(cache_dir, name) != path:
+            os.remove(os.path.join(cache_dir, name))
+    return front
+
+
+def resolve_mode(mode, n_rows):
+    if mode == 'auto':
+        return 'scatter' if n_rows <= AUTO_SCATTER_LIMIT else 'hexbin'
+    return mode
+
+
+def draw_population(ax, x, y, mode, color='slategrey', cmap='Greys', label=None, gridsize=150, **scatter_kwargs):
+    """Draw points as a scatter, or binned into a hexbin or raster image for large tables."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    mode = resolve_mode(mode, len(x))
+    if mode == 'scatter':
+        return ax.scatter(x, y, color=color, label=label, **scatter_kwargs)
+    if len(x) == 0:
+        return None
+    if mode == 'hexbin':
+        return ax.hexbin(x, y, gridsize=gridsize, bins='log', mincnt=1, cmap=cmap, label=label, linewidths=0)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=gridsize)
+    counts = np.ma.masked_equal(counts.T, 0)
+    # imshow does not go into the legend, so a proxy point stands in for it
+    if label:
+        ax.scatter([], [], color=color, marker='s', label=label)
+    return ax.imshow(counts, origin='lower', aspect='auto', cmap=cmap, norm=LogNorm(), interpolation='nearest',
+                     extent=[x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]])
+
+
+def place_labels(ax, x, y, texts, max_labels=20, fontsize=10, offset=0.1, **text_kwargs):
+    """Label up to max_labels points in the given priority order, skipping ones that would overlap.
+
+    Label boxes are estimated from the character count in axes fractions,
+    so call this once the axis limits are final.
+    """
+    fig = ax.figure
+    width_px, height_px = ax.get_window_extent().size
+    char_w = 0.6 * fontsize * fig.dpi / 72 / max(width_px, 1)
+    line_h = 1.2 * fontsize * fig.dpi / 72 / max(height_px, 1)
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+    placed = []
+    for px, py, text in zip(x, y, texts):
+        if len(placed) == max_labels:
+            break
+        # box of the label in axes fractions, it starts right of the point
+        left = (px + offset - x0) / (x1 - x0)
+        bottom = (py - y0) / (y1 - y0) - line_h / 2
+        box = (left, bottom, left + char_w * len(str(text)), bottom + line_h)
+        if not (0 <= box[0] and box[2] <= 1 and 0 <= box[1] and box[3] <= 1):
+            continue
+        if any(box[0] < b[2] and b[0] < box[2] and box[1] < b[3] and b[1] < box[3] for b in placed):
+            continue
+        placed.append(box)
+        ax.text(px + offset, py, text, fontsize=fontsize, va='center', **text_kwargs)
+    return len(placed)
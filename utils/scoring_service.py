@@ -0,0 +1,200 @@
+# Resident scoring service on localhost HTTP
+# Keeps the featurizer (with its feature cache) and the models warm, so a
+# what-if query costs a round trip instead of imports + model loading.
+# Concurrent requests are coalesced into micro-batches: the batcher thread
+# takes the first waiting request, then keeps collecting until max_batch
+# formulas are queued or max_latency has passed, and scores them together.
+#
+#   python utils/scoring_service.py
+#   curl -d '{"formulas": ["Nb2SiC"]}' http://127.0.0.1:8765/score
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+RESULT_COLUMNS = ['pred_bulk_modulus', 'pred_density', 'specific_stiffness', 'stability']
+
+
+class MicroBatcher:
+    """Coalesce concurrent score requests into batched calls of score_formulas."""
+
+    def __init__(self, score_formulas, max_batch=4096, max_latency=0.005):
+        self.score_formulas = score_formulas
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.batches = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, formulas):
+        """Score a list of formulas, blocking until its batch has been run."""
+        if not formulas:
+            # an empty request would make the model fail every request batched with it
+            return []
+        done = threading.Event()
+        pending = {'formulas': list(formulas), 'done': done}
+        self.requests.put(pending)
+        done.wait()
+        if 'error' in pending:
+            raise pending['error']
+        return pending['result']
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0]['formulas'])
+            deadline = time.perf_counter() + self.max_latency
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                size += len(batch[-1]['formulas'])
+            self._score(batch)
+
+    def _score(self, batch):
+        formulas = [f for pending in batch for f in pending['formulas']]
+        try:
+            values = self.score_formulas(formulas)
+        except Exception as e:
+            for pending in batch:
+                pending['error'] = e
+                pending['done'].set()
+            return
+        self.batches += 1
+        start = 0
+        for pending in batch:
+            stop = start + len(pending['formulas'])
+            pending['result'] = [
+                {'formula': f, **{col: float(values[col][i]) for col in RESULT_COLUMNS}}
+                for i, f in zip(range(start, stop), pending['formulas'])
+            ]
+            pending['done'].set()
+            start = stop
+
+
+def load_scorer(project_root):
+    """Warm featurizer + models, returned as a formulas -> predictions callable."""
+    import joblib
+    from utils.feature_cache import FeatureCache
+    from utils.magpie import MagpieFeaturizer
+    from utils.screening import model_feature_labels, score_chunk
+
+    model = joblib.load(os.path.join(project_root, 'models', 'regressor.joblib'))
+    clf = joblib.load(os.path.join(project_root, 'models', 'stability.joblib'))
+    # only the columns the models were trained on
+    featurizer = FeatureCache(MagpieFeaturizer(labels=model_feature_labels(model)))
+    labels = featurizer.feature_labels()
+
+    def score_formulas(formulas):
+        return score_chunk(featurizer.featurize_many(formulas), model, clf, labels)
+
+    return score_formulas
+
+
+def make_handler(batcher):
+    from utils.magpie import parse_formula
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'status': 'ok', 'batches': batcher.batches})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                formulas = body['formulas']
+                # reject bad formulas here so they can't fail the whole micro-batch
+                if not isinstance(formulas, list) or not formulas:
+                    raise ValueError("'formulas' must be a non-empty list of formula strings")
+                for formula in formulas:
+                    parse_formula(formula)
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            t0 = time.perf_counter()
+            try:
+                results = batcher.submit(formulas)
+            except Exception as e:
+                self._reply(500, {'error': repr(e)})
+                return
+            self._reply(200, {'results': results, 'seconds': time.perf_counter() - t0})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    # the socketserver default backlog of 5 resets bursts of concurrent clients
+    request_queue_size = 128
+
+
+class ScoringClient:
+    """Thin stdlib-only client for the scoring service."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=30):
+        self.url = f"http://{address}"
+        self.timeout = timeout
+
+    def is_running(self):
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=0.5) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def score(self, formulas):
+        request = urllib.request.Request(
+            f"{self.url}/score",
+            data=json.dumps({'formulas': list(formulas)}).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)['results']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve bulk modulus / density / stability predictions.")
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help="host:port to listen on")
+    parser.add_argument('--max-batch', type=int, default=4096, help="formulas per micro-batch")
+    parser.add_argument('--max-latency-ms', type=float, default=5.0,
+                        help="how long to wait for more requests before scoring a batch")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, project_root)
+
+    print("Loading featurizer and models...")
+    batcher = MicroBatcher(load_scorer(project_root), args.max_batch, args.max_latency_ms / 1000)
+    host, port = args.address.rsplit(':', 1)
+    server = ScoringServer((host, int(port)), make_handler(batcher))
+    print(f"Scoring service listening on http://{args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,260 @@
+# Streaming screening engine for MAX phase candidates
+# The search space (M_{n+1}AX_n plus M- and A-site solid solutions) is never
+# materialised: every candidate has an integer position and chunks of
+# positions are decoded straight into the padded (element index, amount)
+# arrays the Magpie featurizer consumes. Each chunk is featurized, scored and
+# filtered, and only the running top-k by specific stiffness is kept, so peak
+# memory depends on chunk_size and top_k, not on the size of the space.
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.composition import shared_table
+from utils.feature_cache import FeatureCache
+from utils.instrument import stage
+from utils.magpie import ELEMENT_INDEX
+
+RESULT_COLUMNS = ['pred_bulk_modulus', 'pred_density', 'stability', 'specific_stiffness']
+
+
+def _amount(x):
+    # formula subscript, "Ti2AlC" rather than "Ti2Al1C1"
+    return "" if x == 1 else f"{x:g}"
+
+
+class CandidateSpace:
+    """Lazily indexed space of M_{n+1}AX_n candidates.
+
+    fractions is the grid used for the solid solutions, e.g. (0.25, 0.5, 0.75)
+    generates (Ti0.25Nb0.75)2AlC, (Ti0.5Nb0.5)2AlC and (Ti0.75Nb0.25)2AlC for
+    the Ti/Nb pair. An empty grid only generates the pure phases.
+    """
+
+    def __init__(self, M_list, A_list, X_list, n_values=(1, 2, 3), fractions=(),
+                 m_site=True, a_site=True):
+        self.M_list, self.A_list, self.X_list = list(M_list), list(A_list), list(X_list)
+        self.n_values = list(n_values)
+        self.fractions = [round(f, 10) for f in fractions]
+        if any(not 0 < f < 1 for f in self.fractions):
+            raise ValueError("Solid solution fractions must be strictly between 0 and 1")
+        self.M_pairs = list(itertools.combinations(range(len(self.M_list)), 2))
+        self.A_pairs = list(itertools.combinations(range(len(self.A_list)), 2))
+
+        n_n, n_m, n_a, n_x, n_f = (len(self.n_values), len(self.M_list), len(self.A_list),
+                                   len(self.X_list), len(self.fractions))
+        self.families = [('pure', (n_n, n_m, n_a, n_x))]
+        if m_site and n_f:
+            self.families.append(('m_site', (n_n, len(self.M_pairs), n_f, n_a, n_x)))
+        if a_site and n_f:
+            self.families.append(('a_site', (n_n, n_m, len(self.A_pairs), n_f, n_x)))
+        self.sizes = [int(np.prod(shape)) for _, shape in self.families]
+        self.offsets = np.cumsum([0] + self.sizes)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def fingerprint(self):
+        """Hash of the space definition, used to validate checkpoints."""
+        spec = [self.M_list, self.A_list, self.X_list, self.n_values, self.fractions,
+                [kind for kind, _ in self.families]]
+        return hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:16]
+
+    def _decode(self, positions):
+        # yields (kind, axis indices, mask into positions) per family
+        for (kind, shape), lo, hi in zip(self.families, self.offsets[:-1], self.offsets[1:]):
+            mask = (positions >= lo) & (positions < hi)
+            if mask.any():
+                yield kind, np.unravel_index(positions[mask] - lo, shape), mask
+
+    def padded(self, start, stop):
+        """Padded (element index, amount) arrays for positions [start, stop)."""
+        positions = np.arange(start, stop)
+        idx = np.full((len(positions), 4), -1, dtype=np.int16)
+        amounts = np.zeros((len(positions), 4))
+        M = np.array([ELEMENT_INDEX[el] for el in self.M_list])
+        A = np.array([ELEMENT_INDEX[el] for el in self.A_list])
+        X = np.array([ELEMENT_INDEX[el] for el in self.X_list])
+        n_values = np.array(self.n_values, dtype=float)
+        fractions = np.array(self.fractions)
+
+        for kind, axes, mask in self._decode(positions):
+            n = n_values[axes[0]]
+            if kind == 'pure':
+                _, m, a, x = axes
+                cols = [M[m], A[a], X[x], np.full(len(m), -1)]
+                amts = [n + 1, np.ones(len(n)), n, np.zeros(len(n))]
+            elif kind == 'm_site':
+                _, pair, f, a, x = axes
+                pairs = np.array(self.M_pairs)[pair]
+                f = fractions[f]
+                cols = [M[pairs[:, 0]], M[pairs[:, 1]], A[a], X[x]]
+                amts = [f * (n + 1), (1 - f) * (n + 1), np.ones(len(n)), n]
+            else:
+                _, m, pair, f, x = axes
+                pairs = np.array(self.A_pairs)[pair]
+                f = fractions[f]
+                cols = [M[m], A[pairs[:, 0]], A[pairs[:, 1]], X[x]]
+                amts = [n + 1, f, 1 - f, n]
+            idx[mask] = np.stack(cols, axis=1)
+            amounts[mask] = np.stack(amts, axis=1)
+        return idx, amounts
+
+    def formulas(self, positions):
+        """Formula strings for an array of positions (only used for the survivors)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        out = np.empty(len(positions), dtype=object)
+        M, A, X = self.M_list, self.A_list, self.X_list
+        for kind, axes, mask in self._decode(positions):
+            rows = []
+            for ax in zip(*(a.tolist() for a in axes)):
+                n = self.n_values[ax[0]]
+                if kind == 'pure':
+                    _, m, a, x = ax
+                    rows.append(f"{M[m]}{n + 1}{A[a]}{X[x]}{_amount(n)}")
+                elif kind == 'm_site':
+                    _, pair, f, a, x = ax
+                    m1, m2 = self.M_pairs[pair]
+                    f = self.fractions[f]
+                    rows.append(f"({M[m1]}{f:g}{M[m2]}{round(1 - f, 10):g}){n + 1}{A[a]}{X[x]}{_amount(n)}")
+                else:
+                    _, m, pair, f, x = ax
+                    a1, a2 = self.A_pairs[pair]
+                    f = self.fractions[f]
+                    rows.append(f"{M[m]}{n + 1}({A[a1]}{f:g}{A[a2]}{round(1 - f, 10):g}){X[x]}{_amount(n)}")
+            out[mask] = rows
+        return out.tolist()
+
+    def intern(self, positions, table):
+        """Formula strings for positions, interned in a CompositionTable.
+
+        Interning goes through the strings rather than the padded arrays, so a
+        candidate gets the same row as its formula parsed anywhere else.
+        """
+        formulas = self.formulas(positions)
+        table.intern(formulas)
+        return formulas
+
+
+class TopK:
+    """Bounded running top-k of candidate positions by score."""
+
+    def __init__(self, k):
+        self.k = k
+        self.positions = np.empty(0, dtype=np.int64)
+        self.values = {col: np.empty(0) for col in RESULT_COLUMNS}
+
+    def push(self, positions, values, score_col='specific_stiffness'):
+        positions = np.concatenate([self.positions, positions])
+        values = {col: np.concatenate([self.values[col], values[col]]) for col in RESULT_COLUMNS}
+        if len(positions) > self.k:
+            keep = np.argpartition(-values[score_col], self.k - 1)[:self.k]
+            positions = positions[keep]
+            values = {col: v[keep] for col, v in values.items()}
+        self.positions, self.values = positions, values
+
+
+def model_feature_labels(model):
+    """Feature columns a fitted model was trained on, in order.
+
+    None when the model does not record them, then the full Magpie set is meant.
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    return None if names is None else [str(name) for name in names]
+
+
+def score_chunk(features, model, clf, labels):
+    """Predict bulk modulus, density, stability (%) and specific stiffness for a feature block."""
+    X = pd.DataFrame(features, columns=labels)
+    predictions = model.predict(X)
+    stability = clf.predict_proba(X)[:, 1] * 100
+    return {
+        'pred_bulk_modulus': predictions[:, 0],
+        'pred_density': predictions[:, 1],
+        'stability': stability,
+        'specific_stiffness': predictions[:, 0] / predictions[:, 1],
+    }
+
+
+def model_fingerprint(*paths):
+    """Hash of the model files (joblib files or directories of them), recorded in checkpoints."""
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path] if os.path.isfile(path) else [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        for file_path in files:
+            digest.update(os.path.basename(file_path).encode())
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _save_checkpoint(path, space, next_start, n_stable, top, stability_threshold, models):
+    tmp_path = path + '.tmp.npz'
+    meta = {'space': space.fingerprint(), 'next_start': next_start, 'n_stable': n_stable, 'k': top.k,
+            'stability_threshold': float(stability_threshold), 'models': models}
+    np.savez(tmp_path, meta=json.dumps(meta), positions=top.positions, **top.values)
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(path, space, top, stability_threshold, models):
+    with np.load(path) as ckpt:
+        meta = json.loads(str(ckpt['meta']))
+        if meta['space'] != space.fingerprint() or meta['k'] != top.k:
+            raise ValueError(f"Checkpoint {path} was written for a different search space or top_k")
+        # survivors filtered at another threshold or scored by other models cannot be mixed in
+        if meta.get('stability_threshold') != float(stability_threshold):
+            raise ValueError(f"Checkpoint {path} was written with stability threshold "
+                             f"{meta.get('stability_threshold')}, not {stability_threshold}")
+        if meta.get('models') != models:
+            raise ValueError(f"Checkpoint {path} was written by other models, delete it to screen again")
+        top.positions = ckpt['positions']
+        top.values = {col: ckpt[col] for col in RESULT_COLUMNS}
+    return meta['next_start'], meta['n_stable']
+
+
+def featurize_chunk(featurizer, space, start, stop):
+    """Features of the candidates start:stop, through their formulas when featurizer is a FeatureCache."""
+    if isinstance(featurizer, FeatureCache):
+        # the cache is keyed by formula, so the chunk goes through its strings
+        return featurizer.featurize_many(space.formulas(np.arange(start, stop)))
+    return featurizer.featurize_padded(*space.padded(start, stop))
+
+
+def screen(space, featurizer, model, clf, stability_threshold=67, top_k=1000,
+           chunk_size=50_000, checkpoint_path=None, models=None):
+    """Stream the candidate space through featurize -> score -> filter -> top-k.
+
+    featurizer is a MagpieFeaturizer, which featurizes the decoded chunks
+    directly, or a FeatureCache around one, which looks up their formulas.
+    If checkpoint_path is given the state is saved after every chunk and an
+    existing checkpoint for the same space, threshold and models (their
+    model_fingerprint) is resumed. Returns the top_k stable candidates as a
+    DataFrame sorted by specific stiffness.
+    """
+    labels = featurizer.feature_labels()
+    top = TopK(top_k)
+    start, n_stable = 0, 0
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        start, n_stable = _load_checkpoint(checkpoint_path, space, top, stability_threshold, models)
+        print(f"Resuming from checkpoint at candidate {start}/{len(space)}.")
+
+    while start < len(space):
+        stop = min(start + chunk_size, len(space))
+        with stage('screen.featurize', items=stop - start):
+            features = featurize_chunk(featurizer, space, start, stop)
+        with stage('screen.predict', items=stop - start):
+            values = score_chunk(features, model, clf, labels)
+        stable = values['stability'] > stability_threshold
+        n_stable += int(stable.sum())
+        top.push(np.arange(start, stop)[stable], {col: v[stable] for col, v in values.items()})
+        start = stop
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, space, start, n_stable, top, stability_threshold, models)
+        print(f"  Screened {stop}/{len(space)} candidates ({n_stable} stable so far)...")
+
+    df = pd.DataFrame({'formula': space.intern(top.positions, shared_table()), **top.values})
+    return df.sort_values('specific_stiffness', ascending=False, ignore_index=True)
@@ -0,0 +1,72 @@
+# FeatureCache against direct featurization, including concurrent writers
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.composition import CompositionTable
+from utils.feature_cache import FeatureCache
+from utils.magpie import MagpieFeaturizer
+from utils.screening import CandidateSpace
+
+# the element property table comes from matminer
+pytest.importorskip('matminer')
+
+LABELS = ['MagpieData mean Number', 'MagpieData range Electronegativity', 'MagpieData mode MeltingT',
+          'MagpieData avg_dev CovalentRadius', 'MagpieData maximum GSvolume_pa']
+
+
+def candidate_formulas():
+    space = CandidateSpace(['Ti', 'V', 'Nb', 'Mo'], ['Al', 'Si', 'Ga'], ['C', 'N'], fractions=[0.25, 0.5])
+    return space.formulas(np.arange(len(space)))
+
+
+def test_cold_and_warm_match_direct(tmp_path):
+    featurizer = MagpieFeaturizer(labels=LABELS)
+    formulas = candidate_formulas()
+    direct = featurizer.featurize_many(formulas)
+
+    cache = FeatureCache(featurizer, cache_dir=str(tmp_path), table=CompositionTable())
+    np.testing.assert_array_equal(cache.featurize_many(formulas), direct)
+    assert cache.misses == len(formulas)
+    np.testing.assert_array_equal(cache.featurize_many(formulas[::-1]), direct[::-1])
+    assert cache.hits == len(formulas)
+
+    # a new instance reads the same rows back from disk
+    reopened = FeatureCache(featurizer, cache_dir=str(tmp_path), table=CompositionTable())
+    assert len(reopened) == len(cache)
+    np.testing.assert_array_equal(reopened.featurize_many(formulas), direct)
+    assert reopened.misses == 0
+
+
+def test_spellings_share_a_row(tmp_path):
+    featurizer = MagpieFeaturizer(labels=LABELS)
+    cache = FeatureCache(featurizer, cache_dir=str(tmp_path), table=CompositionTable())
+    spellings = ['Ti2AlC', 'Ti4Al2C2', '(Ti1.0)2AlC', 'Ti2AlC']
+    features = cache.featurize_many(spellings)
+    assert len(cache) == 1
+    np.testing.assert_allclose(features, featurizer.featurize_many(spellings), rtol=1e-12)
+
+
+def _featurize_in_process(cache_dir, formulas):
+    cache = FeatureCache(MagpieFeaturizer(labels=LABELS), cache_dir=cache_dir, table=CompositionTable())
+    return cache.featurize_many(formulas)
+
+
+def test_concurrent_writers(tmp_path):
+    formulas = candidate_formulas()
+    # overlapping slices, so the processes race to add the same formulas
+    slices = [formulas[i::3] + formulas[:40] for i in range(3)] + [formulas]
+    with ProcessPoolExecutor(4) as pool:
+        results = list(pool.map(_featurize_in_process, [str(tmp_path)] * len(slices), slices))
+
+    featurizer = MagpieFeaturizer(labels=LABELS)
+    for chunk, features in zip(slices, results):
+        np.testing.assert_array_equal(features, featurizer.featurize_many(chunk))
+    cache = FeatureCache(featurizer, cache_dir=str(tmp_path), table=CompositionTable())
+    assert len(cache) == len(set(cache.keys)) == len(formulas)
+    np.testing.assert_array_equal(cache.featurize_many(formulas), featurizer.featurize_many(formulas))
+    assert cache.misses == 0
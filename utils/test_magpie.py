@@ -0,0 +1,41 @@
+# MagpieFeaturizer against matminer's ElementProperty.from_preset('magpie')
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.magpie import MagpieFeaturizer, magpie_labels, parse_formula
+
+FORMULAS = ['Nb2SiC', 'Ti3SiC2', 'Ti4AlN3', 'V2PC', 'Cr2GeC', '(Ti0.5Nb0.5)2AlC', 'Ti2(Al0.25Sn0.75)C',
+            'Mo2Ga2C', 'Fe2O3', 'NaCl', 'Si', 'HfB2', 'UO2', 'Ca(OH)2']
+
+
+@pytest.fixture(scope='module')
+def matminer_features():
+    composition = pytest.importorskip('matminer.featurizers.composition')
+    from pymatgen.core import Composition #type: ignore
+
+    featurizer = composition.ElementProperty.from_preset('magpie')
+    assert featurizer.feature_labels() == magpie_labels()
+    return np.array([featurizer.featurize(Composition(parse_formula(f))) for f in FORMULAS])
+
+
+def test_matches_matminer(matminer_features):
+    features = MagpieFeaturizer().featurize_many(FORMULAS)
+    np.testing.assert_allclose(features, matminer_features, rtol=1e-10, atol=1e-10)
+
+
+def test_label_subset_matches_full_columns(matminer_features):
+    labels = magpie_labels()[::7][::-1]
+    featurizer = MagpieFeaturizer(labels=labels)
+    assert featurizer.feature_labels() == labels
+    columns = [magpie_labels().index(label) for label in labels]
+    np.testing.assert_allclose(featurizer.featurize_many(FORMULAS), matminer_features[:, columns],
+                               rtol=1e-10, atol=1e-10)
+
+
+def test_unknown_label_is_rejected():
+    with pytest.raises(ValueError):
+        MagpieFeaturizer(labels=['MagpieData mean Nonsense'])
@@ -0,0 +1,74 @@
+# Pareto fronts and non-dominated sorting against O(n^2) brute force
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.pareto import non_dominated_sort, pareto_front, pareto_mask
+
+
+def brute_force_mask(X):
+    # minimization; an exact duplicate is dominated by its first occurrence
+    n = len(X)
+    mask = np.ones(n, dtype=bool)
+    for i in range(n):
+        for j in range(n):
+            if j == i or not (X[j] <= X[i]).all():
+                continue
+            if (X[j] < X[i]).any() or j < i:
+                mask[i] = False
+                break
+    return mask
+
+
+def brute_force_ranks(X):
+    ranks = np.full(len(X), -1)
+    remaining = np.arange(len(X))
+    rank = 0
+    while len(remaining):
+        front = brute_force_mask(X[remaining])
+        ranks[remaining[front]] = rank
+        remaining = remaining[~front]
+        rank += 1
+    return ranks
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4])
+@pytest.mark.parametrize('seed', range(5))
+def test_mask_and_ranks_match_brute_force(k, seed):
+    rng = np.random.default_rng(seed)
+    # small integer grid, so ties and exact duplicates are common
+    X = rng.integers(0, 6, size=(120, k)).astype(float)
+    np.testing.assert_array_equal(pareto_mask(X), brute_force_mask(X))
+    np.testing.assert_array_equal(non_dominated_sort(X), brute_force_ranks(X))
+
+
+@pytest.mark.parametrize('k', [2, 3, 5])
+def test_maximize_flags(k):
+    rng = np.random.default_rng(k)
+    X = rng.normal(size=(300, k))
+    maximize = np.arange(k) % 2 == 1
+    flipped = np.where(maximize, -X, X)
+    np.testing.assert_array_equal(pareto_mask(X, maximize), brute_force_mask(flipped))
+    np.testing.assert_array_equal(non_dominated_sort(X, maximize), brute_force_ranks(flipped))
+
+
+def test_front_matches_density_sweep():
+    # the loop pareto_front.py and visualize.py used before the shared engine
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'formula': [f"X{i}" for i in range(2000)],
+                       'density': rng.uniform(1, 15, 2000), 'bulk_modulus': rng.uniform(1, 500, 2000)})
+    boundary, max_stiffness = [], -1.0
+    for _, row in df.sort_values('density').iterrows():
+        if row['bulk_modulus'] > max_stiffness:
+            max_stiffness = row['bulk_modulus']
+            boundary.append(row['formula'])
+    front = pareto_front(df, minimize=['density'], maximize=['bulk_modulus'])
+    assert front['formula'].tolist() == boundary
+
+
+def test_empty():
+    assert len(pareto_mask(np.empty((0, 2)))) == 0
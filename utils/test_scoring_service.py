@@ -0,0 +1,94 @@
+# Scoring service request handling and micro-batching, with a stand-in scorer
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.scoring_service import MicroBatcher, ScoringClient, ScoringServer, make_handler
+
+
+class FakeScorer:
+    """Scores by formula length, records the batches it was called with."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, formulas):
+        if not formulas:
+            raise ValueError("empty batch")
+        self.calls.append(list(formulas))
+        n = np.array([len(f) for f in formulas], dtype=float)
+        return {'pred_bulk_modulus': n * 10, 'pred_density': n, 'stability': n,
+                'specific_stiffness': np.full(len(n), 10.0)}
+
+
+@pytest.fixture
+def service():
+    scorer = FakeScorer()
+    server = ScoringServer(('127.0.0.1', 0), make_handler(MicroBatcher(scorer)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield scorer, f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(address, body):
+    request = urllib.request.Request(f"http://{address}/score", data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_scores_formulas(service):
+    scorer, address = service
+    results = ScoringClient(address).score(['Nb2SiC', 'Ti3SiC2'])
+    assert [r['formula'] for r in results] == ['Nb2SiC', 'Ti3SiC2']
+    assert results[1]['pred_bulk_modulus'] == 70.0
+
+
+@pytest.mark.parametrize('body', [{'formulas': []}, {'formulas': 'Nb2SiC'}, {'formulas': ['Nb2SiC', 'Xx9']},
+                                  {'formulas': ['Nb2SiC', 7]}, {'formula': ['Nb2SiC']}])
+def test_bad_requests_are_rejected(service, body):
+    scorer, address = service
+    status, reply = post(address, body)
+    assert status == 400 and 'error' in reply
+    assert scorer.calls == []
+    # and the service keeps answering
+    assert post(address, {'formulas': ['Nb2SiC']})[0] == 200
+
+
+def test_empty_submit_does_not_reach_the_scorer():
+    scorer = FakeScorer()
+    batcher = MicroBatcher(scorer)
+    assert batcher.submit([]) == []
+    assert batcher.submit(['V2PC']) == [{'formula': 'V2PC', 'pred_bulk_modulus': 40.0, 'pred_density': 4.0,
+                                         'stability': 4.0, 'specific_stiffness': 10.0}]
+    assert scorer.calls == [['V2PC']]
+
+
+def test_concurrent_requests_are_batched():
+    scorer = FakeScorer()
+    batcher = MicroBatcher(scorer, max_latency=0.2)
+    formulas = [f"Ti{i + 2}AlC" for i in range(16)]
+    results = [None] * len(formulas)
+
+    def submit(i):
+        results[i] = batcher.submit([formulas[i]])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(formulas))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [r[0]['formula'] for r in results] == formulas
+    assert len(scorer.calls) < len(formulas)
+    assert sorted(f for batch in scorer.calls for f in batch) == sorted(formulas)
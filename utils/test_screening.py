@@ -0,0 +1,146 @@
+# Streaming screen against scoring the whole space at once, the parallel and
+# feature cache paths against the serial one, and checkpoint resume/rejection
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.composition import CompositionTable
+from utils.feature_cache import FeatureCache
+from utils.magpie import MagpieFeaturizer
+from utils.parallel import screen_parallel
+from utils.screening import CandidateSpace, model_feature_labels, model_fingerprint, score_chunk, screen
+
+pytest.importorskip('matminer')
+pytest.importorskip('sklearn')
+
+LABELS = ['MagpieData mean Number', 'MagpieData range Electronegativity', 'MagpieData mode MeltingT',
+          'MagpieData avg_dev CovalentRadius', 'MagpieData maximum GSvolume_pa', 'MagpieData mean Row']
+THRESHOLD = 50
+
+
+@pytest.fixture(scope='module')
+def setup(tmp_path_factory):
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor #type: ignore
+
+    space = CandidateSpace(['Ti', 'V', 'Cr', 'Nb', 'Mo', 'Ta'], ['Al', 'Si', 'Ga', 'Sn'], ['C', 'N'],
+                           fractions=[0.5])
+    featurizer = MagpieFeaturizer(labels=LABELS)
+    X = pd.DataFrame(featurizer.featurize_many(space.formulas(np.arange(len(space)))), columns=LABELS)
+    rng = np.random.default_rng(0)
+    y = np.column_stack([X.iloc[:, 0] * 3 + rng.normal(0, 5, len(X)) + 100, X.iloc[:, 4] / 3 + 4])
+    stable = X.iloc[:, 1] + rng.normal(0, 0.2, len(X)) < X.iloc[:, 1].median()
+    model = RandomForestRegressor(n_estimators=8, max_depth=6, random_state=0).fit(X, y)
+    clf = RandomForestClassifier(n_estimators=8, max_depth=4, random_state=0).fit(X, stable)
+
+    directory = tmp_path_factory.mktemp('models')
+    reg_path, clf_path = str(directory / 'regressor.joblib'), str(directory / 'stability.joblib')
+    joblib.dump(model, reg_path)
+    joblib.dump(clf, clf_path)
+    return {'space': space, 'featurizer': featurizer, 'model': model, 'clf': clf,
+            'reg_path': reg_path, 'clf_path': clf_path}
+
+
+def brute_force(setup):
+    # every candidate featurized and scored in one block, stable ones by specific stiffness
+    space = setup['space']
+    features = setup['featurizer'].featurize_padded(*space.padded(0, len(space)))
+    values = score_chunk(features, setup['model'], setup['clf'], LABELS)
+    stable = values['stability'] > THRESHOLD
+    df = pd.DataFrame({'formula': space.formulas(np.flatnonzero(stable)),
+                       **{col: v[stable] for col, v in values.items()}})
+    return df.sort_values('specific_stiffness', ascending=False, ignore_index=True)
+
+
+def assert_same_screen(df, expected):
+    # forests tie often, so rows are compared as sets and the scores in order
+    assert sorted(df['formula']) == sorted(expected['formula'])
+    np.testing.assert_array_equal(df['specific_stiffness'], expected['specific_stiffness'])
+    merged = df.merge(expected, on='formula', suffixes=('', '_expected'))
+    for col in ['pred_bulk_modulus', 'pred_density', 'stability']:
+        np.testing.assert_array_equal(merged[col], merged[f"{col}_expected"])
+
+
+def test_score_chunk_matches_sklearn(setup):
+    X = pd.DataFrame(setup['featurizer'].featurize_padded(*setup['space'].padded(0, 100)), columns=LABELS)
+    values = score_chunk(X.to_numpy(), setup['model'], setup['clf'], LABELS)
+    predictions = setup['model'].predict(X)
+    np.testing.assert_array_equal(values['pred_bulk_modulus'], predictions[:, 0])
+    np.testing.assert_array_equal(values['pred_density'], predictions[:, 1])
+    np.testing.assert_array_equal(values['stability'], setup['clf'].predict_proba(X)[:, 1] * 100)
+    assert model_feature_labels(setup['model']) == LABELS
+
+
+def test_screen_matches_brute_force(setup):
+    expected = brute_force(setup)
+    assert 0 < len(expected) < len(setup['space'])
+    df = screen(setup['space'], setup['featurizer'], setup['model'], setup['clf'], THRESHOLD,
+                top_k=len(setup['space']), chunk_size=97)
+    assert_same_screen(df, expected)
+
+    top = screen(setup['space'], setup['featurizer'], setup['model'], setup['clf'], THRESHOLD,
+                 top_k=25, chunk_size=97)
+    np.testing.assert_array_equal(top['specific_stiffness'], expected['specific_stiffness'][:25])
+
+
+def test_feature_cache_screen_matches(setup, tmp_path):
+    cache = FeatureCache(setup['featurizer'], cache_dir=str(tmp_path), table=CompositionTable())
+    expected = brute_force(setup)
+    for _ in range(2):   # cold, then warm
+        df = screen(setup['space'], cache, setup['model'], setup['clf'], THRESHOLD,
+                    top_k=len(setup['space']), chunk_size=97)
+        assert_same_screen(df, expected)
+    assert cache.hits == len(setup['space'])
+
+
+def test_parallel_matches_serial(setup):
+    expected = brute_force(setup)
+    df = screen_parallel(setup['space'], setup['reg_path'], setup['clf_path'], n_workers=2,
+                         stability_threshold=THRESHOLD, top_k=len(setup['space']), chunk_size=97)
+    assert_same_screen(df, expected)
+
+
+def test_checkpoint_resumes_and_rejects_other_settings(setup, tmp_path):
+    space = setup['space']
+    checkpoint = str(tmp_path / 'screen.npz')
+    models = model_fingerprint(setup['reg_path'], setup['clf_path'])
+
+    def run(threshold=THRESHOLD, fingerprint=models):
+        return screen(space, setup['featurizer'], setup['model'], setup['clf'], threshold,
+                      top_k=len(space), chunk_size=97, checkpoint_path=checkpoint, models=fingerprint)
+
+    class Interrupted(MagpieFeaturizer):
+        calls = 0
+
+        def featurize_padded(self, idx, amounts):
+            Interrupted.calls += 1
+            if Interrupted.calls == 4:
+                raise KeyboardInterrupt
+            return super().featurize_padded(idx, amounts)
+
+    with pytest.raises(KeyboardInterrupt):
+        screen(space, Interrupted(labels=LABELS), setup['model'], setup['clf'], THRESHOLD,
+               top_k=len(space), chunk_size=97, checkpoint_path=checkpoint, models=models)
+    # three chunks are in the checkpoint, the rest is screened on resume
+    assert_same_screen(run(), brute_force(setup))
+
+    with pytest.raises(ValueError, match='threshold'):
+        run(threshold=THRESHOLD + 10)
+    with pytest.raises(ValueError, match='other models'):
+        run(fingerprint='0' * 16)
+    with pytest.raises(ValueError, match='search space'):
+        screen(CandidateSpace(['Ti'], ['Al'], ['C']), setup['featurizer'], setup['model'], setup['clf'],
+               THRESHOLD, top_k=len(space), checkpoint_path=checkpoint, models=models)
+
+
+def test_model_fingerprint_follows_contents(setup, tmp_path):
+    path = str(tmp_path / 'regressor.joblib')
+    joblib.dump(setup['model'], path)
+    before = model_fingerprint(path, setup['clf_path'])
+    assert model_fingerprint(path, setup['clf_path']) == before
+    joblib.dump(setup['clf'], path)
+    assert model_fingerprint(path, setup['clf_path']) != before
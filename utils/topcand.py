@@ -1,4 +1,5 @@
 # Top Candidate: Nb2SiC
+import os
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
@@ -30,4 +31,4 @@ plt.ylabel("Specific Stiffness (GPa / g/cm³)", fontsize=12)
 plt.xlabel("")
 plt.xticks(rotation=15)
 plt.tight_layout()
-plt.savefig('../figures/topcand.png')
\ No newline at end of file
+plt.savefig(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'figures', 'topcand.png'))
\ No newline at end of file
@@ -1,10 +1,22 @@
 # this script visualizes our novel discovered materials on the pareto plot
+import argparse
 import os
+import sys
 import pandas as pd
-import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.pareto import pareto_optimality_score
+from utils.plotting import PLOT_MODES, cached_pareto_front, draw_population, place_labels, resolve_mode
+
+parser = argparse.ArgumentParser(description="Plot the novel candidates against the known materials.")
+parser.add_argument('--mode', choices=PLOT_MODES, default='auto',
+                    help="draw materials and candidates as points, or binned (hexbin, raster) for large tables")
+parser.add_argument('--max-labels', type=int, default=20,
+                    help="most top candidates to mark and label in the binned modes (scatter marks all of them)")
+args = parser.parse_args()
+
 # Get paths relative to this script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(script_dir)
@@ -26,44 +38,35 @@ except FileNotFoundError:
     raise SystemExit(1)
 
 # Calculate the Pareto Front
-densities = df.sort_values('density')
-pareto_boundary = []
-max_stiffness = -1.0
-
-for _, row in densities.iterrows():
-    if row['bulk_modulus'] > max_stiffness:
-        pareto_boundary.append(row)
-        max_stiffness = row['bulk_modulus']
-
-pareto_df = pd.DataFrame(pareto_boundary)
+pareto_df = cached_pareto_front(df)
 
 # Calculate how close each candidate is to the Pareto Front
-def get_pareto_optimality_score(candidate_row, pareto_df):
-    # Find the max stiffness for the candidate's density on the red line
-    # We interpolate the red line to find the "Limit" at exactly this density
-    limit_at_density = np.interp(candidate_row['pred_density'], pareto_df['density'], pareto_df['bulk_modulus'])
-    
+def get_pareto_optimality_score(candidates, pareto_df):
+    # Find the max stiffness at each candidate's density on the red line
+    # by interpolating the red line, for the whole table at once
     # Score = (Our Stiffness) / (Theoretical Max Stiffness at this density)
-    return (candidate_row['pred_bulk_modulus'] / limit_at_density) * 100
+    return pareto_optimality_score(candidates, pareto_df)
 
 # Calculate and print optimality scores
 print("\n--- OPTIMALITY SCORE (How close to perfection?) ---")
+top10['optimality'] = get_pareto_optimality_score(top10, pareto_df)
 top_candidates = top10.head(10)  # Get top 10 for scoring
-for i, row in top_candidates.iterrows():
-    score = get_pareto_optimality_score(row, pareto_df)
-    print(f"{row['formula']}: {score:.1f}% of the Theoretical Limit")
+for formula, score in zip(top_candidates['formula'], top_candidates['optimality']):
+    print(f"{formula}: {score:.1f}% of the Theoretical Limit")
 print()
 
 # Plot the Data
 plt.figure(figsize=(12, 8))
 sns.set_style("whitegrid")
+ax = plt.gca()
 
 # Existing Data
-plt.scatter(
+draw_population(
+    ax,
     df['density'],
     df['bulk_modulus'], 
+    args.mode,
     alpha=0.15,
-    color='slategrey',
     s=15,
     label='Existing Database'
 )
@@ -79,10 +82,22 @@ plt.plot(
     label='Pareto Front (Curr. Eff. Limit)'
 )
 
-# Novel Candidates
+# Novel Candidates, binned too when there are many, with only the best marked
+binned = resolve_mode(args.mode, len(top10)) != 'scatter'
+if binned:
+    draw_population(
+        ax,
+        top10['pred_density'],
+        top10['pred_bulk_modulus'],
+        args.mode,
+        color='gold',
+        cmap='YlOrBr',
+        label='Candidates'
+    )
+marked = top10.head(args.max_labels) if binned else top10
 plt.scatter(
-    top10['pred_density'],
-    top10['pred_bulk_modulus'], 
+    marked['pred_density'],
+    marked['pred_bulk_modulus'], 
     color='gold',
     marker='*',
     s=300,
@@ -92,16 +107,30 @@ plt.scatter(
     zorder=10
 )
 
-for _, row in top10.sort_values('pred_density').iterrows():
-    label = f"{row['formula']}"
-    plt.text(
-        row['pred_density'] + 0.1,
-        row['pred_bulk_modulus'], 
-        label,
+if binned:
+    # labels on the starred candidates only, in order of specific stiffness,
+    # skipping ones that would overlap
+    place_labels(
+        ax,
+        marked['pred_density'],
+        marked['pred_bulk_modulus'], 
+        marked['formula'],
+        max_labels=args.max_labels,
         fontsize=10,
         fontweight='bold',
         color='darkgoldenrod'
     )
+else:
+    for _, row in top10.sort_values('pred_density').iterrows():
+        label = f"{row['formula']}"
+        plt.text(
+            row['pred_density'] + 0.1,
+            row['pred_bulk_modulus'], 
+            label,
+            fontsize=10,
+            fontweight='bold',
+            color='darkgoldenrod'
+        )
 
 plt.title("Material Discovery: Novel Candidates vs. Known Materials", fontsize=16, fontweight='bold')
 plt.xlabel('Density (g/cm³)', fontsize=12)